@@ -2,6 +2,7 @@ from fastapi import APIRouter
 
 from . import (
     bonds,
+    metrics,
     notifications,
     stocks
 )
@@ -16,3 +17,5 @@ router.include_router(notifications.router,
 router.include_router(stocks.router,
                       prefix='/stocks',
                       tags=['stocks'], )
+router.include_router(metrics.router,
+                      tags=['metrics'], )
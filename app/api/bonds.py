@@ -1,7 +1,7 @@
 from fastapi import (APIRouter, status)
 
+from app.api.responses import validated_response
 from app.models.models import BondsRs, BondFilter
-from app.services.bonds import Bonds
 
 router = APIRouter()
 
@@ -14,7 +14,9 @@ router = APIRouter()
             response_model_by_alias=False,
             tags=["bonds"])
 async def get_bonds():
+    # pandas and MOEX client are imported on the first request, workers serving other routes do not load them
+    from app.services.bonds import Bonds
     default_filter = BondFilter()
     bonds = Bonds(bonds_filter=default_filter)
     bonds_list = await bonds.list()
-    return bonds_list
+    return validated_response(bonds_list, exclude_none=True, exclude_unset=True, by_alias=False)
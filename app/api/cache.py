@@ -0,0 +1,91 @@
+import hashlib
+from typing import List, Optional
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import settings
+from app.db.response_cache import ResponseCache
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+class ResponseCacheMiddleware:
+    """
+    Cache 200 responses of GET routes listed in `http_cache_routes` (route path -> ttl and max_age, seconds). \n
+    Responses are sent with ETag and Cache-Control: public for shared routes, private for routes with chatId,
+    `no-cache` if max_age is 0 so clients revalidate. Requests with matching If-None-Match get 304,
+    cached responses are served without running the route. Responses sent by the route with
+    `Cache-Control: no-store` (degraded results) are not cached
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.cache = ResponseCache()
+
+    @staticmethod
+    def get_route(scope: Scope) -> Optional[dict]:
+        """
+        :return: cache settings of the route which handles the request
+        """
+        for route in scope['app'].routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return settings.http_cache_routes.get(getattr(route, 'path', None))
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        route = None
+        if scope['type'] == 'http' and scope['method'] == 'GET' and settings.http_cache_enabled:
+            route = self.get_route(scope)
+        if route is None:
+            await self.app(scope, receive, send)
+            return
+
+        query = parse_qsl(scope['query_string'].decode('latin-1'), keep_blank_values=True)
+        chat_id = dict(query).get('chatId')
+        key = ResponseCache.get_entry_key(scope['path'], query, chat_id)
+        entry = await self.cache.get(key)
+        if entry is None:
+            messages = await self.run_route(scope, receive)
+            cache_control = Headers(raw=messages[0]['headers']).get('cache-control', '')
+            if messages[0]['status'] != 200 or 'no-store' in cache_control:
+                for message in messages:
+                    await send(message)
+                return
+            body = b''.join(message.get('body', b'') for message in messages[1:])
+            entry = {
+                'body': body.decode('utf-8'),
+                'etag': f'"{hashlib.sha1(body).hexdigest()}"',
+                'media_type': Headers(raw=messages[0]['headers']).get('content-type'),
+            }
+            await self.cache.save(key, entry, ttl=route['ttl'], chat_id=chat_id)
+
+        cache_control = 'private' if chat_id else 'public'
+        cache_control += f', max-age={route["max_age"]}' if route.get('max_age') else ', no-cache'
+        headers = {'etag': entry['etag'], 'cache-control': cache_control}
+        if etag_matches(Headers(scope=scope).get('if-none-match'), entry['etag']):
+            response = Response(status_code=304, headers=headers)
+        else:
+            response = Response(entry['body'], headers=headers, media_type=entry['media_type'])
+        await response(scope, receive, send)
+
+    async def run_route(self, scope: Scope, receive: Receive) -> List[Message]:
+        """
+        Run the route and collect its response messages
+        """
+        messages: List[Message] = []
+
+        async def collect(message: Message):
+            messages.append(message)
+
+        await self.app(scope, receive, collect)
+        return messages
@@ -0,0 +1,62 @@
+import time
+from typing import Callable, Dict
+
+from fastapi import APIRouter
+from starlette.responses import PlainTextResponse
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core import settings
+from app.core.metrics import REQUEST_LATENCY
+from app.services.metrics import Metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """
+    Метрики процессов API и воркеров уведомлений в формате Prometheus
+    """
+    return PlainTextResponse(await Metrics.collect(), media_type='text/plain; version=0.0.4')
+
+
+class MetricsMiddleware:
+    """
+    Observe request latency by method, route path and status. Requests not matched by routes are
+    observed as `unmatched`, so paths do not make new series
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.paths: Dict[Callable, str] = {}
+
+    def get_route_path(self, scope: Scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint in self.paths:
+            return self.paths[endpoint]
+        for route in scope['app'].routes:
+            if route.matches(scope)[0] == Match.FULL:
+                if endpoint is not None:
+                    self.paths[endpoint] = route.path
+                return route.path
+        return 'unmatched'
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http' or not settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - started, scope['method'], self.get_route_path(scope),
+                                    str(status))
@@ -4,11 +4,13 @@ import logging
 from typing import List
 
 from fastapi import APIRouter, Query, Path
-from starlette.status import HTTP_200_OK, HTTP_201_CREATED
+from starlette.responses import Response
+from starlette.status import HTTP_200_OK, HTTP_201_CREATED, HTTP_204_NO_CONTENT
 
+from app.api.responses import validated_response
 from app.core.logging import setup_logging
 from app.models.models import StockPriceNotificationReadRs, StockPriceNotificationCreateRq, \
-    StockPriceNotificationReadRq, TelegramUser
+    StockPriceNotificationReadRq, TelegramUser, StockPriceNotificationDeleteRq
 from app.services.notification import NotificationStockPriceService
 
 setup_logging()
@@ -72,4 +74,44 @@ async def get_all_notification_by_chat_id(chatId: str = Query(...,
     logger.debug(f'Request to get_all_notification_stock_price_by_id with: '
                  f'chatId {chatId}')
     notification = NotificationStockPriceService()
-    return await notification.get_many(TelegramUser(chatId=chatId))
+    return validated_response(await notification.get_many(TelegramUser(chatId=chatId)), exclude_none=True)
+
+
+@router.delete("/{id}",
+               status_code=HTTP_204_NO_CONTENT,
+               )
+async def delete_notification_stock_price_by_id(id: str = Path(...,
+                                                               min_length=3,
+                                                               max_length=50,
+                                                               description='notification id',
+                                                               example='dcf1ae55-52c4-4017-8057-e6168b51773d'),
+                                                chatId: str = Query(...,
+                                                                    min_length=4,
+                                                                    max_length=12,
+                                                                    description='telegram chat (user) id',
+                                                                    example='411442889')):
+    """
+    Контролер для удаления уведомления о изменении цены акции
+    """
+    logger.debug(f'Request to delete_notification_stock_price_by_id with: '
+                 f'notification_id: {id}, chatId {chatId}')
+    notification = NotificationStockPriceService()
+    await notification.delete_one(StockPriceNotificationDeleteRq(id=id, chatId=chatId))
+    return Response(status_code=HTTP_204_NO_CONTENT)
+
+
+@router.delete("/",
+               status_code=HTTP_204_NO_CONTENT,
+               )
+async def delete_all_notification_by_chat_id(chatId: str = Query(...,
+                                                                 min_length=4,
+                                                                 max_length=12,
+                                                                 description='telegram chat (user) id',
+                                                                 example='411442889')):
+    """
+    Контролер для удаления всех уведомлений пользователя
+    """
+    logger.debug(f'Request to delete_all_notification_by_chat_id with: chatId {chatId}')
+    notification = NotificationStockPriceService()
+    await notification.delete_many(TelegramUser(chatId=chatId))
+    return Response(status_code=HTTP_204_NO_CONTENT)
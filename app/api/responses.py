@@ -0,0 +1,53 @@
+import json
+from typing import Any
+
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+from starlette.responses import JSONResponse
+
+from app.core import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response rendered by orjson if it is installed. Values orjson does not know (Decimal, timedelta, models)
+    are encoded as pydantic does
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, default=pydantic_encoder)
+        return json.dumps(content,
+                          default=pydantic_encoder,
+                          ensure_ascii=False,
+                          allow_nan=False,
+                          separators=(',', ':')).encode('utf-8')
+
+
+def validated_response(content: Any,
+                       status_code: int = 200,
+                       exclude_none: bool = False,
+                       exclude_unset: bool = False,
+                       by_alias: bool = True) -> Any:
+    """
+    Response for models already validated by the route: `response_model` validation
+    and `jsonable_encoder` pass are skipped. Options are the ones of the route `response_model_*`. \n
+    None (route failed) and any content with `api_skip_response_validation` disabled are returned as is,
+    so they go through the usual `response_model` path
+    """
+    if content is None or not settings.api_skip_response_validation:
+        return content
+
+    def dump(item: Any) -> Any:
+        if not isinstance(item, BaseModel):
+            return item
+        data = item.dict(exclude_none=exclude_none, exclude_unset=exclude_unset, by_alias=by_alias)
+        return data['__root__'] if item.__custom_root_type__ else data
+
+    body = [dump(item) for item in content] if isinstance(content, list) else dump(content)
+    return FastJSONResponse(body, status_code=status_code)
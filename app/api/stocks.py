@@ -1,10 +1,19 @@
 import logging
-from typing import List
+import math
+import re
+from datetime import datetime
+from typing import List, Optional
 
-from fastapi import (APIRouter, status, Path)
+from fastapi import (APIRouter, HTTPException, status, Path, Query)
+from starlette.responses import Response
 
+from app.api.responses import validated_response
+from app.core import settings
 from app.core.logging import setup_logging
-from app.models.models import StockRs, FindStockRq
+from app.db.history import PriceHistory, ohlc, lttb
+from app.models.models import (StockRs, FindStockRq, WarmUpProfilesRq, WarmUpProfilesRs, QuoteRs,
+                               SecurityRs, PriceHistoryRs, YAHOO_SYMBOL_REGEX)
+from app.services.search import SecuritiesDirectory
 from app.services.stock import StockService
 
 router = APIRouter()
@@ -13,19 +22,122 @@ setup_logging()
 logger = logging.getLogger(__name__)
 
 
+@router.post("/profiles",
+             status_code=status.HTTP_200_OK,
+             response_model=WarmUpProfilesRs
+             )
+async def warm_up_profiles(request: WarmUpProfilesRq):
+    """
+    Контролер загрузки профилей акций в кэш
+    """
+    logger.debug(f'Request to warm_up_profiles with: {len(request.symbols)} symbols')
+    stock_service = StockService()
+    return WarmUpProfilesRs(cached=await stock_service.warm_up_profiles(request.symbols))
+
+
+@router.get("/search",
+            status_code=status.HTTP_200_OK,
+            response_model=List[SecurityRs]
+            )
+async def search_stocks(q: str = Query(...,
+                                       description="Ticker or name prefix, ticker with a typo",
+                                       min_length=1,
+                                       max_length=50,
+                                       example="MOE"),
+                        limit: int = Query(10, ge=1, le=50)):
+    """
+    Контролер поиска акций в справочнике
+    """
+    logger.debug(f'Request to search_stocks with: q {q}')
+    return [SecurityRs(ticker=security.ticker,
+                       name=security.name,
+                       yahoo_search_symbol=security.yahoo_symbol,
+                       exchange=security.exchange)
+            for security in SecuritiesDirectory.search(q, limit=limit)]
+
+
+@router.get("/quotes",
+            response_model_exclude_none=True,
+            status_code=status.HTTP_200_OK,
+            response_model=List[QuoteRs]
+            )
+async def get_quotes(symbols: List[str] = Query(...,
+                                                description="YahooFinance search symbols",
+                                                example=["MOEX.ME", "AAPL"])):
+    """
+    Контролер получения последних цен списка акций
+    """
+    logger.debug(f'Request to get_quotes with: {len(symbols)} symbols')
+    if len(symbols) > settings.stock_quotes_max_symbols:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'No more than {settings.stock_quotes_max_symbols} symbols')
+    invalid = [symbol for symbol in symbols if not re.fullmatch(YAHOO_SYMBOL_REGEX, symbol)]
+    if invalid:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'Invalid YahooFinance symbols: {invalid[:10]}')
+    stock_service = StockService()
+    return validated_response(await stock_service.get_quotes(symbols), exclude_none=True)
+
+
 @router.get("/{ticker}",
             response_model_exclude_none=True,
             status_code=status.HTTP_200_OK,
             response_model=List[StockRs]
             )
-async def get_stocks_by_ticker(ticker: str = Path(...,
+async def get_stocks_by_ticker(response: Response,
+                               ticker: str = Path(...,
                                                   description="Stock ticker",
                                                   min_length=1,
                                                   max_length=5,
-                                                  example="MOEX")):
+                                                  example="MOEX"),
+                               first: bool = Query(False,
+                                                   description="Return the first found exchange "
+                                                               "without waiting for others")):
     """
     Контролер поиска акции по тикеру
     """
     logger.debug(f'Request to get_stocks_by_ticker with: ticker {ticker}')
     stock_service = StockService()
-    return await stock_service.find_stocks_by_ticker(FindStockRq(ticker=ticker))
+    stocks = await stock_service.find_stocks_by_ticker(FindStockRq(ticker=ticker), first_hit=first)
+    if stock_service.degraded and not stocks:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Exchanges are not answered, retry later',
+                            headers={'Retry-After': str(math.ceil(settings.yahoo_lookup_budget))})
+    content = validated_response(stocks, exclude_none=True)
+    if stock_service.degraded:
+        # some exchanges did not answer, partial results are not cached
+        (content if isinstance(content, Response) else response).headers['cache-control'] = 'no-store'
+    return content
+
+
+@router.get("/{symbol}/history",
+            response_model_exclude_none=True,
+            status_code=status.HTTP_200_OK,
+            response_model=PriceHistoryRs
+            )
+async def get_price_history(symbol: str = Path(...,
+                                               description="YahooFinance search symbol",
+                                               regex=YAHOO_SYMBOL_REGEX,
+                                               example="MOEX.ME"),
+                            start: Optional[datetime] = Query(None, description="Range start"),
+                            end: Optional[datetime] = Query(None, description="Range end, excluded"),
+                            interval: Optional[int] = Query(None,
+                                                            ge=1,
+                                                            description="OHLC bucket, seconds. "
+                                                                        "Without it points are downsampled by LTTB"),
+                            points: int = Query(settings.history_max_points,
+                                                ge=3,
+                                                le=settings.history_max_points,
+                                                description="Max number of LTTB points")):
+    """
+    Контролер получения истории цен акции
+    """
+    logger.debug(f'Request to get_price_history with: symbol {symbol}, interval {interval}')
+    records = PriceHistory.read(symbol,
+                                start=start.timestamp() if start else None,
+                                end=end.timestamp() if end else None)
+    columns = ohlc(records, interval) if interval else lttb(records, points)
+    if len(columns['t']) > settings.history_max_points:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                            detail=f'More than {settings.history_max_points} buckets, increase interval')
+    return PriceHistoryRs(symbol=symbol, **{name: column.tolist() for name, column in columns.items()})
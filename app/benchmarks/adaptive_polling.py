@@ -0,0 +1,98 @@
+"""
+Replay a price series through fixed and adaptive polling and report upstream calls. \n
+Usage: python -m app.benchmarks.adaptive_polling [--series prices.csv] [--delay 60]
+CSV rows: unix timestamp, price. Without --series a seeded random walk is used.
+"""
+import argparse
+import bisect
+import csv
+import math
+import random
+from typing import List, Optional, Tuple
+
+from app.services.polling import AdaptivePolling
+
+Series = List[Tuple[float, float]]
+
+
+def load_series(path: str) -> Series:
+    series = []
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            try:
+                series.append((float(row[0]), float(row[1])))
+            except (ValueError, IndexError):
+                continue
+    return sorted(series)
+
+
+def random_walk(days: int = 5, step: int = 10, daily_volatility: float = 0.02, seed: int = 42) -> Series:
+    """
+    Seeded geometric random walk with a price point every `step` seconds of an 8.5h session
+    """
+    rnd = random.Random(seed)
+    steps_per_day = int(8.5 * 3600 / step)
+    sigma = daily_volatility / math.sqrt(steps_per_day)
+    price, series = 100.0, []
+    for i in range(days * steps_per_day):
+        series.append((float(i * step), price))
+        price *= math.exp(rnd.gauss(0, sigma))
+    return series
+
+
+def price_at(series: Series, timestamps: List[float], t: float) -> float:
+    return series[max(bisect.bisect_right(timestamps, t) - 1, 0)][1]
+
+
+def is_reached(price: float, target: float, sell: bool) -> bool:
+    return price >= target if sell else price <= target
+
+
+def simulate(series: Series, delay: int, target: float, sell: bool, adaptive: bool) -> Tuple[int, Optional[float]]:
+    """
+    :return: upstream calls and time when target was detected (None if not reached)
+    """
+    timestamps = [t for t, _ in series]
+    t, end = series[0][0], series[-1][0]
+    policy = AdaptivePolling(delay=delay)
+    calls = 0
+    while t <= end:
+        price = price_at(series, timestamps, t)
+        calls += 1
+        if is_reached(price, target, sell):
+            return calls, t - series[0][0]
+        interval = delay
+        if adaptive:
+            policy.observe(price, t)
+            interval = policy.next_interval(price, target)
+        t += interval
+    return calls, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--series', help='csv with timestamp,price rows')
+    parser.add_argument('--delay', type=int, default=60)
+    args = parser.parse_args()
+
+    series = load_series(args.series) if args.series else random_walk()
+    start = series[0][1]
+    print(f'{len(series)} prices, {(series[-1][0] - series[0][0]) / 3600:.1f}h, delay {args.delay}s')
+    print(f'{"target":>8} {"fixed":>7} {"adaptive":>8} {"saved":>6} {"fixed hit":>10} {"adaptive hit":>12}')
+    total_fixed = total_adaptive = 0
+    for move in (0.01, 0.03, 0.05, 0.1, 0.2, 0.4, -0.01, -0.03, -0.05, -0.1, -0.2, -0.4):
+        target = start * (1 + move)
+        fixed_calls, fixed_hit = simulate(series, args.delay, target, move > 0, adaptive=False)
+        adaptive_calls, adaptive_hit = simulate(series, args.delay, target, move > 0, adaptive=True)
+        total_fixed += fixed_calls
+        total_adaptive += adaptive_calls
+        saved = 1 - adaptive_calls / fixed_calls
+        print(f'{move:>+8.0%} {fixed_calls:>7} {adaptive_calls:>8} {saved:>6.0%} '
+              f'{"-" if fixed_hit is None else f"{fixed_hit:.0f}s":>10} '
+              f'{"-" if adaptive_hit is None else f"{adaptive_hit:.0f}s":>12}')
+    print(f'total upstream calls: fixed {total_fixed}, adaptive {total_adaptive}, '
+          f'reduction {1 - total_adaptive / total_fixed:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Requests/sec of hot API routes by response path. \n
+Usage: python -m app.benchmarks.api_throughput [--requests 2000] [--concurrency 20] [--bonds 300] [--notifications 50]
+Routes are called in-process (no sockets between client and app) against a Redis stand-in and a fake
+YahooFinance server, so the numbers are the cost of the app itself: route, services, validation and rendering.
+Response paths:
+ - json: `response_model` validation, `jsonable_encoder` and json rendering (the FastAPI default)
+ - orjson: the same validation, orjson rendering
+ - orjson+bypass: models returned by routes are dumped once and rendered by orjson (`api_skip_response_validation`)
+ - cached: orjson+bypass behind the HTTP response cache, routes run once per cache ttl
+ - revalidated: cached, requests with If-None-Match get 304 without body
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.benchmarks.loadtest import flush
+from app.tests.stubs import FakeYahooServer, RedisStandIn
+
+CHAT_ID = '411442889'
+
+
+def bond(i: int) -> dict:
+    now = datetime.now()
+    return {
+        'isin': f'RU000A{i:06d}',
+        'name': f'Облигация БО-{i:03d}',
+        'couponAmount': 17.01 + i % 10,
+        'accumulatedCouponYield': 3.2,
+        'couponPeriod': 182,
+        'couponPercent': 6.75,
+        'price': 92.75 + i % 7,
+        'nextCouponDate': (now + timedelta(days=90)).isoformat(),
+        'expiredDate': (now + timedelta(days=182 + i)).isoformat(),
+        'yieldToOffer': 6.3471,
+        'effectiveYield': 6.4,
+    }
+
+
+async def seed(client, bonds: int, notifications: int):
+    from app.core import settings
+    from app.db.redis_pub import Redis
+
+    await Redis().save_cache([bond(i) for i in range(bonds)],
+                             collection_key=settings.redis_bonds_list_cache_key,
+                             ttl_per_sec=3600)
+    for i in range(notifications):
+        ticker = f'S{i:04d}'
+        r = await client.post('/notification/', json={
+            'ticker': ticker,
+            'exchange': {'code': 'MCX', 'name': 'MCX', 'yahoo_search_symbol': f'{ticker}.ME'},
+            'targetPrice': 100000,
+            'action': 'Sell',
+            'delay': 60,
+            'chatId': CHAT_ID,
+        })
+        r.raise_for_status()
+    # stock listing, profile and price get cached by the first lookup
+    (await client.get('/stocks/MOEX')).raise_for_status()
+
+
+async def measure(client, url: str, requests: int, concurrency: int, headers: Optional[dict] = None) -> float:
+    """
+    :return: requests per second
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+
+    async def call():
+        nonlocal failed
+        async with semaphore:
+            r = await client.get(url, headers=headers)
+            if r.status_code not in (200, 304):
+                failed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[call() for _ in range(requests)])
+    elapsed = time.perf_counter() - started
+    if failed:
+        print(f'  {failed} requests to {url} failed')
+    return requests / elapsed
+
+
+async def run(args, redis: RedisStandIn) -> List[dict]:
+    yahoo = FakeYahooServer(latency=0).start_in_thread()
+    os.environ['REDIS_HOST'], os.environ['REDIS_PORT'] = redis.host, str(redis.port)
+    os.environ['YAHOO_BASE_URL'] = yahoo.base_url
+    os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+    os.environ.setdefault('TELEGRAM_CHAT_ID', 'benchmark')
+    # measured load is not throttled: notifications are created in bursts of one chat
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    import httpx
+    from app.api import responses
+    from app.core import settings
+    from app.db.redis_pub import Redis
+    from app.main import app
+    from app.services.stock import StockService
+    logging.disable(logging.ERROR)
+
+    urls = {'/bonds/': '/bonds/', '/notification/': f'/notification/?chatId={CHAT_ID}', '/stocks/MOEX': '/stocks/MOEX'}
+    variants = [('json', None, False, False), ('orjson', responses.orjson, False, False),
+                ('orjson+bypass', responses.orjson, True, False), ('cached', responses.orjson, True, True),
+                ('revalidated', responses.orjson, True, True)]
+    if responses.orjson is None:
+        print('orjson is not installed, orjson variants render with json')
+    rows = []
+    await flush(redis.host, redis.port)
+    try:
+        async with httpx.AsyncClient(app=app, base_url='http://benchmark') as client:
+            await seed(client, args.bonds, args.notifications)
+            for name, orjson, skip_validation, cache in variants:
+                responses.orjson, settings.api_skip_response_validation = orjson, skip_validation
+                settings.http_cache_enabled = cache
+                row = {'name': name}
+                for route, url in urls.items():
+                    await measure(client, url, args.requests // 10, args.concurrency)
+                    etag = (await client.get(url)).headers.get('etag') if name == 'revalidated' else None
+                    headers = {'if-none-match': etag} if etag else None
+                    row[route] = await measure(client, url, args.requests, args.concurrency, headers)
+                rows.append(row)
+        await StockService.close_client()
+        await Redis.close_pool()
+    finally:
+        yahoo.stop_thread()
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Requests/sec of hot API routes by response path')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route and response path')
+    parser.add_argument('--concurrency', type=int, default=20, help='parallel requests')
+    parser.add_argument('--bonds', type=int, default=300, help='bonds in cached list')
+    parser.add_argument('--notifications', type=int, default=50, help='notifications of the chat')
+    args = parser.parse_args(argv)
+
+    redis = RedisStandIn().start()
+    try:
+        rows = asyncio.run(run(args, redis))
+    finally:
+        redis.stop()
+    routes = [route for route in rows[0] if route != 'name']
+    print(f'{"response":>14} ' + ' '.join(f'{route:>16}' for route in routes) + '   (requests/sec)')
+    for r in rows:
+        print(f'{r["name"]:>14} ' + ' '.join(f'{r[route]:>16.0f}' for route in routes))
+    for route in routes:
+        print(f'{route}: ' + ', '.join(f'{r["name"]} x{r[route] / rows[0][route]:.2f}' for r in rows[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+API worker cold start: import time and memory of a fresh interpreter importing the app. \n
+Usage: python -m app.benchmarks.cold_start [--runs 5] [--top 15]
+Every run is a new process started with `-X importtime`, so nothing is cached between runs except OS file cache.
+Variants:
+ - app.main: what a worker imports before serving the first request
+ - app.main + bonds: the same plus the bonds stack (pandas, apimoex, requests) loaded by the first /bonds/ request
+The process runs in a temporary directory with `core/` and LOG_CFG set, as workers do with the logging config file.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+HEAVY_MODULES = ('pandas', 'apimoex', 'requests', 'apscheduler', 'transitions', 'numpy', 'yaml')
+
+CHILD = """
+import importlib, json, resource, sys, time
+started = time.perf_counter()
+for name in sys.argv[1:]:
+    importlib.import_module(name)
+print(json.dumps({'seconds': time.perf_counter() - started,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def parse_importtime(output: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Parse `-X importtime` report
+    :return: module -> self and cumulative import time, microseconds
+    """
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if self_us.strip().isdigit():
+            modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_import(modules: List[str], cwd: Optional[str] = None) -> dict:
+    """
+    Import modules in a new interpreter
+    :return: seconds, rss_mb and importtime report `modules`
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [root, os.environ.get('PYTHONPATH')]))}
+    env.setdefault('TELEGRAM_TOKEN', 'benchmark')
+    env.setdefault('TELEGRAM_CHAT_ID', 'benchmark')
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD, *modules],
+                             cwd=cwd, env=env, capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['modules'] = parse_importtime(process.stderr)
+    return result
+
+
+def run_variant(modules: List[str], runs: int, cwd: str) -> dict:
+    results = [measure_import(modules, cwd=cwd) for _ in range(runs)]
+    return {
+        'seconds': median(r['seconds'] for r in results),
+        'rss_mb': median(r['rss_mb'] for r in results),
+        'modules': results[-1]['modules'],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='API worker import time and memory')
+    parser.add_argument('--runs', type=int, default=5, help='processes per variant, median is reported')
+    parser.add_argument('--top', type=int, default=15, help='slowest top level imports to list')
+    args = parser.parse_args(argv)
+
+    log_cfg = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'core', 'logging.yaml')
+    os.environ.setdefault('LOG_CFG', log_cfg)
+    variants = {'app.main': ['app.main'], 'app.main + bonds': ['app.main', 'app.services.bonds']}
+    with tempfile.TemporaryDirectory() as cwd:
+        os.makedirs(os.path.join(cwd, 'core'))
+        rows = {name: run_variant(modules, args.runs, cwd) for name, modules in variants.items()}
+
+    print(f'{"variant":>18} {"import ms":>10} {"rss MB":>7}  heavy modules loaded')
+    for name, row in rows.items():
+        heavy = ', '.join(module for module in HEAVY_MODULES if module in row['modules']) or '-'
+        print(f'{name:>18} {row["seconds"] * 1000:>10.0f} {row["rss_mb"]:>7.1f}  {heavy}')
+    print('Slowest imports of app.main (cumulative ms):')
+    modules = rows['app.main']['modules']
+    for name, (_, cumulative) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f'{cumulative / 1000:>10.1f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare connections opened to YahooFinance by a client per request and by the shared keep-alive client. \n
+Usage: python -m app.benchmarks.http_client [--lookups 100] [--latency 0.005]
+Every opened connection is a TCP (and TLS for real YahooFinance) handshake, the stand-in server counts them.
+Stand-in lists the ticker on every exchange, so cached exchanges of the ticker do not reduce requests.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+import httpx
+
+from app.tests.stubs import FakeYahooServer, RedisStandIn
+
+
+async def measure(name: str, service, yahoo: FakeYahooServer, lookups: int) -> dict:
+    from app.models.models import FindStockRq
+
+    connections, requests = yahoo.connections, yahoo.requests
+    durations = []
+    for _ in range(lookups):
+        started = time.perf_counter()
+        await service.find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+        durations.append(time.perf_counter() - started)
+    durations.sort()
+    return {
+        'name': name,
+        'requests': (yahoo.requests - requests) / lookups,
+        'handshakes': (yahoo.connections - connections) / lookups,
+        'lookup_ms': sum(durations) / lookups * 1000,
+        'p95_ms': durations[min(int(lookups * 0.95), lookups - 1)] * 1000,
+    }
+
+
+async def run(args, redis: RedisStandIn) -> List[dict]:
+    yahoo = FakeYahooServer(latency=args.latency).start_in_thread()
+    os.environ['REDIS_HOST'], os.environ['REDIS_PORT'] = redis.host, str(redis.port)
+    os.environ['YAHOO_BASE_URL'] = yahoo.base_url
+    os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+    os.environ.setdefault('TELEGRAM_CHAT_ID', 'benchmark')
+    from app.db.redis_pub import Redis
+    from app.services.stock import StockService
+    logging.disable(logging.ERROR)
+
+    class ClientPerRequestService(StockService):
+        @classmethod
+        async def fetch_data(cls, url: str, allow_not_found: bool = False, params: Optional[dict] = None):
+            try:
+                async with httpx.AsyncClient() as client:
+                    r = await client.get(url, params=params)
+                    if allow_not_found and r.status_code == httpx.codes.NOT_FOUND:
+                        return r.json()
+                    r.raise_for_status()
+                    return r.json()
+            except httpx.HTTPError:
+                return None
+
+    try:
+        rows = [await measure('client_per_request', ClientPerRequestService(), yahoo, args.lookups),
+                await measure('shared_client', StockService(), yahoo, args.lookups)]
+        await StockService.close_client()
+        await Redis.close_pool()
+    finally:
+        yahoo.stop_thread()
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='YahooFinance connections per stock lookup')
+    parser.add_argument('--lookups', type=int, default=100, help='find_stocks_by_ticker calls')
+    parser.add_argument('--latency', type=float, default=0.005, help='stand-in server latency, seconds')
+    args = parser.parse_args(argv)
+
+    redis = RedisStandIn().start()
+    try:
+        rows = asyncio.run(run(args, redis))
+    finally:
+        redis.stop()
+    print(f'{"client":>20} {"requests":>9} {"handshakes":>11} {"ms/lookup":>10} {"p95 ms":>8}')
+    for r in rows:
+        print(f'{r["name"]:>20} {r["requests"]:>9.2f} {r["handshakes"]:>11.2f} {r["lookup_ms"]:>10.2f} '
+              f'{r["p95_ms"]:>8.2f}')
+    avoided = rows[0]['handshakes'] - rows[1]['handshakes']
+    print(f'Handshakes avoided per lookup: {avoided:.2f} ({avoided / rows[0]["requests"]:.2f} per request)')
+
+
+if __name__ == '__main__':
+    main()
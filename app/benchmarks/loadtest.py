@@ -0,0 +1,285 @@
+"""
+Notification load test. \n
+Creates N notifications across M symbols through the /notification/ API, runs notification workers
+against a fake YahooFinance server and a Redis stand-in, then reports tick lateness percentiles,
+Redis ops/sec, upstream calls/sec, CPU and memory. \n
+Usage: python -m app.benchmarks.loadtest [--alerts 1000 10000 100000] [--symbols 500] [--duration 60]
+By default Redis is a fakeredis server in a child process, use --redis host:port to run against a real one.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.tests.stubs import FakeYahooServer, RedisStandIn
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)]
+
+
+def rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class TickRecorder:
+    """
+    Collect lateness of scheduled jobs from scheduler events
+    """
+
+    def __init__(self):
+        self.lateness: List[float] = []
+        self.missed = 0
+        self.skipped = 0
+        self.errors = 0
+
+    def listen(self, scheduler):
+        from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_ERROR
+
+        def on_event(event):
+            if event.code == EVENT_JOB_SUBMITTED:
+                now = datetime.now(scheduler.timezone)
+                self.lateness += [(now - t).total_seconds() for t in event.scheduled_run_times]
+            elif event.code == EVENT_JOB_MISSED:
+                self.missed += 1
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                self.skipped += 1
+            elif event.code == EVENT_JOB_ERROR:
+                self.errors += 1
+
+        scheduler.add_listener(on_event,
+                               EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_ERROR)
+
+
+async def create_notifications(alerts: int, symbols: int, delay: int, concurrency: int, deadline: float) -> float:
+    """
+    Create notifications through the API. Requests are not sent after the deadline (monotonic time),
+    requests in flight are completed instead of cancelled
+    :return: created notifications per second
+    :raise TimeoutError: if not all notifications are created before the deadline
+    """
+    import httpx
+    from app.main import app
+
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+    skipped = 0
+
+    async def create(client: httpx.AsyncClient, i: int):
+        nonlocal failed, skipped
+        ticker = f'S{i % symbols:04d}'
+        data = {
+            'ticker': ticker,
+            'exchange': {'code': 'MCX', 'name': 'MCX', 'yahoo_search_symbol': f'{ticker}.ME'},
+            'targetPrice': 100000,
+            'action': 'Sell',
+            'delay': delay,
+            'chatId': f'{10000 + i // 50}',
+        }
+        async with semaphore:
+            if time.monotonic() > deadline:
+                skipped += 1
+                return
+            try:
+                r = await client.post('/notification/', json=data)
+                if r.status_code != 201:
+                    failed += 1
+            except Exception:
+                failed += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(app=app, base_url='http://loadtest') as client:
+        await asyncio.gather(*[create(client, i) for i in range(alerts)])
+    elapsed = time.perf_counter() - started
+    if skipped:
+        raise TimeoutError(f'{alerts - skipped - failed} of {alerts} notifications created in {elapsed:.0f}s')
+    if failed:
+        print(f'  {failed} notifications were not created')
+    return alerts / elapsed
+
+
+async def run_workers(workers: int, duration: int, recorder: TickRecorder) -> Dict[str, int]:
+    """
+    Run notification workers for duration seconds
+    :return: number of running notifications per worker
+    """
+    from app.db.redis_pub import Redis
+    from app.services.notification_worker import NotificationWorker
+    from app.services.stock import YahooApiService
+
+    await Redis.init_pool()
+    pool = [NotificationWorker(worker_id=f'loadtest-{i}') for i in range(workers)]
+    for worker in pool:
+        recorder.listen(worker.scheduler)
+    tasks = [asyncio.create_task(worker.run()) for worker in pool]
+    try:
+        await asyncio.sleep(duration)
+        return {w.worker_id: sum(len(n) for n in w.notifications.values()) for w in pool}
+    finally:
+        for worker in pool:
+            worker.stop()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await YahooApiService.close_client()
+        await Redis.close_pool()
+
+
+async def flush(host: str, port: int):
+    """
+    Clean Redis and load lua scripts (fakeredis drops connection on NOSCRIPT reply)
+    """
+    import aioredis
+    from app.db import scripts
+
+    connection = await aioredis.create_redis(f'redis://{host}:{port}')
+    await connection.flushall()
+    for name in dir(scripts):
+        if name.isupper():
+            await connection.script_load(getattr(scripts, name))
+    connection.close()
+    await connection.wait_closed()
+
+
+async def run_size(alerts: int, args, yahoo: FakeYahooServer, redis: RedisStandIn) -> dict:
+    await flush(redis.host, redis.port)
+    started = time.perf_counter()
+    create_rate = await create_notifications(alerts, args.symbols, args.delay, args.concurrency,
+                                             deadline=time.monotonic() + args.size_timeout)
+    print(f'  created {alerts} notifications in {time.perf_counter() - started:.1f}s ({create_rate:.0f}/s)')
+
+    recorder = TickRecorder()
+    redis_before = redis.stats()
+    requests = yahoo.requests
+    cpu, thread_cpu = time.process_time(), time.thread_time()
+    started = time.perf_counter()
+    running = await run_workers(args.workers, args.duration, recorder)
+    elapsed = time.perf_counter() - started
+    cpu, thread_cpu = time.process_time() - cpu, time.thread_time() - thread_cpu
+    redis_after = redis.stats()
+    redis_stats = {name: redis_after[name] - redis_before[name] for name in ('commands', 'round_trips', 'connections')}
+
+    from app.db.redis_pub import Redis
+    print(f'  Redis pool: {Redis.pool_stats()}')
+    print(f'  Near cache: {Redis.near_cache_stats()}')
+
+    lateness = [t * 1000 for t in recorder.lateness]
+    return {
+        'alerts': alerts,
+        'running': sum(running.values()),
+        'ticks': len(lateness),
+        'p50': percentile(lateness, 50),
+        'p95': percentile(lateness, 95),
+        'p99': percentile(lateness, 99),
+        'max': max(lateness) if lateness else float('nan'),
+        'missed': recorder.missed + recorder.skipped,
+        'errors': recorder.errors,
+        'redis_ops': redis_stats['commands'] / elapsed,
+        'redis_round_trips': redis_stats['round_trips'] / elapsed,
+        'redis_conns': redis_stats['connections'] / elapsed,
+        'upstream': (yahoo.requests - requests) / elapsed,
+        'loop_cpu': thread_cpu / elapsed * 100,
+        'cpu': cpu / elapsed * 100,
+        'rss': rss_mb(),
+    }
+
+
+def print_header():
+    print(f'{"alerts":>8} {"running":>8} {"ticks":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>9} '
+          f'{"max ms":>9} {"missed":>7} {"errors":>7} {"redis/s":>9} {"rtt/s":>8} {"conn/s":>8} {"yahoo/s":>8} '
+          f'{"loop%":>6} {"cpu%":>6} {"rss MB":>7}', flush=True)
+
+
+def print_row(r: dict):
+    if r.get('failed'):
+        print(f'{r["alerts"]:>8} FAILED: {r["failed"]}', flush=True)
+        return
+    print(f'{r["alerts"]:>8} {r["running"]:>8} {r["ticks"]:>8} {r["p50"]:>8.1f} {r["p95"]:>8.1f} '
+          f'{r["p99"]:>9.1f} {r["max"]:>9.1f} {r["missed"]:>7} {r["errors"]:>7} {r["redis_ops"]:>9.0f} '
+          f'{r["redis_round_trips"]:>8.0f} {r["redis_conns"]:>8.0f} {r["upstream"]:>8.1f} {r["loop_cpu"]:>6.0f} '
+          f'{r["cpu"]:>6.0f} {r["rss"]:>7.0f}', flush=True)
+
+
+def print_report(rows: List[dict]):
+    print_header()
+    for r in rows:
+        print_row(r)
+
+
+async def run(args, redis: RedisStandIn) -> List[dict]:
+    yahoo = FakeYahooServer(latency=args.yahoo_latency, fail_rate=args.yahoo_fail_rate).start_in_thread()
+
+    # settings are read on import, so the stand-ins must be up before app modules are imported
+    os.environ['REDIS_HOST'], os.environ['REDIS_PORT'] = redis.host, str(redis.port)
+    os.environ['YAHOO_BASE_URL'] = yahoo.base_url
+    os.environ.setdefault('TELEGRAM_TOKEN', 'loadtest')
+    os.environ.setdefault('TELEGRAM_CHAT_ID', 'loadtest')
+    # measured load is not throttled: notifications are created in bursts of one chat
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    from app.core import settings
+    settings.notification_worker_heartbeat_interval = args.heartbeat
+    logging.disable(args.log_level)
+
+    rows = []
+    try:
+        for alerts in args.alerts:
+            print(f'Running {alerts} alerts, {args.symbols} symbols, {args.workers} workers, {args.duration}s..',
+                  flush=True)
+            try:
+                row = await run_size(alerts, args, yahoo, redis)
+            except Exception as err:
+                row = {'alerts': alerts, 'failed': repr(err)}
+            rows.append(row)
+            # rows are printed as sizes complete, so a later failed size does not lose them
+            print_header()
+            print_row(row)
+    finally:
+        yahoo.stop_thread()
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Notification load test')
+    parser.add_argument('--alerts', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--symbols', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=1, help='in-process notification workers')
+    parser.add_argument('--delay', type=int, default=60, help='notification delay, seconds')
+    parser.add_argument('--duration', type=int, default=150, help='measurement window, seconds')
+    parser.add_argument('--heartbeat', type=int, default=5, help='worker heartbeat interval, seconds')
+    parser.add_argument('--concurrency', type=int, default=20, help='parallel create requests')
+    parser.add_argument('--yahoo-latency', type=float, default=0.05, help='fake YahooFinance latency, seconds')
+    parser.add_argument('--yahoo-fail-rate', type=float, default=0.0)
+    parser.add_argument('--size-timeout', type=int, default=3600,
+                        help='seconds to create notifications of one size, the size is reported as failed after it')
+    parser.add_argument('--redis', help='host:port of Redis to use instead of fakeredis')
+    parser.add_argument('--log-level', type=int, default=logging.ERROR,
+                        help='disable app logs at this level and below, job errors are counted in the report')
+    args = parser.parse_args(argv)
+
+    upstream = None
+    if args.redis:
+        host, _, port = args.redis.partition(':')
+        upstream = (host, int(port or 6379))
+    redis = RedisStandIn(upstream).start()
+    try:
+        rows = asyncio.run(run(args, redis))
+        print('Summary:')
+        print_report(rows)
+    finally:
+        redis.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare Redis round trips of a notification price tick made of single-key calls, of batched calls
+and of field update of notification hash by Lua script. \n
+Usage: python -m app.benchmarks.redis_round_trips [--ticks 1000] [--latency 0.0005] [--redis host:port]
+Latency is added by the proxy once per round trip to emulate network between app and Redis.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional
+
+from app.db.scripts import UPDATE_NOTIFICATION_PRICE
+from app.tests.stubs import RedisStandIn
+
+NOTIFICATION = '{"id": "benchmark", "currentPrice": {"value": "171.73"}}'
+
+
+async def unbatched_tick(storage, notification_key: str, price_key: str):
+    await storage.get_cached(notification_key)
+    await storage.get_key_ttl(price_key)
+    await storage.get_cached(price_key)
+    await storage.save_cache(NOTIFICATION, collection_key=notification_key, ttl_per_sec=3600)
+
+
+async def batched_tick(storage, notification_key: str, price_key: str):
+    await storage.get_many_cached_with_ttl([notification_key, price_key])
+    await storage.save_many_cache({notification_key: (NOTIFICATION, 3600)})
+
+
+async def hash_tick(storage, notification_key: str, price_key: str):
+    await storage.get_cached_with_ttl(price_key)
+    await storage.run_script(UPDATE_NOTIFICATION_PRICE, keys=[notification_key], args=['171.73', '150', 'Buy'])
+
+
+async def measure(tick, storage, redis: RedisStandIn, ticks: int) -> dict:
+    before = redis.stats()
+    started = time.perf_counter()
+    for i in range(ticks):
+        await tick(storage, f'notification:benchmark:{i % 100}', f'stock:price:S{i % 10}.ME')
+    elapsed = time.perf_counter() - started
+    after = redis.stats()
+    return {
+        'name': tick.__name__,
+        'round_trips': (after['round_trips'] - before['round_trips']) / ticks,
+        'commands': (after['commands'] - before['commands']) / ticks,
+        'tick_ms': elapsed / ticks * 1000,
+    }
+
+
+async def run(args, redis: RedisStandIn) -> List[dict]:
+    os.environ['REDIS_HOST'], os.environ['REDIS_PORT'] = redis.host, str(redis.port)
+    os.environ.setdefault('TELEGRAM_TOKEN', 'benchmark')
+    os.environ.setdefault('TELEGRAM_CHAT_ID', 'benchmark')
+    from app.db.redis_pub import Redis
+    logging.disable(logging.ERROR)
+
+    storage = Redis()
+    await storage.save_many_cache({f'stock:price:S{i}.ME': ('171.73', 3600) for i in range(10)})
+    rows = [await measure(tick, storage, redis, args.ticks) for tick in (unbatched_tick, batched_tick)]
+    async with storage.get_connection() as conn:
+        await conn.script_load(UPDATE_NOTIFICATION_PRICE)  # fakeredis drops connection on NOSCRIPT reply
+    for i in range(100):
+        await storage.save_hash(f'notification:benchmark:{i}', {'body': NOTIFICATION, 'state': 'new'}, 3600)
+    rows.append(await measure(hash_tick, storage, redis, args.ticks))
+    await Redis.close_pool()
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Redis round trips per notification tick')
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.0005, help='added latency per round trip, seconds')
+    parser.add_argument('--redis', help='host:port of Redis to use instead of fakeredis')
+    args = parser.parse_args(argv)
+
+    upstream = None
+    if args.redis:
+        host, _, port = args.redis.partition(':')
+        upstream = (host, int(port or 6379))
+    redis = RedisStandIn(upstream, latency=args.latency).start()
+    try:
+        rows = asyncio.run(run(args, redis))
+    finally:
+        redis.stop()
+    print(f'{"tick":>16} {"round trips":>12} {"commands":>9} {"ms/tick":>8}')
+    for r in rows:
+        print(f'{r["name"]:>16} {r["round_trips"]:>12.2f} {r["commands"]:>9.2f} {r["tick_ms"]:>8.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,22 @@
+from typing import Dict, List
+
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     server_host: str = '127.0.0.1'
     server_port: int = 8000
+    api_skip_response_validation: bool = True
+    metrics_enabled: bool = True
+    metrics_publish_interval: float = 5.0
+    metrics_loop_lag_interval: float = 0.5
+    http_cache_enabled: bool = True
+    http_cache_routes: Dict[str, Dict[str, int]] = {
+        '/bonds/': {'ttl': 300, 'max_age': 300},
+        '/stocks/{ticker}': {'ttl': 60, 'max_age': 60},
+        '/notification/': {'ttl': 60, 'max_age': 0},
+        '/notification/{id}': {'ttl': 60, 'max_age': 0},
+    }
     telegram_token: str
     mongo_host: str = '127.0.0.1'
     mongo_port: int = 27017
@@ -13,11 +26,82 @@ class Settings(BaseSettings):
     mongo_collection: str = 'notifications'
     telegram_chat_id: str
     time_out: int = 5
+    yahoo_base_url: str = 'https://query1.finance.yahoo.com'
+    yahoo_http2: bool = False
+    yahoo_max_connections: int = 100
+    yahoo_max_keepalive_connections: int = 20
+    yahoo_connect_timeout: float = 3.0
+    yahoo_lookup_budget: float = 3.0
+    yahoo_quote_batch_size: int = 50
+    yahoo_timeout: float = 3.0
+    yahoo_max_concurrency: int = 50
+    yahoo_retries: int = 1
+    yahoo_retry_backoff: float = 0.1
+    yahoo_hedge_after: float = 0.0
+    yahoo_breaker_failures: int = 10
+    yahoo_breaker_reset: float = 30.0
+    yahoo_rate_limit: float = 50.0
+    yahoo_rate_burst: int = 500
+    iss_base_url: str = 'https://iss.moex.com/iss'
+    iss_timeout: float = 10.0
+    iss_max_concurrency: int = 4
+    iss_retries: int = 2
+    iss_retry_backoff: float = 0.5
+    iss_hedge_after: float = 0.0
+    iss_breaker_failures: int = 5
+    iss_breaker_reset: float = 60.0
+    iss_rate_limit: float = 10.0
+    iss_rate_burst: int = 100
+    iss_rate_max_wait: float = 30.0
+    rate_limit_enabled: bool = True
+    notification_create_rate_limit: float = 0.2
+    notification_create_rate_burst: int = 10
     redis_host: str = '127.0.0.1'
     redis_port: int = 6379
-    redis_notification_queue: str = 'notification:stock:price:received'
+    redis_pool_min_size: int = 1
+    redis_pool_max_size: int = 20
+    redis_codec: str = 'msgpack'
+    redis_codec_compress_threshold: int = 1024
+    redis_codec_compress_level: int = 3
+    redis_near_cache_enabled: bool = False
+    redis_near_cache_max_bytes: int = 16 * 1024 * 1024
+    redis_near_cache_ttl: int = 60
+    redis_near_cache_prefixes: List[str] = ['notification:bonds:', 'stock:price:', 'stock:exchanges:',
+                                            'stock:unlisted:', 'stock:profile:', 'stock:currency:',
+                                            'http:response:']
+    redis_near_cache_channel: str = 'cache:invalidate'
+    redis_notification_stream: str = 'notification:stock:price:events'
+    redis_notification_stream_max_len: int = 100000
+    redis_notification_group: str = 'bot'
     redis_bonds_list_cache_key: str = 'notification:bonds:default6:received'
     redis_bonds_list_cache_ttl: int = 86400
+    redis_notification_symbols_key: str = 'notification:symbols'
+    redis_notification_workers_key: str = 'notification:workers'
+    redis_notification_control_channel: str = 'notification:control'
+    notification_worker_processes: int = 1
+    notification_worker_heartbeat_interval: int = 5
+    notification_worker_lease_ttl: int = 15
+    notification_worker_virtual_nodes: int = 64
+    notification_polling_mode: str = 'fixed'
+    notification_adaptive_max_delay: int = 3600
+    notification_adaptive_z_score: float = 3.0
+    notification_adaptive_window: int = 30
+    redis_stock_price_cache_ttl: int = 3600
+    stock_quote_max_age: int = 60
+    stock_quotes_max_symbols: int = 500
+    stock_directory_boards: List[str] = ['TQBR', 'TQTF']
+    stock_directory_file: str = ''
+    stock_directory_ttl: int = 86400
+    stock_directory_reload_interval: int = 3600
+    stock_directory_retry_interval: int = 60
+    history_enabled: bool = True
+    history_dir: str = 'data/history'
+    history_max_open_files: int = 256
+    history_max_points: int = 1000
+    redis_symbol_cache_ttl: int = 7 * 86400
+    redis_symbol_negative_ttl: int = 86400
+    redis_profile_cache_ttl: int = 14 * 86400
+    redis_profile_refresh_after: int = 7 * 86400
 
     class Config:
         env_file = '.env'
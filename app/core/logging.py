@@ -1,7 +1,8 @@
 import logging.config
 import os
 
-import yaml
+_configured = False
+_config = None
 
 
 def setup_logging(
@@ -10,17 +11,23 @@ def setup_logging(
         env_key='LOG_CFG'
 ):
     """
-    Setup logging configuration
+    Setup logging configuration. Logging is configured by the first call of the process,
+    next calls return the same configuration
     """
+    global _configured, _config
+    if _configured:
+        return _config
+    _configured = True
     path = default_path
     value = os.getenv(env_key, None)
     if value:
         path = value
     if os.path.exists(path):
+        import yaml
         with open(path, 'rt') as f:
-            config = yaml.safe_load(f.read())
-        logging.config.dictConfig(config)
-        return config
+            _config = yaml.safe_load(f.read())
+        logging.config.dictConfig(_config)
+        return _config
     else:
         logging.basicConfig(level=default_level,
                             format="%(asctime)s - %(threadName)s - %(name)s - %(levelname)s - %(message)s")
@@ -0,0 +1,196 @@
+import bisect
+import os
+import socket
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+PROCESS = f'{socket.gethostname()}:{os.getpid()}'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class Histogram:
+    """
+    Histogram of observed values by labels. \n
+    Observation is a dict lookup, a bisect and three increments without locks: metrics are updated from the event
+    loop thread, observations from executor threads may rarely lose an increment
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str], buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> observations per bucket (the last one is +Inf), sum and count
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series.setdefault(labels, [0] * (len(self.buckets) + 3))
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self) -> List[list]:
+        return [[list(labels), list(values)] for labels, values in self.series.items()]
+
+
+class Counter:
+    """
+    Increasing count by labels
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, value: float = 1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def samples(self) -> List[list]:
+        return [[list(labels), value] for labels, value in self.series.items()]
+
+
+class Gauge:
+    """
+    Last value by labels
+    """
+    type = 'gauge'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.series: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str):
+        self.series[labels] = value
+
+    def samples(self) -> List[list]:
+        return [[list(labels), value] for labels, value in self.series.items()]
+
+
+class MetricsRegistry:
+    """
+    Metrics of the process. Snapshots of processes are merged by `merge`,
+    series of every process are kept under `process` label
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, Union[Histogram, Counter, Gauge]] = {}
+        self.stats: List[Tuple[str, Callable[[], dict], Optional[str]]] = []
+
+    def histogram(self, name: str, description: str, labels: Sequence[str],
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, description, labels, buckets))
+
+    def counter(self, name: str, description: str, labels: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, description, labels))
+
+    def gauge(self, name: str, description: str, labels: Sequence[str] = ()) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, description, labels))
+
+    def stats_gauges(self, prefix: str, stats: Callable[[], dict], label: Optional[str] = None):
+        """
+        Expose numeric values of a stats function as gauges `{prefix}_{key}`, they are read at snapshot
+        :param stats: stats function, like `Redis.pool_stats`
+        :param label: stats function returns label value -> stats dict, like `UpstreamPolicy.upstream_stats`
+        """
+        self.stats.append((prefix, stats, label))
+
+    def read_stats(self) -> Dict[str, dict]:
+        metrics = {}
+        for prefix, stats, label in self.stats:
+            items = stats().items() if label else [((), stats())]
+            for label_value, values in items:
+                for key, value in values.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        metric = metrics.setdefault(f'{prefix}_{key}', {
+                            'type': 'gauge', 'description': f'{prefix} {key}', 'labels': [label] if label else [],
+                            'buckets': [], 'samples': []})
+                        metric['samples'].append([[label_value] if label else [], value])
+        return metrics
+
+    def snapshot(self) -> dict:
+        """
+        Values of all metrics, the format is shared by processes through Redis
+        """
+        return {
+            'process': PROCESS,
+            'time': time.time(),
+            'metrics': {**{name: {'type': metric.type, 'description': metric.description, 'labels': list(metric.labels),
+                                  'buckets': list(getattr(metric, 'buckets', [])), 'samples': metric.samples()}
+                           for name, metric in self.metrics.items()},
+                        **self.read_stats()},
+        }
+
+    @staticmethod
+    def merge(snapshots: Iterable[dict]) -> Dict[str, dict]:
+        """
+        Series of all snapshots labelled by `process`. Totals are summed by the query, e.g.
+        `sum by (route) (rate(http_request_duration_seconds_count[5m]))`, so a stopped process
+        does not look like a counter reset
+        """
+        merged: Dict[str, dict] = {}
+        for snapshot in snapshots:
+            for name, metric in snapshot['metrics'].items():
+                target = merged.setdefault(name, {**metric, 'labels': ['process', *metric['labels']], 'samples': {}})
+                if metric['type'] == 'histogram' and metric['buckets'] != target['buckets']:
+                    continue
+                for labels, value in metric['samples']:
+                    target['samples'][(snapshot['process'], *labels)] = value
+        return merged
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render(metrics: Dict[str, dict]) -> str:
+    """
+    Prometheus text exposition format of merged metrics
+    """
+    lines = []
+    for name, metric in sorted(metrics.items()):
+        lines.append(f'# HELP {name} {metric["description"]}')
+        lines.append(f'# TYPE {name} {metric["type"]}')
+        labels = metric['labels']
+        for values, series in sorted(metric['samples'].items()):
+            if metric['type'] != 'histogram':
+                lines.append(f'{name}{format_labels(labels, values)} {series}')
+                continue
+            cumulative = 0
+            for bound, count in zip([*metric['buckets'], '+Inf'], series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{format_labels(labels, values, le)} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels, values)} {series[-2]}')
+            lines.append(f'{name}_count{format_labels(labels, values)} {series[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram('http_request_duration_seconds', 'HTTP request latency by route',
+                                     ('method', 'route', 'status'))
+UPSTREAM_LATENCY = registry.histogram('upstream_request_duration_seconds', 'Upstream attempt latency by provider',
+                                      ('provider', 'outcome'))
+REDIS_LATENCY = registry.histogram('redis_command_duration_seconds', 'Redis storage call latency by command',
+                                   ('command',), buckets=REDIS_BUCKETS)
+ACTIVE_NOTIFICATIONS = registry.gauge('notifications_active', 'Notifications run by the worker')
+SCHEDULER_LAG = registry.gauge('scheduler_lag_seconds', 'Lateness of the last job submitted by the worker scheduler')
+EVENT_LOOP_LAG = registry.gauge('event_loop_lag_seconds', 'Delay of the last event loop lag probe')
+RATE_LIMITED = registry.counter('rate_limit_rejected_total', 'Calls rejected by rate limits', ('limit',))
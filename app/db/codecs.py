@@ -0,0 +1,105 @@
+"""
+Codecs of values stored in Redis. \n
+Encoded value starts with a header: MAGIC byte, format version and flags.
+MAGIC is never the first byte of UTF-8 text, so values saved as plain text (before codecs) are read as is.
+"""
+import json
+import logging
+from typing import Any, Optional, Type, TypeVar
+
+import msgpack
+from pydantic import BaseModel
+from pydantic.json import pydantic_encoder
+
+from app.core.logging import setup_logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+MAGIC = 0xC1
+VERSION = 1
+FLAG_ZSTD = 1
+FLAG_TEXT = 2
+HEADER_SIZE = 3
+
+Model = TypeVar('Model', bound=BaseModel)
+
+
+class Codec:
+    """
+    Base codec: strings are saved as UTF-8 text, other values as JSON text. Reads any format
+    """
+    name = 'json'
+
+    def encode(self, value: Any) -> bytes:
+        if not isinstance(value, str):
+            value = json.dumps(value, default=pydantic_encoder, separators=(',', ':'))
+        return value.encode('utf-8')
+
+    @staticmethod
+    def decode(data: Optional[bytes]) -> Any:
+        """
+        :return: None, string for text values, decoded object for msgpack values
+        """
+        if data is None:
+            return None
+        if not data or data[0] != MAGIC:
+            return data.decode('utf-8')
+        version, flags = data[1], data[2]
+        if version != VERSION:
+            raise ValueError(f'Unknown cached value format version: {version}')
+        payload = data[HEADER_SIZE:]
+        if flags & FLAG_ZSTD:
+            if zstandard is None:
+                raise ValueError('Cached value is compressed, but zstandard is not installed')
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+        if flags & FLAG_TEXT:
+            return payload.decode('utf-8')
+        return msgpack.unpackb(payload, raw=False)
+
+
+class MsgpackCodec(Codec):
+    """
+    Saves objects as msgpack and compresses values larger than threshold with zstd (if it is installed). \n
+    Short strings (prices, ids) stay plain text, header would only make them longer
+    """
+    name = 'msgpack'
+
+    def __init__(self, compress_threshold: int = 1024, compress_level: int = 3):
+        self.compress_threshold = compress_threshold
+        self.compressor = zstandard.ZstdCompressor(level=compress_level) if zstandard else None
+        if not zstandard:
+            logger.warning('zstandard is not installed, cached values are not compressed')
+
+    def encode(self, value: Any) -> bytes:
+        if isinstance(value, str):
+            payload, flags = value.encode('utf-8'), FLAG_TEXT
+            if len(payload) < self.compress_threshold or not self.compressor:
+                return payload
+        else:
+            payload, flags = msgpack.packb(value, default=pydantic_encoder, use_bin_type=True), 0
+        if self.compressor and len(payload) >= self.compress_threshold:
+            payload, flags = self.compressor.compress(payload), flags | FLAG_ZSTD
+        return bytes((MAGIC, VERSION, flags)) + payload
+
+
+def get_codec(name: str, compress_threshold: int = 1024, compress_level: int = 3) -> Codec:
+    if name == MsgpackCodec.name:
+        return MsgpackCodec(compress_threshold=compress_threshold, compress_level=compress_level)
+    if name == Codec.name:
+        return Codec()
+    raise ValueError(f'Unknown codec: {name}')
+
+
+def parse_model(model: Type[Model], value: Any) -> Model:
+    """
+    Build model from cached value: object saved by codec or JSON text saved before codecs
+    """
+    if isinstance(value, (str, bytes)):
+        return model.parse_raw(value)
+    return model.parse_obj(value)
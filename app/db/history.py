@@ -0,0 +1,132 @@
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from app.core import settings
+from app.core.logging import setup_logging
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+RECORD = np.dtype([('t', '<f8'), ('p', '<f8')])
+SYMBOL = re.compile(r'^[A-Za-z0-9.^=\-]{1,20}$')
+
+
+class PriceHistory:
+    """
+    Append-only price history: one file of (timestamp, price) records per symbol. \n
+    A record is appended by one O_APPEND write, so processes polling the same symbol do not tear records.
+    Ranges are read from a memory map: timestamp and price columns are views of the file, not copies.
+    Timestamps are expected to grow, records written out of order by concurrent processes stay close to their place
+    """
+    _fds: 'OrderedDict[str, int]' = OrderedDict()
+    _maps: Dict[str, Tuple[int, np.memmap]] = {}
+
+    @classmethod
+    def get_path(cls, symbol: str) -> str:
+        if not SYMBOL.match(symbol):
+            raise ValueError(f'Invalid symbol: {symbol}')
+        return os.path.join(settings.history_dir, f'{symbol.upper()}.bin')
+
+    @classmethod
+    def get_fd(cls, symbol: str) -> int:
+        path = cls.get_path(symbol)
+        fd = cls._fds.pop(path, None)
+        if fd is None:
+            os.makedirs(settings.history_dir, exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            while len(cls._fds) >= settings.history_max_open_files:
+                os.close(cls._fds.popitem(last=False)[1])
+        cls._fds[path] = fd
+        return fd
+
+    @classmethod
+    def append(cls, symbol: str, price: float, timestamp: Optional[float] = None):
+        """
+        Append polled price, errors are logged
+        """
+        if not settings.history_enabled:
+            return
+        try:
+            record = np.array([(time.time() if timestamp is None else timestamp, float(price))], dtype=RECORD)
+            os.write(cls.get_fd(symbol), record.tobytes())
+        except (OSError, ValueError) as exc:
+            logger.warning(f'Price of {symbol} is not saved to history: {exc!r}')
+
+    @classmethod
+    def close(cls):
+        while cls._fds:
+            os.close(cls._fds.popitem()[1])
+        cls._maps.clear()
+
+    @classmethod
+    def read(cls, symbol: str, start: Optional[float] = None, end: Optional[float] = None) -> np.ndarray:
+        """
+        Records in [start, end) as a slice of the memory map
+        """
+        path = cls.get_path(symbol)
+        try:
+            size = os.path.getsize(path) // RECORD.itemsize
+        except OSError:
+            return np.empty(0, dtype=RECORD)
+        if not size:
+            return np.empty(0, dtype=RECORD)
+        cached = cls._maps.get(path)
+        if cached is None or cached[0] != size:
+            cls._maps[path] = cached = (size, np.memmap(path, dtype=RECORD, mode='r', shape=(size,)))
+        records = cached[1]
+        timestamps = records['t']
+        left = 0 if start is None else int(np.searchsorted(timestamps, start, side='left'))
+        right = size if end is None else int(np.searchsorted(timestamps, end, side='left'))
+        return records[left:right]
+
+
+def ohlc(records: np.ndarray, interval: float) -> Dict[str, np.ndarray]:
+    """
+    Downsample records to OHLC buckets of `interval` seconds, empty buckets are skipped
+    :return: columns: bucket start, open, high, low, close and number of prices
+    """
+    timestamps, prices = records['t'], records['p']
+    if not len(records):
+        return {name: np.empty(0) for name in ('t', 'open', 'high', 'low', 'close', 'count')}
+    buckets = np.floor(timestamps / interval)
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(records)]
+    return {
+        't': buckets[starts] * interval,
+        'open': prices[starts],
+        'high': np.maximum.reduceat(prices, starts),
+        'low': np.minimum.reduceat(prices, starts),
+        'close': prices[ends - 1],
+        'count': ends - starts,
+    }
+
+
+def lttb(records: np.ndarray, threshold: int) -> Dict[str, np.ndarray]:
+    """
+    Downsample records to `threshold` points with Largest-Triangle-Three-Buckets, which keeps the visual shape
+    :return: columns: timestamp and price
+    """
+    timestamps, prices = records['t'], records['p']
+    size = len(records)
+    if threshold >= size or threshold < 3:
+        return {'t': np.asarray(timestamps), 'price': np.asarray(prices)}
+    edges = np.linspace(1, size - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, size - 1
+    # averages of the next bucket of every bucket, the last point is the next bucket of the last one
+    counts = np.diff(np.r_[edges[1:], size])
+    next_t = np.add.reduceat(timestamps, edges[1:]) / counts
+    next_p = np.add.reduceat(prices, edges[1:]) / counts
+    for bucket in range(threshold - 2):
+        left, right = edges[bucket], edges[bucket + 1]
+        prev = selected[bucket]
+        areas = np.abs((timestamps[prev] - next_t[bucket]) * (prices[left:right] - prices[prev])
+                       - (timestamps[prev] - timestamps[left:right]) * (next_p[bucket] - prices[prev]))
+        selected[bucket + 1] = left + int(np.argmax(areas))
+    return {'t': timestamps[selected], 'price': prices[selected]}
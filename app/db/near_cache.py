@@ -0,0 +1,103 @@
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+
+class NearCache:
+    """
+    In-process LRU cache in front of Redis, limited by entries ttl and total size of keys and values. \n
+    Cache serves values only while it is `active`, that is while invalidation channel is listened,
+    so it never serves values which could be changed by other processes unnoticed.
+    Values are decoded objects shared between callers, they must not be modified.
+    """
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.active = False
+        self.version = 0
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # key -> (value, local expiration, redis expiration or None, size)
+        self._entries: 'OrderedDict[str, Tuple[Any, float, Optional[float], int]]' = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[Any, Optional[int]]]:
+        """
+        :return: value and its ttl in Redis (None if key has no ttl) or None on miss
+        """
+        if not self.active:
+            return None
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at, redis_expires_at, _ = entry
+        if expires_at <= now or (redis_expires_at is not None and redis_expires_at <= now):
+            self.expirations += 1
+            self.misses += 1
+            self._pop(key)
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return value, round(redis_expires_at - now) if redis_expires_at is not None else None
+
+    def set(self,
+            key: str,
+            value: Any,
+            size: int,
+            redis_ttl: Optional[int] = None,
+            version: Optional[int] = None):
+        """
+        Put value to the cache
+        :param size: size of the value in Redis, bytes
+        :param redis_ttl: seconds before key expires in Redis
+        :param version: cache version the value was read at. Value is dropped if cache was invalidated after the read
+        """
+        if not self.active or value is None or (version is not None and version != self.version):
+            return
+        size += len(key)
+        if size > self.max_bytes:
+            return
+        self._pop(key)
+        now = time.monotonic()
+        self._entries[key] = (value, now + self.ttl, now + redis_ttl if redis_ttl is not None else None, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, keys: Iterable[str]):
+        self.version += 1
+        for key in keys:
+            if self._pop(key):
+                self.invalidations += 1
+
+    def clear(self):
+        self.version += 1
+        self._entries.clear()
+        self.size = 0
+
+    def _pop(self, key: str) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self.size -= entry[3]
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
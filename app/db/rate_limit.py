@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.core.metrics import RATE_LIMITED
+from app.db.redis_pub import Redis
+from app.db.scripts import TAKE_TOKENS
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class RateLimitedError(Exception):
+    """
+    Tokens of the rate limit are spent, API answers 429 with Retry-After
+    """
+
+    def __init__(self, limit: str, retry_after: float):
+        super().__init__(f'Rate limit {limit} is exceeded, retry after {retry_after:.1f}s')
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Token bucket in Redis shared by all processes: `rate` tokens per second up to `burst` tokens. \n
+    Tokens are refilled and taken by one Lua script on Redis time, so concurrent callers never overdraw the bucket.
+    If Redis does not answer, calls are let through
+    """
+    prefix = 'rate:'
+    _limiters: Dict[str, 'RateLimiter'] = {}
+
+    def __init__(self, name: str, rate: float, burst: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+
+    @classmethod
+    def for_limit(cls, name: str) -> 'RateLimiter':
+        """
+        Limiter configured by `{name}_rate_limit` and `{name}_rate_burst` settings
+        """
+        if name not in cls._limiters:
+            cls._limiters[name] = cls(name=name,
+                                      rate=getattr(settings, f'{name}_rate_limit'),
+                                      burst=getattr(settings, f'{name}_rate_burst'))
+        return cls._limiters[name]
+
+    def get_bucket_key(self, key: Optional[str] = None) -> str:
+        return f'{self.prefix}{self.name}:{key}' if key else f'{self.prefix}{self.name}'
+
+    async def take(self, key: Optional[str] = None, tokens: int = 1) -> float:
+        """
+        Take tokens from the bucket
+        :param key: bucket of the limit, like chatId; one bucket of the limit if it is not passed
+        :param tokens: number of calls
+        :return: 0 if tokens are taken, else seconds to wait for them
+        :raise ValueError: if more than `burst` tokens are requested, the bucket never holds them
+        """
+        if not settings.rate_limit_enabled or self.rate <= 0:
+            return 0.0
+        if tokens > self.burst:
+            raise ValueError(f'{tokens} tokens are more than burst {self.burst} of rate limit {self.name}')
+        result = await Redis().run_script(TAKE_TOKENS,
+                                          keys=[self.get_bucket_key(key)],
+                                          args=[self.rate, self.burst, tokens])
+        if not result or result[0]:
+            return 0.0
+        return float(result[1])
+
+    async def acquire(self, key: Optional[str] = None, tokens: int = 1, max_wait: float = 0.0):
+        """
+        Take tokens from the bucket, waiting up to `max_wait` seconds for them to be refilled
+        :raise RateLimitedError: if tokens are not refilled in time
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            retry_after = await self.take(key, tokens)
+            if not retry_after:
+                return
+            if time.monotonic() + retry_after > deadline:
+                RATE_LIMITED.inc(self.name)
+                raise RateLimitedError(self.name, retry_after)
+            await asyncio.sleep(retry_after)
+
+    async def check(self, key: Optional[str] = None, tokens: int = 1):
+        """
+        Take tokens from the bucket without waiting
+        :raise RateLimitedError: if the bucket has not enough tokens
+        """
+        await self.acquire(key, tokens)
@@ -1,23 +1,40 @@
 import asyncio
+import hashlib
+import json
 import logging
+import time
 from asyncio import CancelledError
 from contextlib import asynccontextmanager
-from typing import Optional, List
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, List, Tuple
+from uuid import uuid4
 
 import aioredis
-from aioredis import RedisError
+from aioredis import RedisError, ReplyError
 
 from app.core import settings
 from app.core.logging import setup_logging
+from app.core.metrics import REDIS_LATENCY
+from app.db.codecs import Codec, get_codec
+from app.db.near_cache import NearCache
 
 setup_logging()
 logger = logging.getLogger(__name__)
 
+# set while a storage call is awaited, calls made by it are not observed again
+_in_storage_call = ContextVar('in_storage_call', default=False)
+
 
 def error_logging_handler(func):
     async def wrapped(*args, **kwargs):
+        # messages are formatted only if they are logged, large cached values make it expensive
+        debug = logger.isEnabledFor(logging.DEBUG)
+        outer = _in_storage_call.get() is False
+        token = _in_storage_call.set(True) if outer else None
+        started = time.perf_counter()
         try:
-            logger.debug(f'Call "{func.__name__}" with args: {args}, kwargs: {kwargs}')
+            if debug:
+                logger.debug(f'Call "{func.__name__}" with args: {args}, kwargs: {kwargs}')
             result = await func(*args, **kwargs)
         except RedisError as redis_err:
             logging.error(f'Redis error: {redis_err.args}')
@@ -25,46 +42,343 @@ def error_logging_handler(func):
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
         else:
-            logger.debug(f'Successes call "{func.__name__}" return: {result}')
+            if debug:
+                logger.debug(f'Successes call "{func.__name__}" return: {result}')
             return result
+        finally:
+            if outer:
+                REDIS_LATENCY.observe(time.perf_counter() - started, func.__name__)
+                _in_storage_call.reset(token)
     return wrapped
 
 
 class Redis:
+    """
+    Redis storage. All instances of the process share one connection pool per connection string. \n
+    Keys with `redis_near_cache_prefixes` are also kept in the process near cache if it is enabled.
+    Writes of such keys publish invalidation, so near caches of other processes drop changed keys. \n
+    Cached values are encoded by `redis_codec`: strings are returned as strings, other values as decoded objects.
+    """
+    _pools: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+    _pool_usage = {'acquired': 0, 'waited': 0, 'wait_time': 0.0, 'max_wait_time': 0.0}
+    _near_cache: Optional[NearCache] = NearCache(max_bytes=settings.redis_near_cache_max_bytes,
+                                                 ttl=settings.redis_near_cache_ttl) \
+        if settings.redis_near_cache_enabled else None
+    _near_cache_listener: Optional[asyncio.Task] = None
+    _process_id = uuid4().hex
+    codec: Codec = get_codec(settings.redis_codec,
+                             compress_threshold=settings.redis_codec_compress_threshold,
+                             compress_level=settings.redis_codec_compress_level)
+
     def __init__(self, host: str = settings.redis_host, port: str = settings.redis_port, db: int = 0):
         self.redis_connection_string = f'redis://{host}:{port}/{db}'
 
+    @classmethod
+    async def init_pool(cls, host: str = settings.redis_host, port: str = settings.redis_port, db: int = 0):
+        """
+        Create connection pool on application startup, instead of the first storage call
+        """
+        storage = cls(host=host, port=port, db=db)
+        if cls._near_cache and not cls._near_cache_listener:
+            cls._near_cache_listener = asyncio.create_task(storage.listen_invalidations())
+        try:
+            return await storage.get_pool()
+        except (RedisError, OSError) as err:
+            logger.error(f'Can not create Redis pool, it will be created on the first call: {err.args}')
+
+    @classmethod
+    async def close_pool(cls):
+        listener, cls._near_cache_listener = cls._near_cache_listener, None
+        if listener:
+            listener.cancel()
+            await asyncio.gather(listener, return_exceptions=True)
+        pools, cls._pools = cls._pools, {}
+        for loop, pool_future in pools.values():
+            if pool_future.done() and not pool_future.exception():
+                pool = pool_future.result()
+                pool.close()
+                await pool.wait_closed()
+        logger.info(f'Redis pools are closed, usage: {cls.pool_stats()}')
+        if cls._near_cache:
+            logger.info(f'Near cache usage: {cls.near_cache_stats()}')
+
+    async def get_pool(self) -> aioredis.ConnectionsPool:
+        """
+        Get process connection pool, it is created on the first call in the event loop
+        """
+        loop = asyncio.get_event_loop()
+        pool_loop, pool_future = self._pools.get(self.redis_connection_string, (None, None))
+        if pool_loop is not loop or (pool_future.done() and
+                                     (pool_future.exception() or pool_future.result().closed)):
+            pool_future = asyncio.ensure_future(aioredis.create_pool(self.redis_connection_string,
+                                                                     encoding='utf-8',
+                                                                     minsize=settings.redis_pool_min_size,
+                                                                     maxsize=settings.redis_pool_max_size))
+            self._pools[self.redis_connection_string] = (loop, pool_future)
+            logger.info(f'Creating Redis pool {self.redis_connection_string}, '
+                        f'size {settings.redis_pool_min_size}..{settings.redis_pool_max_size}')
+        return await asyncio.shield(pool_future)
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        """
+        Pool usage: connections opened, free and in use, connection acquisitions and time waited for free connection
+        """
+        stats = {'size': 0, 'free': 0, 'in_use': 0, 'max_size': 0, **cls._pool_usage}
+        for loop, pool_future in cls._pools.values():
+            if pool_future.done() and not pool_future.exception():
+                pool = pool_future.result()
+                stats['size'] += pool.size
+                stats['free'] += pool.freesize
+                stats['in_use'] += pool.size - pool.freesize
+                stats['max_size'] += pool.maxsize
+        return stats
+
+    @classmethod
+    def record_acquire(cls, wait_time: float):
+        usage = cls._pool_usage
+        usage['acquired'] += 1
+        if wait_time > 0.001:
+            usage['waited'] += 1
+            usage['wait_time'] += wait_time
+            usage['max_wait_time'] = max(usage['max_wait_time'], wait_time)
+
+    @classmethod
+    def near_cache_stats(cls) -> dict:
+        """
+        Near cache usage: entries, bytes, hits, misses, evictions, expirations and invalidations
+        """
+        return cls._near_cache.stats() if cls._near_cache else {'active': False}
+
+    @classmethod
+    def is_near_cached(cls, collection_key: str) -> bool:
+        return cls._near_cache is not None and collection_key.startswith(tuple(settings.redis_near_cache_prefixes))
+
+    @classmethod
+    def publish_invalidation(cls, pipe, collection_keys: Iterable[str]) -> List[str]:
+        """
+        Add invalidation of near cached keys to pipeline, so it is published right after the keys are written
+        :return: invalidated keys
+        """
+        keys = [key for key in collection_keys if cls.is_near_cached(key)]
+        if keys:
+            pipe.publish(settings.redis_near_cache_channel, json.dumps({'origin': cls._process_id, 'keys': keys}))
+        return keys
+
+    async def listen_invalidations(self):
+        """
+        Drop near cached keys changed by other processes. Near cache serves values only while the channel is listened,
+        it is cleared on reconnect as invalidations could be lost
+        :return:
+        """
+        cache = self._near_cache
+        while True:
+            try:
+                conn = await aioredis.create_redis(self.redis_connection_string, encoding='utf-8')
+                try:
+                    ch, = await conn.subscribe(settings.redis_near_cache_channel)
+                    cache.clear()
+                    cache.active = True
+                    async for message in ch.iter(encoding='utf-8'):
+                        message = json.loads(message)
+                        if message['origin'] != self._process_id:
+                            cache.invalidate(message['keys'])
+                finally:
+                    cache.active = False
+                    cache.clear()
+                    conn.close()
+                    await conn.wait_closed()
+            except (RedisError, OSError, ValueError, KeyError) as err:
+                logger.error(f'Near cache invalidation channel error: {err.args}')
+            await asyncio.sleep(1)
+
     @asynccontextmanager
     async def get_connection(self):
-        conn = await aioredis.create_redis(self.redis_connection_string, encoding='utf-8')
+        pool = await self.get_pool()
+        started = time.perf_counter()
+        conn = await pool.acquire()
+        self.record_acquire(time.perf_counter() - started)
         try:
-            yield conn
+            yield aioredis.Redis(conn)
         finally:
-            conn.close()
-            await conn.wait_closed()
+            pool.release(conn)
+
+    @asynccontextmanager
+    async def pipeline(self, transaction: bool = False, return_exceptions: bool = False):
+        """
+        Buffer commands and send them in one round trip on exit. \n
+        Commands return futures, their results are available after the block:
+            async with storage.pipeline() as pipe:
+                price = pipe.get(key)
+            price.result()
+        :param transaction: wrap commands in MULTI/EXEC
+        :param return_exceptions: keep command errors in their futures instead of raising
+        """
+        async with self.get_connection() as conn:
+            pipe = conn.multi_exec() if transaction else conn.pipeline()
+            yield pipe
+            await pipe.execute(return_exceptions=return_exceptions)
 
     @error_logging_handler
     async def start_publish(self,
                             message: str,
-                            queue: str = settings.redis_notification_queue):
+                            stream: str = settings.redis_notification_stream):
+        """
+        Append message to the stream, stream is trimmed to about `redis_notification_stream_max_len` entries. \n
+        Consumer group is created with the stream in the same round trip, so messages added before consumers start
+        are delivered, also after the stream is deleted or Redis is restarted without persistence
+        """
+        async with self.pipeline(return_exceptions=True) as pipe:
+            created = pipe.xgroup_create(stream, settings.redis_notification_group, latest_id='0', mkstream=True)
+            added = pipe.xadd(stream, {'message': message}, max_len=settings.redis_notification_stream_max_len)
+        if created.exception() and not str(created.exception()).startswith('BUSYGROUP'):
+            raise created.exception()
+        logging.debug(f'Message {added.result()} added to redis stream: {stream}')
+
+    @error_logging_handler
+    async def publish(self, channel: str, message: str) -> int:
         async with self.get_connection() as conn:
-            await conn.rpush(queue, message)
-            logging.debug(f'Message pushed to redis queue: {queue}')
+            return await conn.publish(channel, message)
+
+    async def subscribe(self, channel: str) -> AsyncIterator[str]:
+        """
+        Listen channel messages on dedicated connection, it is not taken from the pool
+        """
+        conn = await aioredis.create_redis(self.redis_connection_string, encoding='utf-8')
+        try:
+            ch, = await conn.subscribe(channel)
+            logging.debug(f'Subscribed to redis channel: {channel}')
+            async for message in ch.iter(encoding='utf-8'):
+                yield message
+        finally:
+            conn.close()
+            await conn.wait_closed()
 
     @error_logging_handler
     async def save_cache(self,
-                         message: str,
+                         message: Any,
                          collection_key: str,
                          ttl_per_sec: Optional[int] = None):
+        if self.is_near_cached(collection_key):
+            await self.save_many_cache({collection_key: (message, ttl_per_sec)})
+            return collection_key
         async with self.get_connection() as conn:
-            await conn.set(key=collection_key, expire=ttl_per_sec, value=message)
+            await conn.set(key=collection_key, expire=ttl_per_sec, value=self.codec.encode(message))
             return collection_key
 
     @error_logging_handler
     async def get_cached(self,
                          collection_key: str = settings.redis_bonds_list_cache_key):
+        if self.is_near_cached(collection_key):
+            return (await self.get_many_cached_with_ttl([collection_key]))[0][0]
+        async with self.get_connection() as conn:
+            return self.codec.decode(await conn.get(key=collection_key, encoding=None))
+
+    @error_logging_handler
+    async def save_many_cache(self,
+                              messages: Dict[str, Any],
+                              transaction: bool = False) -> List[str]:
+        """
+        Save many keys in one round trip
+        :param messages: key -> message or tuple (message, ttl in seconds)
+        :param transaction: save all keys atomically
+        :return: saved keys
+        """
+        messages = {key: message if isinstance(message, tuple) else (message, None)
+                    for key, message in messages.items()}
+        async with self.pipeline(transaction=transaction) as pipe:
+            for collection_key, (message, ttl_per_sec) in messages.items():
+                pipe.set(key=collection_key, value=self.codec.encode(message), expire=ttl_per_sec or 0)
+            invalidated = self.publish_invalidation(pipe, messages)
+        if invalidated:
+            self._near_cache.invalidate(invalidated)
+        return list(messages)
+
+    @error_logging_handler
+    async def get_cached_with_ttl(self, collection_key: str) -> Tuple[Any, Optional[int]]:
+        """
+        Get value and its ttl in one round trip
+        :return: value (None if key does not exist) and ttl (None if key does not exist or has no ttl)
+        """
+        return (await self.get_many_cached_with_ttl([collection_key]))[0]
+
+    @error_logging_handler
+    async def get_many_cached_with_ttl(self,
+                                       collection_keys: List[str]) -> List[Tuple[Any, Optional[int]]]:
+        """
+        Get values and their ttl in one round trip. \n
+        Near cache serves the call only if it has all the keys, otherwise they are read in the same round trip,
+        so values are not older than the ones read from Redis
+        """
+        cache = self._near_cache
+        if cache and all(self.is_near_cached(key) for key in collection_keys):
+            found = [cache.get(key) for key in collection_keys]
+            if None not in found:
+                return found
+        version = cache.version if cache else None
+        async with self.pipeline() as pipe:
+            replies = [(pipe.get(key, encoding=None), pipe.ttl(key)) for key in collection_keys]
+        found = []
+        for key, (value, ttl) in zip(collection_keys, replies):
+            data, ttl = value.result(), ttl.result() if ttl.result() >= 0 else None
+            found.append((self.codec.decode(data), ttl))
+            if data is not None and self.is_near_cached(key):
+                cache.set(key, found[-1][0], size=len(data), redis_ttl=ttl, version=version)
+        return found
+
+    @error_logging_handler
+    async def save_hash(self,
+                        collection_key: str,
+                        fields: Dict[str, Any],
+                        ttl_per_sec: Optional[int] = None) -> str:
+        """
+        Replace key with hash of fields encoded by codec, fields can be updated separately later
+        """
+        async with self.pipeline(transaction=True) as pipe:
+            pipe.delete(collection_key)
+            pipe.hmset_dict(collection_key, {field: self.codec.encode(value) for field, value in fields.items()})
+            if ttl_per_sec:
+                pipe.expire(collection_key, ttl_per_sec)
+        return collection_key
+
+    @error_logging_handler
+    async def get_hash(self, collection_key: str) -> Any:
+        found = await self.get_many_hashes([collection_key])
+        return found[0] if found else None
+
+    @error_logging_handler
+    async def get_many_hashes(self, collection_keys: List[str]) -> List[Any]:
+        """
+        Get hashes in one round trip
+        :return: dict of decoded fields, None if key does not exist
+         or decoded value if key is not a hash (it was saved with save_cache)
+        """
+        async with self.pipeline(return_exceptions=True) as pipe:
+            replies = [pipe.hgetall(key, encoding=None) for key in collection_keys]
+        found, not_hashes = [], {}
+        for key, reply in zip(collection_keys, replies):
+            error = reply.exception()
+            if error and not str(error).startswith('WRONGTYPE'):
+                raise error
+            if error:
+                not_hashes[key] = len(found)
+                found.append(None)
+            else:
+                found.append(self.decode_hash(reply.result()))
+        if not_hashes:
+            values = await self.get_many_cached(list(not_hashes)) or []
+            for key, value in zip(not_hashes, values):
+                found[not_hashes[key]] = value
+        return found
+
+    @classmethod
+    def decode_hash(cls, fields: Dict[bytes, bytes]) -> Optional[Dict[str, Any]]:
+        return {field.decode('utf-8'): cls.codec.decode(value) for field, value in fields.items()} or None
+
+    @error_logging_handler
+    async def exists(self, collection_key: str) -> bool:
         async with self.get_connection() as conn:
-            return await conn.get(key=collection_key, encoding='utf-8')
+            return bool(await conn.exists(collection_key))
 
     @error_logging_handler
     async def get_key_ttl(self,
@@ -79,12 +393,100 @@ class Redis:
 
     @error_logging_handler
     async def search_by_pattern(self,
-                                pattern: str) -> List[str]:
+                                pattern: str) -> List[Any]:
         async with self.get_connection() as conn:
             collection_key = set()
             async for key in conn.iscan(match=pattern):
                 collection_key.add(key)
             logging.debug(f'Find keys: {collection_key} by pattern {pattern}')
-            tasks = [asyncio.create_task(self.get_cached(item)) for item in collection_key]
-            done, pending = await asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
-            return [d.result() for d in done]
+            if not collection_key:
+                return []
+            return [self.codec.decode(value) for value in await conn.mget(*collection_key, encoding=None)
+                    if value is not None]
+
+    @error_logging_handler
+    async def delete(self, *collection_keys: str) -> int:
+        async with self.pipeline() as pipe:
+            deleted = pipe.delete(*collection_keys)
+            invalidated = self.publish_invalidation(pipe, collection_keys)
+        if invalidated:
+            self._near_cache.invalidate(invalidated)
+        return deleted.result()
+
+    @error_logging_handler
+    async def add_to_set(self, collection_key: str, *members: str) -> int:
+        async with self.get_connection() as conn:
+            return await conn.sadd(collection_key, *members)
+
+    @error_logging_handler
+    async def remove_from_set(self, collection_key: str, *members: str) -> int:
+        async with self.get_connection() as conn:
+            return await conn.srem(collection_key, *members)
+
+    @error_logging_handler
+    async def get_set(self, collection_key: str) -> List[str]:
+        async with self.get_connection() as conn:
+            return await conn.smembers(collection_key)
+
+    @error_logging_handler
+    async def get_sorted_set(self, collection_key: str) -> List[str]:
+        async with self.get_connection() as conn:
+            return await conn.zrange(collection_key, 0, -1)
+
+    @error_logging_handler
+    async def get_many_cached(self, collection_keys: List[str]) -> List[Any]:
+        async with self.get_connection() as conn:
+            return [self.codec.decode(value) for value in await conn.mget(*collection_keys, encoding=None)]
+
+    @error_logging_handler
+    async def remove_from_sorted_set(self, collection_key: str, *members: str) -> int:
+        async with self.get_connection() as conn:
+            return await conn.zrem(collection_key, *members)
+
+    @error_logging_handler
+    async def run_script(self,
+                         script: str,
+                         keys: Optional[List[str]] = None,
+                         args: Optional[List] = None,
+                         encoding: Optional[str] = 'utf-8'):
+        """
+        Run lua script by its sha1 digest, load it on the first call
+        :param encoding: reply encoding, None to get bytes (scripts returning cached values)
+        """
+        digest = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        keys, args = keys or [], args or []
+        async with self.get_connection() as conn:
+            try:
+                return await conn.execute(b'EVALSHA', digest, len(keys), *keys, *args, encoding=encoding)
+            except ReplyError as err:
+                if not str(err).startswith('NOSCRIPT'):
+                    raise
+                return await conn.execute(b'EVAL', script, len(keys), *keys, *args, encoding=encoding)
+
+    @error_logging_handler
+    async def run_scripts(self, script: str, calls: List[Tuple[List[str], List]]) -> List[Any]:
+        """
+        Run lua script for many keys and args in one pipelined round trip, load it if Redis does not have it
+        :param calls: keys and args of every run
+        :return: replies in order of calls, error of a failed run is returned in its place
+        """
+        digest = hashlib.sha1(script.encode('utf-8')).hexdigest()
+        replies: List[Any] = [None] * len(calls)
+        pending = list(range(len(calls)))
+        async with self.get_connection() as conn:
+            for attempt in range(2):
+                pipe = conn.pipeline()
+                futures = [pipe.evalsha(digest, keys=calls[i][0], args=calls[i][1]) for i in pending]
+                await pipe.execute(return_exceptions=True)
+                not_loaded = []
+                for i, future in zip(pending, futures):
+                    error = future.exception()
+                    if error and str(error).startswith('NOSCRIPT') and not attempt:
+                        not_loaded.append(i)
+                    else:
+                        replies[i] = error or future.result()
+                if not not_loaded:
+                    break
+                await conn.script_load(script)
+                pending = not_loaded
+        return replies
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+from aioredis import RedisError
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.db.redis_pub import Redis
+from app.db.scripts import INVALIDATE_RESPONSES
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    HTTP responses cached in Redis (and in the near cache with `http:response:` prefix). \n
+    Entry key is built from path, sorted query and chatId. Responses of a chat are listed in the chat index,
+    so notification changes delete them: by `invalidate` or by the Lua scripts changing notifications
+    """
+    entry_prefix = 'http:response:'
+    index_prefix = 'http:responses:'
+
+    def __init__(self):
+        self.storage = Redis()
+
+    @classmethod
+    def get_entry_key(cls, path: str, query: List[Tuple[str, str]], chat_id: Optional[str] = None) -> str:
+        digest = hashlib.sha1(f'{path}?{urlencode(sorted(query))}'.encode('utf-8')).hexdigest()
+        return f'{cls.entry_prefix}{chat_id or "-"}:{digest}'
+
+    @classmethod
+    def get_index_key(cls, chat_id: str) -> str:
+        return f'{cls.index_prefix}{chat_id}'
+
+    @classmethod
+    def get_index_ttl(cls) -> int:
+        return max([route['ttl'] for route in settings.http_cache_routes.values()] or [0])
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = await self.storage.get_cached(key)
+        # the json codec returns cached objects as JSON text
+        return json.loads(entry) if isinstance(entry, str) else entry
+
+    async def save(self, key: str, entry: Dict[str, Any], ttl: int, chat_id: Optional[str] = None):
+        """
+        Save entry and add it to the chat index in one round trip. \n
+        Invalidation is not published: the key is written only after it is deleted or expired,
+        deletion publishes it and near caches expire entries with Redis
+        """
+        try:
+            async with self.storage.pipeline() as pipe:
+                pipe.set(key, Redis.codec.encode(entry), expire=ttl)
+                if chat_id:
+                    pipe.sadd(self.get_index_key(chat_id), key)
+                    pipe.expire(self.get_index_key(chat_id), self.get_index_ttl())
+        except (RedisError, OSError) as err:
+            logger.error(f'Response {key} is not cached: {err.args}')
+
+    async def get_keys(self, chat_id: str) -> List[str]:
+        """
+        Keys of cached responses of the chat, scripts deleting the responses get them as declared keys
+        """
+        return await self.storage.get_set(self.get_index_key(chat_id)) or []
+
+    async def invalidate(self, chat_id: str) -> int:
+        """
+        Delete cached responses of the chat
+        :return: number of deleted responses
+        """
+        responses = await self.get_keys(chat_id)
+        if not responses:
+            return 0
+        deleted = await self.storage.run_script(INVALIDATE_RESPONSES, keys=[self.get_index_key(chat_id), *responses])
+        await self.forget(deleted)
+        return len(deleted or [])
+
+    async def forget(self, deleted: Any):
+        """
+        Drop near cached copies of responses deleted by a script
+        :param deleted: response keys returned by the script
+        """
+        if isinstance(deleted, list) and any(Redis.is_near_cached(key) for key in deleted):
+            await self.storage.delete(*deleted)
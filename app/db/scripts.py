@@ -0,0 +1,192 @@
+# Lua scripts executed on Redis side by Redis.run_script
+
+# KEYS: lease keys, ARGV[1]: owner id, ARGV[2]: lease ttl in ms
+# Return list of 1/0 flags: lease is acquired (or renewed) by the owner
+ACQUIRE_LEASES = """
+local result = {}
+for i, key in ipairs(KEYS) do
+    local owner = redis.call('GET', key)
+    if not owner then
+        redis.call('SET', key, ARGV[1], 'PX', ARGV[2])
+        result[i] = 1
+    elseif owner == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        result[i] = 1
+    else
+        result[i] = 0
+    end
+end
+return result
+"""
+
+# KEYS: lease keys, ARGV[1]: owner id
+# Delete only leases held by the owner
+RELEASE_LEASES = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('DEL', key)
+        released = released + 1
+    end
+end
+return released
+"""
+
+# KEYS[1]: workers sorted set, ARGV[1]: worker id, ARGV[2]: now (sec), ARGV[3]: heartbeat ttl (sec)
+# Register worker heartbeat, drop dead workers and return alive ones
+WORKERS_HEARTBEAT = """
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', tonumber(ARGV[2]) - tonumber(ARGV[3]))
+return redis.call('ZRANGE', KEYS[1], 0, -1)
+"""
+
+# KEYS[1]: symbol notifications set, KEYS[2]: symbols registry set, KEYS[3]: chat notifications index
+# ARGV[1]: notification key, ARGV[2]: symbol, ARGV[3]: creation timestamp
+ENQUEUE_NOTIFICATION = """
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+return redis.call('SADD', KEYS[2], ARGV[2])
+"""
+
+# KEYS[1]: symbol notifications set, KEYS[2]: symbols registry set, KEYS[3]: chat notifications index
+# ARGV[1]: notification key, ARGV[2]: symbol
+# Drop symbol from registry when it has no notifications anymore
+DEQUEUE_NOTIFICATION = """
+redis.call('SREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+local left = redis.call('SCARD', KEYS[1])
+if left == 0 then
+    redis.call('SREM', KEYS[2], ARGV[2])
+end
+return left
+"""
+
+# Lua function: delete cached HTTP responses KEYS[first..] which are listed in the index set and drop them
+# from the index, the caller reads response keys from the index first, so all keys are declared.
+# Return deleted response keys
+DROP_RESPONSES = """
+local function drop_responses(index, first)
+    local deleted = {}
+    if not index then
+        return deleted
+    end
+    for i = first, #KEYS do
+        if redis.call('SREM', index, KEYS[i]) == 1 then
+            redis.call('DEL', KEYS[i])
+            deleted[#deleted + 1] = KEYS[i]
+        end
+    end
+    return deleted
+end
+"""
+
+# KEYS[1]: chat responses index, KEYS[2..]: response keys of the index
+# Delete cached HTTP responses of the chat, return deleted response keys
+INVALIDATE_RESPONSES = DROP_RESPONSES + """
+return drop_responses(KEYS[1], 2)
+"""
+
+# KEYS[1]: notification hash, KEYS[2] (optional): chat responses index, KEYS[3..]: response keys of the index
+# ARGV[1]: price, ARGV[2]: target price, ARGV[3]: action (Buy, Sell or empty)
+# Set price and state fields and move notification to done when target is reached, cached responses of the chat
+# are deleted with the change.
+# Return {state, 1 if state is changed by the call, deleted response keys} or {'', 0} if notification does not exist
+UPDATE_NOTIFICATION_PRICE = DROP_RESPONSES + """
+local state = redis.call('HGET', KEYS[1], 'state')
+if not state then
+    return {'', 0}
+end
+if state ~= 'new' and state ~= 'in_progress' then
+    return {state, 0}
+end
+local price, target = tonumber(ARGV[1]), tonumber(ARGV[2])
+local new_state = 'in_progress'
+if price == target or (ARGV[3] == 'Buy' and price <= target) or (ARGV[3] == 'Sell' and price >= target) then
+    new_state = 'done'
+end
+redis.call('HSET', KEYS[1], 'price', ARGV[1], 'state', new_state)
+return {new_state, new_state ~= state and 1 or 0, drop_responses(KEYS[2], 3)}
+"""
+
+# KEYS[1]: notification hash, KEYS[2] (optional): chat responses index, KEYS[3..]: response keys of the index
+# ARGV[1]: state
+# Set state field of existing notification, delete cached responses of the chat (also if notification is expired)
+# Return deleted response keys
+SET_NOTIFICATION_STATE = DROP_RESPONSES + """
+if redis.call('TYPE', KEYS[1]).ok == 'hash' then
+    redis.call('HSET', KEYS[1], 'state', ARGV[1])
+end
+return drop_responses(KEYS[2], 3)
+"""
+
+# KEYS[1]: chat notifications index, KEYS[2..]: notification keys read from the index by the caller
+# Return notifications in order of KEYS as flat lists of hash fields and values,
+# notifications saved as strings are returned as {'body', value}. Expired notifications are dropped from the index
+LIST_NOTIFICATIONS = """
+local found = {}
+for i = 2, #KEYS do
+    local key = KEYS[i]
+    local key_type = redis.call('TYPE', key).ok
+    if key_type == 'hash' then
+        found[#found + 1] = redis.call('HGETALL', key)
+    elseif key_type == 'string' then
+        found[#found + 1] = {'body', redis.call('GET', key)}
+    else
+        redis.call('ZREM', KEYS[1], key)
+    end
+end
+return found
+"""
+
+# KEYS[1]: chat notifications index, KEYS[2]: symbols registry set, KEYS[3..ARGV[1] + 2]: notification keys,
+# other KEYS: symbol sets of the notifications
+# ARGV[1]: number of notification keys, ARGV[2]: symbol set key prefix,
+# ARGV[3..]: symbol of each notification key (empty if notification does not exist)
+# Delete notifications with their index entries and symbol subscriptions, return deleted notification keys.
+# The caller reads symbols from `symbol` fields (or string values saved before hash layout) first,
+# so all keys are declared
+DELETE_NOTIFICATIONS = """
+local deleted = {}
+for i = 1, tonumber(ARGV[1]) do
+    local key, symbol = KEYS[i + 2], ARGV[i + 2]
+    redis.call('ZREM', KEYS[1], key)
+    if symbol ~= '' then
+        local symbol_key = ARGV[2] .. symbol
+        redis.call('SREM', symbol_key, key)
+        if redis.call('SCARD', symbol_key) == 0 then
+            redis.call('SREM', KEYS[2], symbol)
+        end
+    end
+    if redis.call('DEL', key) == 1 then
+        deleted[#deleted + 1] = key
+    end
+end
+return deleted
+"""
+
+# KEYS[1]: token bucket hash
+# ARGV[1]: refill rate (tokens per second), ARGV[2]: capacity, ARGV[3]: tokens to take
+# Time is read from Redis, so clocks of API and worker hosts do not matter
+# Return {1, '0'} if tokens are taken, else {0, seconds until enough tokens are refilled}
+TAKE_TOKENS = """
+if redis.replicate_commands then
+    redis.replicate_commands()
+end
+local rate, capacity, requested = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'time')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local taken, retry_after = 0, 0
+if tokens >= requested then
+    tokens = tokens - requested
+    taken = 1
+else
+    retry_after = (requested - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'time', tostring(math.max(now, updated)))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {taken, tostring(retry_after)}
+"""
@@ -1,12 +1,24 @@
+import asyncio
 import logging
+import math
 
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from starlette.responses import RedirectResponse
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
 
 from app import api
+from app.api.cache import ResponseCacheMiddleware
+from app.api.metrics import MetricsMiddleware
+from app.api.responses import FastJSONResponse
 from app.core import settings
 from app.core.logging import setup_logging
+from app.db.history import PriceHistory
+from app.db.rate_limit import RateLimitedError
+from app.db.redis_pub import Redis
+from app.services.metrics import Metrics
+from app.services.search import SecuritiesDirectory
+from app.services.stock import YahooApiService
 
 tags_metadata = [
     {
@@ -24,9 +36,45 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="InvestAssistance",
               description="This is API for InvestAssistance",
-              version="0.2.1")
+              version="0.2.1",
+              default_response_class=FastJSONResponse)
 
 app.include_router(api.router)
+app.add_middleware(ResponseCacheMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
+def log_task_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f'Background task {task!r} failed', exc_info=task.exception())
+
+
+@app.on_event("startup")
+async def startup():
+    await Redis.init_pool()
+    await YahooApiService.open_client()
+    app.state.directory_loading = asyncio.create_task(SecuritiesDirectory.run())
+    app.state.directory_loading.add_done_callback(log_task_failure)
+    app.state.metrics_publishing = asyncio.create_task(Metrics.run()) if settings.metrics_enabled else None
+    if app.state.metrics_publishing:
+        app.state.metrics_publishing.add_done_callback(log_task_failure)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    app.state.directory_loading.cancel()
+    if app.state.metrics_publishing:
+        app.state.metrics_publishing.cancel()
+    await YahooApiService.close_client()
+    await Redis.close_pool()
+    PriceHistory.close()
+
+
+@app.exception_handler(RateLimitedError)
+async def rate_limited(request: Request, exc: RateLimitedError):
+    return FastJSONResponse({'detail': str(exc)},
+                            status_code=HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(max(math.ceil(exc.retry_after), 1))})
 
 
 @app.get("/", include_in_schema=False)
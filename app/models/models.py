@@ -1,9 +1,13 @@
+import re
 from datetime import datetime, timedelta
 from decimal import Decimal
 from enum import Enum, unique
 from typing import Optional, List
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, validator
+
+# YahooFinance search symbol: it is sent to YahooFinance and is a part of Redis keys and history file names
+YAHOO_SYMBOL_REGEX = r'^[A-Za-z0-9^=\-][A-Za-z0-9.^=\-]{0,19}$'
 
 
 @unique
@@ -170,6 +174,65 @@ class AssetProfile(BaseModel):
                                 example='http://www.moex.com')
 
 
+class WarmUpProfilesRq(BaseModel):
+    symbols: List[str] = Field(...,
+                               description='Yahoo symbols to cache asset profiles of',
+                               min_items=1,
+                               max_items=1000,
+                               example=['MOEX.ME', 'AAPL'])
+
+    @validator('symbols', each_item=True)
+    def check_symbol(cls, symbol: str) -> str:
+        if not re.fullmatch(YAHOO_SYMBOL_REGEX, symbol):
+            raise ValueError(f'Invalid YahooFinance symbol: {symbol!r}')
+        return symbol
+
+
+class WarmUpProfilesRs(BaseModel):
+    cached: int = Field(...,
+                        description='Number of requested and cached profiles',
+                        example=2)
+
+
+class SecurityRs(BaseModel):
+    ticker: str = Field(...,
+                        description='Security ticker',
+                        example='MOEX')
+    name: str = Field(...,
+                      description='Security name',
+                      example='ПАО Московская Биржа')
+    yahoo_search_symbol: str = Field(...,
+                                     description='YahooFinance search symbol',
+                                     example='MOEX.ME')
+    exchange: str = Field(...,
+                          description='Exchange name',
+                          example='MCX')
+
+
+class QuoteRs(BaseModel):
+    symbol: str = Field(...,
+                        description='YahooFinance search symbol',
+                        example='MOEX.ME')
+    price: Optional[Amount] = Field(None,
+                                    description='Latest price, empty if symbol is not answered')
+
+
+class PriceHistoryRs(BaseModel):
+    symbol: str = Field(...,
+                        description='YahooFinance search symbol',
+                        example='MOEX.ME')
+    t: List[float] = Field(...,
+                           description='Unix timestamps of points or starts of OHLC buckets')
+    price: Optional[List[float]] = Field(None,
+                                         description='Prices of downsampled points')
+    open: Optional[List[float]] = None
+    high: Optional[List[float]] = None
+    low: Optional[List[float]] = None
+    close: Optional[List[float]] = None
+    count: Optional[List[int]] = Field(None,
+                                       description='Number of prices in OHLC bucket')
+
+
 class StockRs(StockRq):
     shortName: Optional[str] = Field(None,
                                      description='Asset short name',
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 from abc import ABC, abstractmethod
 from datetime import date, timedelta
@@ -12,21 +13,51 @@ from starlette import status
 
 from app.core.logging import setup_logging
 from app.core import settings
+from app.db.codecs import parse_model
+from app.db.rate_limit import RateLimitedError, RateLimiter
 from app.db.redis_pub import Redis
 from app.models.models import BondFilter, BondsRs
+from app.services.resilience import UpstreamPolicy
 
 # сетап конфиг и логгер
 setup_logging()
 logger = logging.getLogger(__name__)
 
 
+class TimeoutSession(requests.Session):
+    """
+    Сессия с таймаутом по умолчанию для каждого запроса, ISSClient таймаут не передает
+    """
+
+    def __init__(self, timeout: float):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
 class DataFetcher:
     """
     Базовый класс для получения данных из api MOEX ISS
     """
 
     @staticmethod
-    def get_data_by_reference(request_url: str, arguments: dict, reference_name: str) -> pd.DataFrame:
+    def is_upstream_failure(exc: BaseException) -> bool:
+        """
+        Ошибки ISS, которые повторяются и учитываются circuit breaker: сеть, таймауты, ошибки сервера
+        """
+        if isinstance(exc, requests.HTTPError) and exc.response is not None:
+            return exc.response.status_code >= 500 or exc.response.status_code == requests.codes.too_many_requests
+        return isinstance(exc, (requests.ConnectionError, requests.Timeout, ValueError))
+
+    @classmethod
+    def get_policy(cls) -> UpstreamPolicy:
+        return UpstreamPolicy.for_upstream('iss', is_failure=cls.is_upstream_failure)
+
+    @classmethod
+    def get_data_by_reference(cls, request_url: str, arguments: dict, reference_name: str) -> pd.DataFrame:
         """
         Функция для получения данных по облигациям в разрезе справочника и режима торгов \n
         :param request_url: базовый урл
@@ -34,12 +65,16 @@ class DataFetcher:
         :param reference_name: код справчника. Например: securities, marketdata, marketdata_yields
         :return: фрэйм с данными по инстументу
         """
-        with requests.Session() as session:
-            iss = apimoex.ISSClient(session, request_url, arguments)
-            ref_data = iss.get()
-            df = pd.DataFrame(ref_data[reference_name])
-            df.set_index('SECID', inplace=True)
-            return df
+        policy = cls.get_policy()
+
+        def request() -> dict:
+            with TimeoutSession(timeout=policy.timeout) as session:
+                return apimoex.ISSClient(session, request_url, arguments).get()
+
+        ref_data = policy.call_sync(request)
+        df = pd.DataFrame(ref_data[reference_name])
+        df.set_index('SECID', inplace=True)
+        return df
 
     @staticmethod
     def fill_nan_rule(x: float, y: float):
@@ -49,10 +84,9 @@ class DataFetcher:
             return x
 
     @staticmethod
-    async def to_cache(json_data: str) -> Optional[str]:
-        logging.debug(f'Called to_cache with json: {json_data}')
+    async def to_cache(data: List[Dict[str, Any]]) -> Optional[str]:
         redis = Redis()
-        cache = await redis.save_cache(message=json_data,
+        cache = await redis.save_cache(message=data,
                                        collection_key=settings.redis_bonds_list_cache_key,
                                        ttl_per_sec=settings.redis_bonds_list_cache_ttl)
         logging.debug(f'Saved to {cache}')
@@ -278,27 +312,49 @@ class Bonds(GetAsset):
             cached_data = await redis.get_cached()
             if cached_data:
                 logging.debug(f'Returning data from cache..')
-                model = BondsRs.parse_raw(cached_data)
+                model = parse_model(BondsRs, cached_data)
                 logging.debug(f'Model {model}')
                 return model
             else:
                 logging.debug(f'No cache data. Getting from exchange..')
-                raw_data = self.data_fetcher.fetch_raw(self.bonds_filter.boards)
+                # запросы к ISS синхронные и выполняются в executor, токены лимита берутся заранее по числу запросов
+                rate_limiter = RateLimiter.for_limit('iss')
+                await rate_limiter.check(tokens=len(self.bonds_filter.boards) * len(self.data_fetcher.references))
+                loop = asyncio.get_event_loop()
+                raw_data = await loop.run_in_executor(None, self.data_fetcher.fetch_raw, self.bonds_filter.boards)
                 logging.debug(f'Got row data')
                 pre_filtered_data = self.data_fetcher.apply_filter(raw_data)
                 logging.debug(f'Apply first filter')
-                enriched_history_data = self.history_data.enrich_history_data(pre_filtered_data)
+                enriched_history_data = await self.enrich_history_data(pre_filtered_data, rate_limiter)
                 logging.debug(f'Enrich history data')
                 filtered_data = self.history_data.apply_filter(enriched_history_data)
                 logging.debug(f'Apply second filter')
                 data_to_model = self.data_fetcher.to_dict(filtered_data)
                 model = BondsRs.parse_obj(data_to_model)
-                data_to_cache = model.json()
-                logging.debug(f'Json data is: {data_to_cache}')
+                data_to_cache = model.dict()['__root__']
                 cache_key = await self.data_fetcher.to_cache(data_to_cache)
                 logging.debug(f'Data has been cached to {cache_key}')
                 return model
+        except RateLimitedError:
+            raise
         except (ValueError, ValidationError) as e:
             raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR)
         except Exception as err:
             logging.error(err.args)
+
+    async def enrich_history_data(self, pre_filtered_data: pd.DataFrame, rate_limiter: RateLimiter) -> pd.DataFrame:
+        """
+        Обогащение историческими данными частями не больше burst лимита ISS. \n
+        Токен берется на каждый запрос истории, при нехватке токенов пополнение ожидается
+        до `iss_rate_max_wait` секунд
+        """
+        loop = asyncio.get_event_loop()
+        size = max(rate_limiter.burst, 1)
+        chunks = []
+        for start in range(0, len(pre_filtered_data), size):
+            chunk = pre_filtered_data.iloc[start:start + size]
+            await rate_limiter.acquire(tokens=len(chunk), max_wait=settings.iss_rate_max_wait)
+            chunks.append(await loop.run_in_executor(None, self.history_data.enrich_history_data, chunk))
+        if not chunks:
+            return await loop.run_in_executor(None, self.history_data.enrich_history_data, pre_filtered_data)
+        return pd.concat(chunks)
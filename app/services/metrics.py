@@ -0,0 +1,84 @@
+import asyncio
+import json
+import logging
+import time
+from typing import List
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.core.metrics import EVENT_LOOP_LAG, PROCESS, registry, render
+from app.db.redis_pub import Redis
+from app.db.scripts import WORKERS_HEARTBEAT
+from app.services.resilience import UpstreamPolicy
+from app.services.stock import StockService
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+registry.stats_gauges('redis_pool', Redis.pool_stats)
+registry.stats_gauges('near_cache', Redis.near_cache_stats)
+registry.stats_gauges('upstream', UpstreamPolicy.upstream_stats, label='provider')
+registry.stats_gauges('stock_probe', StockService.probe_stats)
+
+
+class Metrics:
+    """
+    Metrics of API and notification worker processes. \n
+    Every process samples event loop lag and publishes its metrics snapshot to Redis
+    every `metrics_publish_interval` seconds, `/metrics` of any API process merges snapshots of alive processes
+    with its own current metrics, series are labelled by `process`.
+    Metrics of a stopped process are dropped after three publish intervals
+    """
+    processes_key = 'metrics:processes'
+
+    @classmethod
+    def get_snapshot_key(cls, process: str) -> str:
+        return f'metrics:process:{process}'
+
+    @classmethod
+    def get_snapshot_ttl(cls) -> int:
+        return int(settings.metrics_publish_interval * 3) + 1
+
+    @classmethod
+    async def publish(cls, snapshot: dict):
+        storage = Redis()
+        await storage.save_cache(snapshot,
+                                 collection_key=cls.get_snapshot_key(snapshot['process']),
+                                 ttl_per_sec=cls.get_snapshot_ttl())
+        await storage.run_script(WORKERS_HEARTBEAT,
+                                 keys=[cls.processes_key],
+                                 args=[snapshot['process'], time.time(), cls.get_snapshot_ttl()])
+
+    @classmethod
+    async def run(cls):
+        """
+        Sample event loop lag every `metrics_loop_lag_interval` seconds and publish metrics snapshot
+        """
+        loop = asyncio.get_event_loop()
+        published = 0.0
+        while True:
+            started = loop.time()
+            await asyncio.sleep(settings.metrics_loop_lag_interval)
+            EVENT_LOOP_LAG.set(max(loop.time() - started - settings.metrics_loop_lag_interval, 0.0))
+            if loop.time() - published >= settings.metrics_publish_interval:
+                published = loop.time()
+                try:
+                    await cls.publish(registry.snapshot())
+                except Exception as err:
+                    logger.error(f'Metrics are not published: {err!r}')
+
+    @classmethod
+    async def collect(cls) -> str:
+        """
+        Metrics of all processes in Prometheus text format
+        """
+        snapshots: List[dict] = [registry.snapshot()]
+        storage = Redis()
+        processes = [process for process in await storage.get_sorted_set(cls.processes_key) or []
+                     if process != PROCESS]
+        if processes:
+            found = await storage.get_many_cached([cls.get_snapshot_key(process) for process in processes]) or []
+            # snapshots saved by the json codec are read back as JSON text
+            found = [json.loads(snapshot) if isinstance(snapshot, str) else snapshot for snapshot in found]
+            snapshots += [snapshot for snapshot in found if isinstance(snapshot, dict)]
+        return render(registry.merge(snapshots))
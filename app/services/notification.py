@@ -1,12 +1,14 @@
 import asyncio
+import json
 import logging
+import math
+import time
 from asyncio import CancelledError
 from datetime import datetime
 from decimal import Decimal
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from uuid import uuid4
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from fastapi import HTTPException
 from pydantic import ValidationError
 from starlette import status
@@ -14,14 +16,21 @@ from transitions.extensions import AsyncMachine
 
 from app.core import settings
 from app.core.logging import setup_logging
+from app.db.codecs import parse_model
+from app.db.history import PriceHistory
+from app.db.rate_limit import RateLimitedError, RateLimiter
 from app.db.redis_pub import Redis
+from app.db.response_cache import ResponseCache
+from app.db.scripts import (ENQUEUE_NOTIFICATION, DEQUEUE_NOTIFICATION, DELETE_NOTIFICATIONS, LIST_NOTIFICATIONS,
+                             UPDATE_NOTIFICATION_PRICE, SET_NOTIFICATION_STATE)
 from app.models.models import (StockPriceNotificationCreateRq,
                                StockPriceNotificationReadRs,
                                StockPriceNotificationReadRq,
                                TelegramUser,
                                StockPriceNotificationDeleteRq,
-                               StockRq, ActionsOnExchange,
+                               StockRq,
                                )
+from app.services.polling import AdaptivePolling
 from app.services.stock import StockService
 
 setup_logging()
@@ -30,7 +39,10 @@ logger = logging.getLogger(__name__)
 
 class NotificationStockPriceService:
     """
-    Base class to manage notification
+    Base class to manage notification. \n
+    Notification is saved as Redis hash: `body` with the created notification,
+    `symbol`, `price` and `state` fields updated by price ticks. \n
+    Notifications run by the worker are updated by the price tick of their symbol when they are due
     """
     states = ["new", "in_progress", "disabled", "done"]
 
@@ -38,15 +50,18 @@ class NotificationStockPriceService:
         self.notification: Optional[StockPriceNotificationReadRs] = None
         self.stock_service = StockService()
         self.storage = Redis()
-        self.scheduler = AsyncIOScheduler()
+        self.response_cache = ResponseCache()
         self.__price_cache_key = None
         self.__notification_cache_key = None
+        self.polling: Optional[AdaptivePolling] = None
+        # monotonic time of the next price update, the first update is done by the next symbol tick
+        self.next_update = 0.0
         self.__loop = asyncio.get_event_loop()
         self.machine = AsyncMachine(model=self, states=NotificationStockPriceService.states, initial='new')
-        self.machine.add_transition(trigger='start', source='new', dest='in_progress',
-                                    unless=['is_expired', 'is_finished'])
+        # the worker starts notifications restored as active
+        self.machine.add_transition(trigger='start', source='new', dest='in_progress')
         self.machine.add_transition(trigger='to_expired', source='*', dest='disabled', conditions='is_expired')
-        self.machine.add_transition(trigger='to_done', source='in_progress', dest='done')
+        self.machine.add_transition(trigger='to_done', source=['new', 'in_progress'], dest='done')
         self.machine.add_transition(trigger='stop', source=['new', 'in_progress'], dest='disabled')
 
     @property
@@ -61,6 +76,10 @@ class NotificationStockPriceService:
     def notification_cache_key(self, value):
         self.__notification_cache_key = value
 
+    @property
+    def response_index_key(self) -> str:
+        return ResponseCache.get_index_key(self.notification_cache_key.split(':')[1])
+
     @property
     def created_notification(self) -> Optional[StockPriceNotificationReadRs]:
         return self.notification
@@ -68,20 +87,22 @@ class NotificationStockPriceService:
     @property
     def notification_ttl(self) -> Optional[int]:
         if self.notification:
-            return (self.notification.endNotification - datetime.utcnow()).seconds
+            return max(int((self.notification.endNotification - datetime.now()).total_seconds()), 1)
         else:
             return None
 
     async def create(self, notification: StockPriceNotificationCreateRq) -> StockPriceNotificationReadRs:
         """
-        Create notification and save it to storage \n
+        Create notification, save it to storage and enqueue it for notification workers \n
         :param notification: model: StockPriceNotificationCreateRq
         :return: model: StockPriceNotificationReadRs
+        :raise RateLimitedError: if the chat creates notifications faster than `notification_create_rate_limit`
         """
+        await RateLimiter.for_limit('notification_create').check(notification.chatId)
         try:
             notification_id = str(uuid4())
             logger.info(f'Creating notification {notification_id}..')
-            self.__price_cache_key = f'stock:price:{notification.ticker}'
+            self.__price_cache_key = self.get_price_cache_key(notification.exchange.yahoo_search_symbol)
             self.notification_cache_key = self.get_notification_cache_key(notification_id=notification_id,
                                                                           chatId=notification.chatId)
 
@@ -95,19 +116,14 @@ class NotificationStockPriceService:
             logger.debug(f'Build model: {response}')
 
             await asyncio.gather(
-                self.storage.save_cache(
-                    message=str(current_stock_amount.value),
-                    collection_key=self.price_cache_key,
-                    ttl_per_sec=notification.delay
-                ),
-                self.storage.save_cache(
-                    message=response.json(),
-                    collection_key=self.notification_cache_key,
-                    ttl_per_sec=self.notification_ttl
-                ))
+                self.storage.save_cache(str(current_stock_amount.value),
+                                        collection_key=self.price_cache_key,
+                                        ttl_per_sec=settings.redis_stock_price_cache_ttl),
+                self.save_notification(response))
 
+            await self.enqueue()
+            await self.response_cache.invalidate(notification.chatId)
             logger.info(f'Notification {notification_id} is created')
-            await self.machine.dispatch('start')
             return response
         except ValidationError as ve:
             logger.error(f'Validation error while trying creating notification: {ve}')
@@ -116,60 +132,169 @@ class NotificationStockPriceService:
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
 
+    async def save_notification(self, notification: StockPriceNotificationReadRs):
+        await self.storage.save_hash(self.notification_cache_key, {
+            'body': notification.dict(),
+            'symbol': notification.exchange.yahoo_search_symbol,
+            'price': str(notification.currentPrice.value),
+            'state': notification.state,
+        }, ttl_per_sec=self.notification_ttl)
+
+    async def save_state(self):
+        responses = await self.storage.get_set(self.response_index_key) or []
+        deleted = await self.storage.run_script(SET_NOTIFICATION_STATE,
+                                                keys=[self.notification_cache_key, self.response_index_key,
+                                                      *responses],
+                                                args=[self.state])
+        await self.response_cache.forget(deleted)
+
+    async def enqueue(self):
+        """
+        Register notification in its symbol set, so the worker owning the symbol picks it up
+        :return:
+        """
+        symbol = self.created_notification.exchange.yahoo_search_symbol
+        await self.storage.run_script(ENQUEUE_NOTIFICATION,
+                                      keys=[self.get_symbol_key(symbol),
+                                            settings.redis_notification_symbols_key,
+                                            self.get_chat_index_key(self.created_notification.chatId)],
+                                      args=[self.notification_cache_key, symbol, time.time()])
+        logger.debug(f'Notification {self.created_notification.id} enqueued for symbol {symbol}')
+
+    async def dequeue(self):
+        """
+        Remove notification from its symbol set and chat index
+        :return:
+        """
+        await self.dequeue_key(storage=self.storage,
+                               symbol=self.created_notification.exchange.yahoo_search_symbol,
+                               notification_cache_key=self.notification_cache_key)
+
+    @classmethod
+    async def dequeue_key(cls, storage: Redis, symbol: str, notification_cache_key: str):
+        chat_id = notification_cache_key.split(':')[1]
+        await storage.run_script(DEQUEUE_NOTIFICATION,
+                                 keys=[cls.get_symbol_key(symbol),
+                                       settings.redis_notification_symbols_key,
+                                       cls.get_chat_index_key(chat_id)],
+                                 args=[notification_cache_key, symbol])
+
+    async def restore(self, notification_cache_key: str) -> Optional[StockPriceNotificationReadRs]:
+        """
+        Load enqueued notification from storage to run it in the worker
+        :param notification_cache_key: notification key in storage
+        :return: model: StockPriceNotificationReadRs or None if notification is expired
+        """
+        return await self.restore_fields(notification_cache_key, await self.storage.get_hash(notification_cache_key))
+
+    async def restore_fields(self, notification_cache_key: str,
+                             cached_notification: Any) -> Optional[StockPriceNotificationReadRs]:
+        """
+        Restore notification from fields read by the caller (the worker reads notifications of a symbol at once).
+        Notification saved as string (before hash layout) is saved again as hash
+        :param notification_cache_key: notification key in storage
+        :param cached_notification: hash fields or value saved as string, None if notification is expired
+        :return: model: StockPriceNotificationReadRs or None if notification is expired
+        """
+        self.notification_cache_key = notification_cache_key
+        notification = self.parse_notification(cached_notification) if cached_notification else None
+        if notification:
+            self.notification = notification
+            self.__price_cache_key = self.get_price_cache_key(notification.exchange.yahoo_search_symbol)
+            if not self.is_hash(cached_notification):
+                await self.save_notification(notification)
+                logger.info(f'Notification {notification_cache_key} is saved as hash')
+        return notification
+
+    def stop_updates(self):
+        """
+        Stop price updates, the worker forgets the notification with the next sync of its symbol
+        :return:
+        """
+        self.next_update = math.inf
+
+    def is_due(self, now: float) -> bool:
+        return self.state == 'in_progress' and self.next_update <= now
+
     async def on_enter_in_progress(self):
         """
-        Run price scheduling and done/expired checks
+        Start price polling. State is saved by the first price update. \n
+        Expiration is found by the price update, with adaptive polling which moves price updates up to
+        `notification_adaptive_max_delay` away it is checked by every symbol tick
         :return:
         """
-        try:
-            self.scheduler.add_job(self.update_price,
-                                   trigger='interval',
-                                   seconds=self.created_notification.delay,
-                                   id=f'update_price_{self.created_notification.id}',
-                                   name='update_price'
-                                   )
-
-            self.scheduler.add_job(self.is_finished,
-                                   trigger='interval',
-                                   seconds=self.created_notification.delay,
-                                   id=f'done_check_{self.created_notification.id}',
-                                   name='done_check'
-                                   )
-            self.scheduler.add_job(self.is_expired,
-                                   trigger='interval',
-                                   seconds=self.created_notification.delay,
-                                   id=f'expired_check_{self.created_notification.id}',
-                                   name='expired_check'
-                                   )
-            self.scheduler.start()
-        except CancelledError:
-            done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
-            await asyncio.gather(pending)
+        if settings.notification_polling_mode == 'adaptive':
+            self.polling = AdaptivePolling(delay=self.created_notification.delay)
 
     async def update_price(self):
         """
-        Update price and save it to storage
+        Update price and check the target. \n
+        Price comes from cache (near cache serves it without round trip) or from API
         :return:
         """
-        try:
-            notification = await self.get_cached_notification()
-            if notification:
-                actual_price = await self.get_actual_price()
-                notification.currentPrice.value = actual_price
-                notification.state = self.state
-
-                await self.storage.save_cache(
-                    message=notification.json(),
-                    collection_key=self.notification_cache_key,
-                    # ttl_per_sec=self.notification_ttl
-                )
-                logger.debug(f'Price updated: {notification.currentPrice.value}')
-            else:
-                logger.debug(f'Cant get notification from cache while updating price!')
-                await self.machine.dispatch('to_expired')
-        except CancelledError:
-            done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
-            await asyncio.gather(pending)
+        actual_price = await self.get_actual_price()
+        if actual_price is not None:
+            await self.update_prices(self.storage, [self], actual_price)
+
+    @classmethod
+    async def update_prices(cls, storage: Redis, services: List['NotificationStockPriceService'], price: Decimal):
+        """
+        Apply price of a symbol to its notifications in two round trips whatever their number:
+        response indexes of their chats are read, then Lua scripts set price and state fields
+        and move notifications to done atomically, so notifications are neither read nor rewritten by the tick
+        :param storage: storage to run the scripts
+        :param services: notifications to update
+        :param price: actual price
+        """
+        index_keys = list(dict.fromkeys(service.response_index_key for service in services))
+        async with storage.pipeline() as pipe:
+            replies = [pipe.smembers(key) for key in index_keys]
+        responses = {key: reply.result() for key, reply in zip(index_keys, replies)}
+        calls = []
+        for service in services:
+            action = service.created_notification.action
+            calls.append(([service.notification_cache_key, service.response_index_key,
+                           *responses[service.response_index_key]],
+                          [str(price), str(service.created_notification.targetPrice),
+                           str(action.value) if action else '']))
+        results = await storage.run_scripts(UPDATE_NOTIFICATION_PRICE, calls) or []
+        for service, result in zip(services, results):
+            if isinstance(result, Exception):
+                logger.error(f'Price of {service.notification_cache_key} is not updated: {result!r}')
+                continue
+            await service.apply_price(price, result)
+
+    async def apply_price(self, price: Decimal, result: List[Any]):
+        """
+        Move notification according to the result of price update script and schedule its next update
+        """
+        state, changed, *deleted = result
+        await self.response_cache.forget(deleted[0] if deleted else None)
+        logger.debug(f'Price updated: {price}, state: {state}')
+        if not state:
+            logger.debug('Cant get notification from cache while updating price!')
+            await self.machine.dispatch('to_expired')
+        elif state == 'done' and changed:
+            await self.machine.dispatch('to_done')
+        elif state != 'in_progress':
+            logger.debug(f'Notification {self.created_notification.id} is already {state}')
+            self.stop_updates()
+        else:
+            self.schedule_price_update(price)
+
+    def schedule_price_update(self, price: Decimal):
+        """
+        Schedule next price update after the notification delay or, with adaptive polling,
+        according to the distance to the target price
+        :param price: actual price
+        :return:
+        """
+        interval = self.created_notification.delay
+        if self.polling:
+            self.polling.observe(float(price))
+            interval = max(self.polling.next_interval(float(price), self.created_notification.targetPrice), interval)
+            logger.debug(f'Next price update of {self.created_notification.id} in {interval} sec')
+        self.next_update = time.monotonic() + interval
 
     async def get_cached_price(self) -> Optional[Decimal]:
         try:
@@ -185,80 +310,114 @@ class NotificationStockPriceService:
 
     async def get_cached_notification(self) -> Optional[StockPriceNotificationReadRs]:
         try:
-            notification_json = await self.storage.get_cached(self.notification_cache_key)
-            notification: StockPriceNotificationReadRs = StockPriceNotificationReadRs.parse_raw(notification_json)
+            cached_notification = await self.storage.get_hash(self.notification_cache_key)
+            return self.parse_notification(cached_notification)
+        except CancelledError:
+            done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
+            await asyncio.gather(pending)
+
+    @staticmethod
+    def is_hash(cached_notification: Any) -> bool:
+        return isinstance(cached_notification, dict) and 'body' in cached_notification
+
+    @classmethod
+    def parse_notification(cls, cached_notification: Any) -> Optional[StockPriceNotificationReadRs]:
+        """
+        Build notification from hash fields or from value saved as string before hash layout
+        """
+        try:
+            if cls.is_hash(cached_notification):
+                cached_notification = cls.merge_fields(cached_notification)
+            notification: StockPriceNotificationReadRs = parse_model(StockPriceNotificationReadRs, cached_notification)
             logger.debug(f'Getting cached notification: {notification.id}')
             return notification
         except ValidationError:
-            logger.warning(f'Cant deserialize cached notification. Probably it is no longer exist')
+            logger.warning('Cant deserialize cached notification. Probably it is no longer exist')
             return None
-        except CancelledError:
-            done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
-            await asyncio.gather(pending)
 
-    async def get_actual_price(self) -> Decimal:
+    @staticmethod
+    def merge_fields(fields: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Getting actual price from API or return in from cache
-        :return: Decimal
+        Apply price and state fields to the notification body
+        """
+        body = fields['body']
+        if isinstance(body, (str, bytes)):
+            body = json.loads(body)
+        body = dict(body)
+        if fields.get('price') is not None:
+            body['currentPrice'] = {**body.get('currentPrice', {}), 'value': fields['price']}
+        if fields.get('state') is not None:
+            body['state'] = fields['state']
+        return body
+
+    def get_actual_cached_price(self,
+                                cached_price: Optional[str],
+                                ttl_cached_price: Optional[int]) -> Optional[Decimal]:
+        """
+        Cached price is actual if it is younger than notification delay
+        :return: cached price or None if it is not actual
+        """
+        price_age = settings.redis_stock_price_cache_ttl - (ttl_cached_price or 0)
+        if not (ttl_cached_price and cached_price) or price_age >= self.created_notification.delay:
+            return None
+        logger.debug('Cached price is actual')
+        return Decimal(cached_price)
+
+    async def get_actual_price(self) -> Optional[Decimal]:
+        """
+        Getting actual price from API or return in from cache. \n
+        Cached price is actual if it is younger than notification delay
+        :return: Decimal or None if price is not available
         """
         try:
-            ttl_cached_price = await self.storage.get_key_ttl(self.price_cache_key)
-            cached_price = await self.get_cached_price()
-            if not (ttl_cached_price or cached_price) or ttl_cached_price > self.created_notification.delay:
-                logger.debug(f'Cached price is not actual. Getting price..')
+            cached_price, ttl_cached_price = await self.storage.get_cached_with_ttl(self.price_cache_key) or (None, None)
+            actual_price = self.get_actual_cached_price(cached_price, ttl_cached_price)
+            if actual_price is None:
+                logger.debug('Cached price is not actual. Getting price..')
                 current_price = await self.stock_service.get_stock_price(StockRq(**self.created_notification.dict()))
-                await self.storage.save_cache(str(current_price.value), collection_key=self.price_cache_key)
+                if not current_price:
+                    return None
+                PriceHistory.append(self.created_notification.exchange.yahoo_search_symbol, current_price.value)
+                await self.storage.save_cache(str(current_price.value),
+                                              collection_key=self.price_cache_key,
+                                              ttl_per_sec=settings.redis_stock_price_cache_ttl)
                 return Decimal(current_price.value)
             else:
-                logger.debug(f'Cached price is actual')
-                return cached_price
+                return actual_price
+        except RateLimitedError as exc:
+            logger.warning(f'Price of {self.created_notification.exchange.yahoo_search_symbol} is not requested: '
+                           f'{exc!r}')
         except CancelledError:
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
 
-    async def is_finished(self) -> bool:
-        notification = await self.get_cached_notification()
-        if not notification:
-            logger.debug(f'Done check return {False}!')  # expired
-            return False
-        elif notification.currentPrice.value == self.created_notification.targetPrice or \
-                (self.created_notification.action == str(ActionsOnExchange.buy.value)
-                 and notification.currentPrice.value <= self.created_notification.targetPrice) or \
-                (self.created_notification.action == str(ActionsOnExchange.sell.value)
-                 and notification.currentPrice.value >= self.created_notification.targetPrice):
-            logger.debug(f'Done check return {True}!')
-            asyncio.create_task(self.machine.dispatch('to_done'))
-            return True
-        else:
-            logger.debug(f'Done check return {False}!')
-            return False
-
     async def on_enter_done(self):
         try:
             logger.info(f'Notification {self.created_notification.id} is Done! Sending message..')
             asyncio.create_task(self.send())
-            self.scheduler.shutdown()
+            self.stop_updates()
+            await self.dequeue()
         except CancelledError:
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
 
-    async def is_expired(self):
-        try:
-            notification = await self.get_cached_notification()
-            if notification:
-                logger.debug(f'Notification {notification.id} is no expired')
-                return False
-            else:
-                logger.debug(f'Can not return cached notification: notification is expired')
-                return True
-        except ValidationError:
-            logger.error(f'Error getting cached notification!')
+    async def is_expired(self) -> bool:
+        """
+        Notification is expired when its key is gone from storage (ttl is the notification end)
+        """
+        exists = await self.storage.exists(self.notification_cache_key)
+        if exists is False:
+            logger.debug(f'Notification {self.notification_cache_key} is expired')
+            return True
+        return False
 
     async def on_enter_disabled(self):
         try:
             logger.info(f'Notification {self.created_notification.id} is Disabled! Sending message..')
+            self.stop_updates()
+            await self.save_state()
             asyncio.create_task(self.send())
-            self.scheduler.shutdown()
+            await self.dequeue()
         except CancelledError:
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
@@ -269,14 +428,10 @@ class NotificationStockPriceService:
         :return:
         """
         try:
-            notification_json = await self.storage.get_cached(self.notification_cache_key)
-            if notification_json:
-                notification: StockPriceNotificationReadRs = StockPriceNotificationReadRs.parse_raw(notification_json)
-            else:
-                notification = self.created_notification
+            notification = await self.get_cached_notification() or self.created_notification
             notification.state = self.state
             logger.debug(f'Sending message {notification.json()}')
-            await self.storage.start_publish(message=notification.json(), queue=settings.redis_notification_queue)
+            await self.storage.start_publish(message=notification.json(), stream=settings.redis_notification_stream)
         except CancelledError:
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
@@ -292,9 +447,8 @@ class NotificationStockPriceService:
                                                                           chatId=notification.chatId)
             cached_notification = await self.get_cached_notification()
             if cached_notification:
-                message = StockPriceNotificationReadRs(**cached_notification.dict(), state=self.state)
-                logger.debug(f'Return notification {message}')
-                return message
+                logger.debug(f'Return notification {cached_notification}')
+                return cached_notification
             else:
                 raise HTTPException(
                     status_code=404,
@@ -308,22 +462,35 @@ class NotificationStockPriceService:
     def get_notification_cache_key(cls, chatId: str, notification_id: str = '*') -> str:
         return f'notification:{chatId}:{notification_id}'
 
+    @classmethod
+    def get_chat_index_key(cls, chatId: str) -> str:
+        return f'notification:chat:{chatId}'
+
+    @classmethod
+    def get_symbol_key(cls, symbol: str) -> str:
+        return f'notification:symbol:{symbol}'
+
+    @classmethod
+    def get_price_cache_key(cls, symbol: str) -> str:
+        return StockService.get_price_cache_key(symbol)
+
     async def get_many(self, user: TelegramUser) -> List[StockPriceNotificationReadRs]:
         """
-        Get all user notification \n
+        Get all user notification in two round trips whatever their number: the index is read,
+        then Lua script returns fields of its notifications and drops expired ones from the index \n
         :param user: model: TelegramUser
         :return: List[StockPriceNotificationReadRs]
         """
         try:
-            row_notifications = await self.storage.search_by_pattern(
-                self.get_notification_cache_key(chatId=user.chatId))
+            index_key = self.get_chat_index_key(user.chatId)
+            keys = await self.storage.get_sorted_set(index_key)
+            if not keys:
+                return []
+            rows = await self.storage.run_script(LIST_NOTIFICATIONS, keys=[index_key, *keys], encoding=None)
             response = []
-            for item in row_notifications:
-                try:
-                    obj = StockPriceNotificationReadRs.parse_raw(item)
-                except ValidationError as ve:
-                    logger.warning(f'Error trying deserialize {item}: {ve}')
-                else:
+            for row in rows or []:
+                obj = self.parse_notification(Redis.decode_hash(dict(zip(row[::2], row[1::2]))))
+                if obj:
                     response.append(obj)
             return response
         except CancelledError:
@@ -331,7 +498,66 @@ class NotificationStockPriceService:
             await asyncio.gather(pending)
 
     async def delete_one(self, notification: StockPriceNotificationDeleteRq):
-        raise NotImplementedError
+        """
+        Delete notification by user chatId and notification id
+        :param notification: model: StockPriceNotificationDeleteRq
+        :return: None
+        """
+        cache_key = self.get_notification_cache_key(notification_id=notification.id, chatId=notification.chatId)
+        deleted = await self.delete_keys(chatId=notification.chatId, notification_cache_keys=[cache_key])
+        if not deleted:
+            raise HTTPException(
+                status_code=404,
+                detail=f'Item {notification.id} not found'
+            )
+
+    async def delete_many(self, user: TelegramUser) -> int:
+        """
+        Delete all user notification \n
+        :param user: model: TelegramUser
+        :return: count of deleted notifications
+        """
+        deleted = await self.delete_keys(chatId=user.chatId)
+        return len(deleted)
 
-    async def delete_many(self, user: TelegramUser):
-        raise NotImplementedError
+    async def delete_keys(self, chatId: str,
+                          notification_cache_keys: Optional[List[str]] = None) -> List[StockPriceNotificationReadRs]:
+        """
+        Atomically delete notifications with index entries and symbol subscriptions,
+        then cancel worker jobs and publish disabled events. Notifications are read first,
+        so the script gets their symbol sets as declared keys
+        :param chatId: telegram chat id
+        :param notification_cache_keys: notifications to delete, all chat notifications if not passed
+        :return: deleted notifications
+        """
+        index_key = self.get_chat_index_key(chatId)
+        keys = notification_cache_keys or await self.storage.get_sorted_set(index_key) or []
+        if not keys:
+            return []
+        notifications, symbols = {}, []
+        for key, cached in zip(keys, await self.storage.get_many_hashes(keys)):
+            notification = self.parse_notification(cached) if cached else None
+            if notification:
+                notifications[key] = notification
+            if self.is_hash(cached) and cached.get('symbol'):
+                symbols.append(cached['symbol'])
+            else:
+                symbols.append(notification.exchange.yahoo_search_symbol if notification else '')
+        symbol_keys = [self.get_symbol_key(symbol) for symbol in dict.fromkeys(symbols) if symbol]
+        deleted_keys = await self.storage.run_script(DELETE_NOTIFICATIONS,
+                                                     keys=[index_key, settings.redis_notification_symbols_key,
+                                                           *keys, *symbol_keys],
+                                                     args=[len(keys), self.get_symbol_key(''), *symbols])
+        deleted = [notifications[key] for key in deleted_keys or [] if key in notifications]
+        if not deleted:
+            return deleted
+
+        cancelled = [{'key': self.get_notification_cache_key(chatId=item.chatId, notification_id=item.id),
+                      'symbol': item.exchange.yahoo_search_symbol} for item in deleted]
+        await self.storage.publish(settings.redis_notification_control_channel, json.dumps(cancelled))
+        await self.response_cache.invalidate(chatId)
+        for item in deleted:
+            item.state = 'disabled'
+            await self.storage.start_publish(message=item.json(), stream=settings.redis_notification_stream)
+        logger.info(f'Deleted {len(deleted)} notifications of chat {chatId}')
+        return deleted
@@ -0,0 +1,280 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+from uuid import uuid4
+
+from aioredis import RedisError
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_SUBMITTED, JobEvent
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.core.metrics import ACTIVE_NOTIFICATIONS, SCHEDULER_LAG
+from app.db.redis_pub import Redis
+from app.db.scripts import ACQUIRE_LEASES, RELEASE_LEASES, WORKERS_HEARTBEAT
+from app.services.notification import NotificationStockPriceService
+from app.services.sharding import HashRing
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+class NotificationWorker:
+    """
+    Worker which runs notifications of the symbols it owns. \n
+    Symbols are assigned to alive workers by consistent hashing,
+    ownership is confirmed by lease in Redis, so a symbol is never polled by two workers
+    and is taken over by another worker after lease expiration. \n
+    Every owned symbol has one price tick job which requests the price once and updates all due notifications
+    of the symbol, so the number of jobs and round trips does not grow with notifications
+    """
+
+    def __init__(self, worker_id: Optional[str] = None):
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}'
+        self.storage = Redis()
+        self.scheduler = AsyncIOScheduler()
+        self.ring = HashRing(virtual_nodes=settings.notification_worker_virtual_nodes)
+        self.owned_symbols: Set[str] = set()
+        self.notifications: Dict[str, Dict[str, NotificationStockPriceService]] = {}
+        self.stopping = asyncio.Event()
+        self.running_jobs = 0
+        self.jobs_idle = asyncio.Event()
+        self.jobs_idle.set()
+        self.scheduler.add_listener(self.count_running_jobs, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+    @classmethod
+    def get_lease_key(cls, symbol: str) -> str:
+        return f'notification:lease:{symbol}'
+
+    @classmethod
+    def get_tick_job_id(cls, symbol: str) -> str:
+        return f'price_tick_{symbol}'
+
+    async def heartbeat(self) -> Optional[List[str]]:
+        """
+        Register worker heartbeat
+        :return: list of alive workers
+        """
+        return await self.storage.run_script(WORKERS_HEARTBEAT,
+                                             keys=[settings.redis_notification_workers_key],
+                                             args=[self.worker_id,
+                                                   time.time(),
+                                                   settings.notification_worker_lease_ttl])
+
+    def rebuild_ring(self, workers: Iterable[str]):
+        workers = set(workers) | {self.worker_id}
+        if workers != set(self.ring.nodes):
+            logger.info(f'Workers changed: {sorted(workers)}')
+            self.ring = HashRing(workers, virtual_nodes=settings.notification_worker_virtual_nodes)
+
+    async def acquire(self, symbols: Iterable[str]) -> Optional[Set[str]]:
+        """
+        Acquire or renew leases for symbols
+        :return: symbols leased by the worker or None on storage error
+        """
+        symbols = sorted(symbols)
+        if not symbols:
+            return set()
+        flags = await self.storage.run_script(ACQUIRE_LEASES,
+                                              keys=[self.get_lease_key(s) for s in symbols],
+                                              args=[self.worker_id, settings.notification_worker_lease_ttl * 1000])
+        if flags is None:
+            return None
+        return {symbol for symbol, flag in zip(symbols, flags) if flag}
+
+    async def release(self, symbols: Iterable[str]):
+        symbols = list(symbols)
+        if symbols:
+            await self.storage.run_script(RELEASE_LEASES,
+                                          keys=[self.get_lease_key(s) for s in symbols],
+                                          args=[self.worker_id])
+
+    async def rebalance(self):
+        """
+        Refresh workers membership and symbols ownership, then sync notifications of owned symbols
+        :return:
+        """
+        workers = await self.heartbeat()
+        if workers is None:
+            logger.warning(f'Worker {self.worker_id} can not send heartbeat, skip rebalance')
+            return
+        self.rebuild_ring(workers)
+        symbols = await self.storage.get_set(settings.redis_notification_symbols_key) or []
+        wanted = {symbol for symbol in symbols if self.ring.get_node(symbol) == self.worker_id}
+        owned = await self.acquire(wanted)
+        if owned is None:
+            return
+        lost = self.owned_symbols - owned
+        for symbol in lost:
+            self.drop_symbol(symbol)
+        await self.release(lost)
+        if lost or owned - self.owned_symbols:
+            logger.info(f'Worker {self.worker_id} owns {len(owned)} symbols, released {len(lost)}')
+        self.owned_symbols = owned
+        await asyncio.gather(*[self.sync_symbol(symbol) for symbol in owned])
+        ACTIVE_NOTIFICATIONS.set(sum(len(running) for running in self.notifications.values()))
+
+    async def sync_symbol(self, symbol: str):
+        """
+        Start new notifications of the symbol and forget finished ones.
+        New notifications are read in one round trip
+        :param symbol: yahoo search symbol
+        :return:
+        """
+        keys = set(await self.storage.get_set(NotificationStockPriceService.get_symbol_key(symbol)) or [])
+        running = self.notifications.setdefault(symbol, {})
+        for key in set(running) - keys:
+            running.pop(key).stop_updates()
+        new = sorted(keys - set(running))
+        if new:
+            cached = await self.storage.get_many_hashes(new)
+            if cached is not None:
+                for key, fields in zip(new, cached):
+                    await self.start_notification(symbol, key, fields)
+        self.schedule_tick(symbol)
+
+    async def start_notification(self, symbol: str, notification_cache_key: str, cached_notification):
+        service = NotificationStockPriceService()
+        notification = await service.restore_fields(notification_cache_key, cached_notification)
+        if not notification or notification.state in ('done', 'disabled'):
+            logger.debug(f'Notification {notification_cache_key} is no longer active')
+            await NotificationStockPriceService.dequeue_key(storage=self.storage,
+                                                            symbol=symbol,
+                                                            notification_cache_key=notification_cache_key)
+            return
+        self.notifications[symbol][notification_cache_key] = service
+        await service.machine.dispatch('start')
+
+    def schedule_tick(self, symbol: str):
+        """
+        Run price tick of the symbol every smallest delay of its notifications, remove it if there are none.
+        First tick is at random moment within the delay, so symbols restored together do not tick together
+        """
+        job_id = self.get_tick_job_id(symbol)
+        job = self.scheduler.get_job(job_id)
+        running = self.notifications.get(symbol)
+        if not running:
+            if job:
+                job.remove()
+            return
+        interval = min(service.created_notification.delay for service in running.values())
+        if job and job.trigger.interval == timedelta(seconds=interval):
+            return
+        start_date = datetime.now(self.scheduler.timezone) + timedelta(seconds=random.uniform(0, interval))
+        self.scheduler.add_job(self.tick,
+                               trigger='interval',
+                               seconds=interval,
+                               start_date=start_date,
+                               args=[symbol, interval],
+                               id=job_id,
+                               name='price_tick',
+                               replace_existing=True)
+
+    async def tick(self, symbol: str, interval: int):
+        """
+        Request the price of the symbol once and apply it to due notifications.
+        Notifications due within half of the interval are updated by this tick, not by the next one.
+        With adaptive polling other notifications are checked for expiration in one round trip
+        """
+        running = list(self.notifications.get(symbol, {}).values())
+        now = time.monotonic()
+        due = [service for service in running if service.is_due(now + interval / 2)]
+        waiting = [service for service in running
+                   if service.polling and service.state == 'in_progress' and service not in due]
+        if waiting:
+            async with self.storage.pipeline() as pipe:
+                found = [pipe.exists(service.notification_cache_key) for service in waiting]
+            for service, exists in zip(waiting, found):
+                if not exists.result():
+                    await service.machine.dispatch('to_expired')
+        if not due:
+            return
+        # the price is actual for every due notification if it is actual for the smallest delay
+        price = await min(due, key=lambda service: service.created_notification.delay).get_actual_price()
+        if price is not None:
+            await NotificationStockPriceService.update_prices(self.storage, due, price)
+
+    async def listen_control(self):
+        """
+        Stop jobs of deleted notifications right away, without waiting for the next rebalance
+        :return:
+        """
+        while True:
+            try:
+                async for message in self.storage.subscribe(settings.redis_notification_control_channel):
+                    for item in json.loads(message):
+                        service = self.notifications.get(item['symbol'], {}).pop(item['key'], None)
+                        if service:
+                            service.stop_updates()
+                            self.schedule_tick(item['symbol'])
+                            logger.info(f'Notification {item["key"]} is cancelled')
+            except (RedisError, OSError, ValueError, KeyError) as err:
+                logger.error(f'Control channel error: {err.args}')
+            await asyncio.sleep(settings.notification_worker_heartbeat_interval)
+
+    def count_running_jobs(self, event: JobEvent):
+        if event.code == EVENT_JOB_SUBMITTED:
+            self.running_jobs += len(event.scheduled_run_times)
+            now = datetime.now(self.scheduler.timezone)
+            SCHEDULER_LAG.set(max((now - run_time).total_seconds() for run_time in event.scheduled_run_times))
+        else:
+            self.running_jobs = max(self.running_jobs - 1, 0)
+        if self.running_jobs:
+            self.jobs_idle.clear()
+        else:
+            self.jobs_idle.set()
+
+    def drop_symbol(self, symbol: str):
+        for service in self.notifications.pop(symbol, {}).values():
+            service.stop_updates()
+        self.schedule_tick(symbol)
+
+    def stop(self):
+        """
+        Ask worker to finish its run loop. Worker is not cancelled, so storage calls in progress are completed
+        :return:
+        """
+        self.stopping.set()
+
+    async def run(self):
+        logger.info(f'Notification worker {self.worker_id} is started')
+        self.scheduler.start()
+        control = asyncio.create_task(self.listen_control())
+        try:
+            while not self.stopping.is_set():
+                try:
+                    await self.rebalance()
+                except Exception as err:
+                    logger.error(f'Rebalance error: {err.args}')
+                try:
+                    await asyncio.wait_for(self.stopping.wait(), timeout=settings.notification_worker_heartbeat_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            control.cancel()
+            await self.shutdown()
+
+    async def shutdown(self):
+        """
+        Stop notifications and release leases, so other workers take over symbols immediately
+        :return:
+        """
+        for symbol in list(self.owned_symbols):
+            self.drop_symbol(symbol)
+        await self.release(self.owned_symbols)
+        await self.storage.remove_from_sorted_set(settings.redis_notification_workers_key, self.worker_id)
+        self.owned_symbols = set()
+        # scheduler shutdown cancels running jobs, let them finish instead
+        try:
+            await asyncio.wait_for(self.jobs_idle.wait(), timeout=settings.notification_worker_lease_ttl)
+        except asyncio.TimeoutError:
+            logger.warning(f'Worker {self.worker_id} stops with {self.running_jobs} running jobs')
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        logger.info(f'Notification worker {self.worker_id} is stopped')
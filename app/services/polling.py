@@ -0,0 +1,64 @@
+import math
+import time
+from collections import deque
+from typing import Deque, Optional, Tuple
+
+from app.core import settings
+
+
+class AdaptivePolling:
+    """
+    Poll interval policy for a notification. \n
+    Price is treated as a random walk: to move by `distance` with per-delay volatility `vol`
+    it needs about (distance / vol) ^ 2 delays. The policy polls rarely while the target
+    is more than `z_score` standard deviations away and down to the notification delay near it.
+    """
+    min_observations = 3
+    min_volatility = 0.0005
+
+    def __init__(self,
+                 delay: int,
+                 max_delay: int = settings.notification_adaptive_max_delay,
+                 z_score: float = settings.notification_adaptive_z_score,
+                 window: int = settings.notification_adaptive_window):
+        self.delay = delay
+        self.max_delay = max(max_delay, delay)
+        self.z_score = z_score
+        self.prices: Deque[Tuple[float, float]] = deque(maxlen=window)
+
+    def observe(self, price: float, timestamp: Optional[float] = None):
+        """
+        Add polled price to the volatility window
+        """
+        if price and price > 0:
+            self.prices.append((time.time() if timestamp is None else timestamp, float(price)))
+
+    @property
+    def volatility(self) -> Optional[float]:
+        """
+        Standard deviation of log price change per notification delay
+        """
+        if len(self.prices) < self.min_observations:
+            return None
+        squares = []
+        points = list(self.prices)
+        for (t0, p0), (t1, p1) in zip(points, points[1:]):
+            if t1 > t0:
+                squares.append(math.log(p1 / p0) ** 2 / ((t1 - t0) / self.delay))
+        if not squares:
+            return None
+        return math.sqrt(sum(squares) / len(squares))
+
+    def next_interval(self, price: float, target: float) -> int:
+        """
+        Seconds before the next price poll
+        :param price: current price
+        :param target: notification target price
+        :return: interval between notification delay and max delay
+        """
+        volatility = self.volatility
+        if volatility is None or not price or price <= 0 or target <= 0:
+            return self.delay
+        distance = abs(math.log(target / float(price)))
+        steps = (distance / (self.z_score * max(volatility, self.min_volatility))) ** 2
+        return int(min(self.delay * max(steps, 1), self.max_delay))
@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.core.metrics import UPSTREAM_LATENCY
+from app.db.rate_limit import RateLimitedError, RateLimiter
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class CircuitOpenError(Exception):
+    """
+    Upstream is not requested: its circuit breaker is open
+    """
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f'Circuit of {upstream} is open, retry after {retry_after:.1f}s')
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` failures in a row and rejects calls for `reset_timeout` seconds,
+    then lets one trial call through (half-open): its success closes the circuit, failure opens it again
+    """
+    closed = 'closed'
+    open = 'open'
+    half_open = 'half_open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.closed
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.open and not self.retry_after():
+                self.state, self._trial = self.half_open, False
+            if self.state == self.closed:
+                return True
+            if self.state == self.half_open and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def release_trial(self):
+        """
+        Trial call ended without an outcome (cancelled or not sent), let the next call try the half-open circuit
+        """
+        with self._lock:
+            if self.state == self.half_open:
+                self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self.state, self.failures, self._trial = self.closed, 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.half_open or self.failures >= self.failure_threshold:
+                if self.state != self.open:
+                    self.opened += 1
+                self.state, self.opened_at, self._trial = self.open, time.monotonic(), False
+
+
+class UpstreamPolicy:
+    """
+    Call policy of an upstream API: concurrency cap, timeout per attempt, circuit breaker,
+    retries with full jitter backoff, a hedged request for tail latency and a rate limit shared by all processes. \n
+    `is_failure` tells upstream failures (retried and counted by the breaker) from errors of the request itself,
+    which are raised at once. A hedged attempt is started only if the concurrency cap has a free slot
+    """
+    _policies: Dict[str, 'UpstreamPolicy'] = {}
+
+    def __init__(self,
+                 name: str,
+                 max_concurrency: int,
+                 timeout: float,
+                 retries: int = 0,
+                 retry_backoff: float = 0.1,
+                 hedge_after: float = 0.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 is_failure: Callable[[BaseException], bool] = lambda exc: True):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.hedge_after = hedge_after
+        self.is_failure = is_failure
+        self.rate_limiter = rate_limiter
+        self.breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout)
+        self.calls = 0
+        self.failures = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self._semaphore: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    @classmethod
+    def for_upstream(cls,
+                     name: str,
+                     is_failure: Callable[[BaseException], bool] = lambda exc: True) -> 'UpstreamPolicy':
+        """
+        Policy shared by callers of the upstream, configured by `{name}_*` settings
+        """
+        if name not in cls._policies:
+            cls._policies[name] = cls(name=name,
+                                      max_concurrency=getattr(settings, f'{name}_max_concurrency'),
+                                      timeout=getattr(settings, f'{name}_timeout'),
+                                      retries=getattr(settings, f'{name}_retries'),
+                                      retry_backoff=getattr(settings, f'{name}_retry_backoff'),
+                                      hedge_after=getattr(settings, f'{name}_hedge_after'),
+                                      failure_threshold=getattr(settings, f'{name}_breaker_failures'),
+                                      reset_timeout=getattr(settings, f'{name}_breaker_reset'),
+                                      rate_limiter=RateLimiter.for_limit(name),
+                                      is_failure=is_failure)
+        return cls._policies[name]
+
+    @classmethod
+    def upstream_stats(cls) -> Dict[str, dict]:
+        return {name: policy.stats() for name, policy in cls._policies.items()}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_event_loop()
+        if self._semaphore is None or self._semaphore[0] is not loop:
+            self._semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return self._semaphore[1]
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, self.retry_backoff * 2 ** attempt)
+
+    def check_circuit(self):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError(self.name, self.breaker.retry_after())
+
+    async def take_token(self):
+        """
+        :raise RateLimitedError: if the upstream rate limit is exceeded
+        """
+        if self.rate_limiter:
+            await self.rate_limiter.check()
+
+    async def admit(self):
+        """
+        Check the circuit and take a rate limit token. If the token is not taken,
+        a half-open trial given by the circuit is released
+        :raise CircuitOpenError: if circuit is open
+        :raise RateLimitedError: if the upstream rate limit is exceeded
+        """
+        self.check_circuit()
+        try:
+            await self.take_token()
+        except BaseException:
+            self.breaker.release_trial()
+            raise
+
+    def record(self, exc: Optional[BaseException]) -> bool:
+        """
+        Count attempt result in the breaker
+        :return: True if attempt failed because of the upstream
+        """
+        if exc is None or not self.is_failure(exc):
+            self.breaker.record_success()
+            return False
+        self.failures += 1
+        self.breaker.record_failure()
+        return True
+
+    async def call(self, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call upstream with the policy
+        :param request: factory of a request coroutine, called once per attempt
+        :return: result of the first successful attempt
+        :raise CircuitOpenError: if circuit is open
+        :raise RateLimitedError: if the upstream rate limit is exceeded
+        """
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            await self.admit()
+            try:
+                return await self.hedged_attempt(request)
+            except Exception as exc:
+                if not self.is_failure(exc) or attempt == self.retries:
+                    raise
+                logger.warning(f'{self.name} attempt {attempt + 1} failed: {exc!r}')
+                self.retried += 1
+                await asyncio.sleep(self.backoff(attempt))
+
+    async def attempt(self, request: Callable[[], Awaitable[T]]) -> T:
+        try:
+            async with self.semaphore:
+                self.in_flight += 1
+                started, outcome = time.perf_counter(), 'error'
+                try:
+                    result = await asyncio.wait_for(request(), timeout=self.timeout)
+                    outcome = 'ok'
+                except asyncio.CancelledError:
+                    # not an upstream outcome, CancelledError is an Exception before Python 3.8
+                    outcome = 'cancelled'
+                    raise
+                except Exception as exc:
+                    self.record(exc)
+                    raise
+                finally:
+                    self.in_flight -= 1
+                    UPSTREAM_LATENCY.observe(time.perf_counter() - started, self.name, outcome)
+                self.record(None)
+                return result
+        except asyncio.CancelledError:
+            # cancelled while waiting for a slot or for the answer
+            self.breaker.release_trial()
+            raise
+
+    async def hedged_attempt(self, request: Callable[[], Awaitable[T]]) -> T:
+        """
+        Attempt which sends a second request if the first one is not answered in `hedge_after` seconds.
+        The first answer wins, the other request is cancelled. The second request is not sent
+        if the circuit is not closed (the first request is its trial) or the rate limit is exceeded
+        """
+        if not self.hedge_after:
+            return await self.attempt(request)
+        first = asyncio.ensure_future(self.attempt(request))
+        second = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+            if done or self.semaphore.locked() or self.breaker.state != CircuitBreaker.closed:
+                return await first
+            try:
+                await self.take_token()
+            except RateLimitedError:
+                return await first
+            self.hedged += 1
+            second = asyncio.ensure_future(self.attempt(request))
+            tasks = {first, second}
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception():
+                        self.hedge_wins += task is second
+                        return task.result()
+            return await first
+        finally:
+            started = [task for task in (first, second) if task]
+            for task in started:
+                task.cancel()
+            await asyncio.gather(*started, return_exceptions=True)
+
+    def call_sync(self, request: Callable[[], T]) -> T:
+        """
+        Blocking variant of `call` for synchronous clients. Requests are not hedged,
+        the timeout must be applied by the client itself and the rate limit is checked by the async caller.
+        Backoff sleeps the calling thread, so the async caller runs it with `loop.run_in_executor`
+        """
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            self.check_circuit()
+            try:
+                with self._sync_semaphore:
+                    self.in_flight += 1
+                    started, outcome = time.perf_counter(), 'error'
+                    try:
+                        result = request()
+                        outcome = 'ok'
+                    finally:
+                        self.in_flight -= 1
+                        UPSTREAM_LATENCY.observe(time.perf_counter() - started, self.name, outcome)
+            except Exception as exc:
+                if not self.record(exc) or attempt == self.retries:
+                    raise
+                logger.warning(f'{self.name} attempt {attempt + 1} failed: {exc!r}')
+                self.retried += 1
+                time.sleep(self.backoff(attempt))
+            else:
+                self.record(None)
+                return result
+
+    def stats(self) -> dict:
+        return {
+            'state': self.breaker.state,
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'failures': self.failures,
+            'retried': self.retried,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'rejected': self.rejected,
+            'opened': self.breaker.opened,
+        }
@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import csv
+import json
+import logging
+from itertools import islice
+from typing import Dict, Iterable, List, NamedTuple, Set
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.db.rate_limit import RateLimitedError, RateLimiter
+from app.db.redis_pub import Redis
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Cyrillic letters which look like Latin ones, tickers typed with Russian keyboard layout
+LOOKALIKES = str.maketrans('АВЕКМНОРСТХУ', 'ABEKMHOPCTXY')
+
+
+class Security(NamedTuple):
+    ticker: str
+    name: str
+    yahoo_symbol: str
+    exchange: str
+
+
+def is_one_typo(a: str, b: str) -> bool:
+    """
+    Strings differ by one insertion, deletion, substitution or transposition of adjacent letters
+    """
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diff = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diff) == 1 or (len(diff) == 2 and diff[1] == diff[0] + 1
+                                  and a[diff[0]] == b[diff[1]] and a[diff[1]] == b[diff[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    i = next((i for i in range(len(a)) if a[i] != b[i]), len(a))
+    return a[i:] == b[i + 1:]
+
+
+def deletes(word: str) -> Set[str]:
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+class SecuritiesIndex:
+    """
+    In-memory index of securities directory. \n
+    Ticker and name word prefixes are found by binary search in sorted arrays,
+    tickers with one typo by their deletion neighbourhood (symmetric delete), so search makes no network calls
+    """
+
+    def __init__(self, securities: Iterable[Security]):
+        self.securities = sorted({security.yahoo_symbol.upper(): security for security in securities}.values())
+        tickers = sorted((security.ticker.upper(), i) for i, security in enumerate(self.securities))
+        words = sorted({(word, i) for i, security in enumerate(self.securities)
+                        for word in security.name.lower().replace('"', ' ').split()})
+        self._tickers, self._ticker_ids = [key for key, _ in tickers], [i for _, i in tickers]
+        self._words, self._word_ids = [key for key, _ in words], [i for _, i in words]
+        self._deletes: Dict[str, List[int]] = {}
+        for ticker, i in tickers:
+            for variant in deletes(ticker) | {ticker}:
+                self._deletes.setdefault(variant, []).append(i)
+
+    def __len__(self):
+        return len(self.securities)
+
+    @staticmethod
+    def prefixed(keys: List[str], ids: List[int], prefix: str) -> Iterable[int]:
+        for position in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[position].startswith(prefix):
+                break
+            yield ids[position]
+
+    def fuzzy(self, ticker: str) -> List[int]:
+        """
+        :return: securities with ticker one typo away
+        """
+        candidates = {i for variant in deletes(ticker) | {ticker} for i in self._deletes.get(variant, ())}
+        return sorted(i for i in candidates if is_one_typo(ticker, self.securities[i].ticker.upper()))
+
+    def search(self, query: str, limit: int = 10) -> List[Security]:
+        """
+        Securities in order: ticker prefix (exact ticker first), name word prefix, ticker with a typo
+        """
+        query = query.strip()
+        if not query:
+            return []
+        ticker = query.upper().translate(LOOKALIKES)
+        found = dict.fromkeys(islice(self.prefixed(self._tickers, self._ticker_ids, ticker), limit))
+        if len(found) < limit:
+            found.update(dict.fromkeys(islice(self.prefixed(self._words, self._word_ids, query.lower()), limit)))
+        if len(found) < limit:
+            found.update(dict.fromkeys(self.fuzzy(ticker)))
+        return [self.securities[i] for i in list(found)[:limit]]
+
+
+class SecuritiesDirectory:
+    """
+    Securities directory of the process: MOEX ISS securities of `stock_directory_boards`
+    and listings from `stock_directory_file`. Directory is cached in Redis for `stock_directory_ttl` seconds,
+    so processes share one ISS download, and the index is rebuilt every `stock_directory_reload_interval` seconds
+    """
+    cache_key = 'stock:directory'
+    _index = SecuritiesIndex([])
+
+    @classmethod
+    def search(cls, query: str, limit: int = 10) -> List[Security]:
+        return cls._index.search(query, limit=limit)
+
+    @classmethod
+    def size(cls) -> int:
+        return len(cls._index)
+
+    @classmethod
+    async def run(cls):
+        """
+        Load directory and reload it every `stock_directory_reload_interval` seconds,
+        failed or empty load is retried after `stock_directory_retry_interval` seconds
+        """
+        while True:
+            try:
+                loaded = await cls.load()
+            except Exception as err:
+                logger.error(f'Securities directory is not loaded: {err!r}')
+                loaded = 0
+            await asyncio.sleep(settings.stock_directory_reload_interval if loaded
+                                else settings.stock_directory_retry_interval)
+
+    @classmethod
+    async def load(cls) -> int:
+        """
+        Build index from cached directory or download it. Index is kept if no securities are loaded
+        :return: number of loaded securities
+        """
+        storage = Redis()
+        cached = await storage.get_cached(cls.cache_key)
+        if cached:
+            if isinstance(cached, str):
+                cached = json.loads(cached)
+            securities = [Security(*item) for item in cached]
+        else:
+            loop = asyncio.get_event_loop()
+            try:
+                await RateLimiter.for_limit('iss').check(tokens=len(settings.stock_directory_boards))
+                securities = await loop.run_in_executor(None, cls.fetch_moex, settings.stock_directory_boards)
+            except RateLimitedError as exc:
+                logger.warning(f'Securities of MOEX boards are not loaded: {exc!r}')
+                securities = []
+            if settings.stock_directory_file:
+                securities += cls.read_file(settings.stock_directory_file)
+            if securities:
+                await storage.save_cache([list(security) for security in securities],
+                                         collection_key=cls.cache_key,
+                                         ttl_per_sec=settings.stock_directory_ttl)
+        if not securities:
+            logger.warning(f'Securities directory is not loaded, index of {len(cls._index)} securities is kept')
+            return 0
+        SecuritiesDirectory._index = SecuritiesIndex(securities)
+        logger.info(f'Securities directory is loaded: {len(cls._index)} securities')
+        return len(cls._index)
+
+    @staticmethod
+    def fetch_moex(boards: List[str]) -> List[Security]:
+        """
+        Securities of MOEX boards, failed boards are skipped
+        """
+        import apimoex
+        from app.services.bonds import DataFetcher, TimeoutSession
+
+        policy = DataFetcher.get_policy()
+        securities = []
+        for board in boards:
+            url = f'{settings.iss_base_url}/engines/stock/markets/shares/boards/{board}/securities.json'
+            arguments = {'iss.only': 'securities', 'securities.columns': 'SECID,SHORTNAME,SECNAME'}
+
+            def request() -> dict:
+                with TimeoutSession(timeout=policy.timeout) as session:
+                    return apimoex.ISSClient(session, url, arguments).get()
+
+            try:
+                rows = policy.call_sync(request)['securities']
+            except Exception as exc:
+                logger.warning(f'Securities of MOEX board {board} are not loaded: {exc!r}')
+                continue
+            securities += [Security(row['SECID'], row.get('SECNAME') or row.get('SHORTNAME') or row['SECID'],
+                                    row['SECID'] + '.ME', 'MCX')
+                           for row in rows if row.get('SECID')]
+        return securities
+
+    @staticmethod
+    def read_file(path: str) -> List[Security]:
+        """
+        Read listings from CSV file with header: ticker,name,yahoo_symbol,exchange
+        """
+        try:
+            with open(path, newline='', encoding='utf-8') as file:
+                return [Security(row['ticker'], row.get('name') or row['ticker'],
+                                 row.get('yahoo_symbol') or row['ticker'], row.get('exchange') or '')
+                        for row in csv.DictReader(file) if row.get('ticker')]
+        except (OSError, KeyError, csv.Error) as exc:
+            logger.warning(f'Securities file {path} is not loaded: {exc!r}')
+            return []
+
@@ -0,0 +1,49 @@
+import bisect
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+
+class HashRing:
+    """
+    Consistent hashing ring used to assign symbols to notification workers
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = 64):
+        self.virtual_nodes = virtual_nodes
+        self._ring: Dict[int, str] = {}
+        self._sorted_keys: List[int] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    @property
+    def nodes(self) -> List[str]:
+        return sorted(set(self._ring.values()))
+
+    def add_node(self, node: str):
+        for i in range(self.virtual_nodes):
+            point = self.hash_key(f'{node}#{i}')
+            if point not in self._ring:
+                self._ring[point] = node
+                bisect.insort(self._sorted_keys, point)
+
+    def remove_node(self, node: str):
+        for i in range(self.virtual_nodes):
+            point = self.hash_key(f'{node}#{i}')
+            if self._ring.get(point) == node:
+                del self._ring[point]
+                self._sorted_keys.remove(point)
+
+    def get_node(self, key: str) -> Optional[str]:
+        """
+        Return node which owns the key
+        :param key: any string key, e.g. yahoo symbol
+        :return: node name or None for empty ring
+        """
+        if not self._sorted_keys:
+            return None
+        idx = bisect.bisect(self._sorted_keys, self.hash_key(key)) % len(self._sorted_keys)
+        return self._ring[self._sorted_keys[idx]]
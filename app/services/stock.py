@@ -1,14 +1,29 @@
 import asyncio
+import json
 import logging
 import random
+import time
 from asyncio import CancelledError
-from typing import Optional, List
+from typing import Any, Dict, Optional, List, Set, Tuple
+from urllib.parse import quote
 
 import httpx
+from pydantic import ValidationError
 
 from app.core.logging import setup_logging
 from app.core import settings
-from app.models.models import (StockRs, ExchangeSuffix, ExchangeRs, FindStockRq, Amount, StockRq, AssetProfile)
+from app.db.codecs import parse_model
+from app.db.history import PriceHistory
+from app.db.redis_pub import Redis
+from app.models.models import (StockRs, ExchangeSuffix, ExchangeRs, FindStockRq, Amount, StockRq, AssetProfile,
+                               QuoteRs)
+from app.db.rate_limit import RateLimitedError
+from app.services.resilience import CircuitOpenError, UpstreamPolicy
+
+try:
+    import h2
+except ImportError:
+    h2 = None
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -16,7 +31,9 @@ logger = logging.getLogger(__name__)
 
 class YahooApiService:
     """
-    Base class for calling YahooApi
+    Base class for calling YahooApi. \n
+    Requests of the process share one keep-alive client, so connections (and TLS handshakes) are reused.
+    Client is created on first request or by `open_client` and is bound to the event loop it is created in
     """
     __user_agent_lst = ['Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
                         'Chrome/88.0.4324.104 Safari/537.36',
@@ -27,77 +44,326 @@ class YahooApiService:
         'authority': 'query1.finance.yahoo.com',
         'user-agent': random.choice(__user_agent_lst)
     }
+    _client: Optional[Tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        loop = asyncio.get_event_loop()
+        if cls._client is None or cls._client[0] is not loop:
+            http2 = settings.yahoo_http2 and h2 is not None
+            if settings.yahoo_http2 and not http2:
+                logger.warning('h2 is not installed, YahooFinance is requested over HTTP/1.1')
+            client = httpx.AsyncClient(headers=cls.__headers,
+                                       http2=http2,
+                                       limits=httpx.Limits(
+                                           max_connections=settings.yahoo_max_connections,
+                                           max_keepalive_connections=settings.yahoo_max_keepalive_connections),
+                                       timeout=httpx.Timeout(settings.time_out,
+                                                             connect=settings.yahoo_connect_timeout))
+            YahooApiService._client = (loop, client)
+            logger.info(f'Created YahooFinance client, http2: {http2}')
+        return cls._client[1]
+
+    @classmethod
+    async def open_client(cls):
+        cls.get_client()
+
+    @classmethod
+    async def close_client(cls):
+        if cls._client is not None:
+            loop, client = cls._client
+            YahooApiService._client = None
+            if loop is asyncio.get_event_loop():
+                await client.aclose()
+
+    @staticmethod
+    def is_upstream_failure(exc: BaseException) -> bool:
+        """
+        Errors retried and counted by the circuit breaker: transport errors, timeouts,
+        throttling, server errors and responses which are not JSON
+        """
+        if isinstance(exc, httpx.HTTPStatusError):
+            return exc.response.status_code >= 500 or exc.response.status_code == httpx.codes.TOO_MANY_REQUESTS
+        return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError, ValueError))
 
     @classmethod
-    async def fetch_data(cls, url: str):
+    def get_policy(cls) -> UpstreamPolicy:
+        return UpstreamPolicy.for_upstream('yahoo', is_failure=cls.is_upstream_failure)
+
+    @classmethod
+    async def request(cls, url: str, allow_not_found: bool = False, params: Optional[dict] = None) -> dict:
+        r = await cls.get_client().get(url, params=params)
+        logger.info(f'Response from YahooFinance: {r.status_code}')
+        if allow_not_found and r.status_code == httpx.codes.NOT_FOUND:
+            return r.json()
+        r.raise_for_status()
+        return r.json()
+
+    @classmethod
+    async def fetch_data(cls, url: str, allow_not_found: bool = False, params: Optional[dict] = None):
         """
-        Get response from API by url
+        Get response from API by url with the `yahoo` upstream policy
         :param url: url
-        :return: dict with data from API
+        :param allow_not_found: return data of 404 response (symbol is not found) instead of None
+        :param params: query parameters, they are escaped by the client
+        :return: dict with data from API or None if request failed or circuit is open
+        :raise RateLimitedError: if the `yahoo` rate limit is exceeded, API answers 429
         """
 
         try:
-            async with httpx.AsyncClient() as client:
-                r = await client.get(url, headers=cls.__headers)
-                response = r.json()
-                logger.info(f'Response from YahooFinance: {r.status_code}')
-                r.raise_for_status()
-            return response
-        except httpx.HTTPError as exc:
-            logger.warning(f'HTTP Exception: {exc}')
+            return await cls.get_policy().call(lambda: cls.request(url, allow_not_found, params))
+        except (httpx.HTTPError, asyncio.TimeoutError, ValueError, CircuitOpenError) as exc:
+            logger.warning(f'HTTP Exception: {exc!r}')
 
 
 class StockService(YahooApiService):
     """
-    Base class for stock
+    Base class for stock. \n
+    Exchanges of a ticker are cached in Redis: listed exchanges for `redis_symbol_cache_ttl`
+    and symbols not found on an exchange for `redis_symbol_negative_ttl` seconds. \n
+    Asset profiles are cached for `redis_profile_cache_ttl` seconds. Profile older than `redis_profile_refresh_after`
+    is still served, but it is requested again with the next price of the symbol
     """
     module = 'price'
+    profile_module = 'assetProfile'
+    _probe_stats = {'lookups': 0, 'probes': 0, 'hits': 0, 'slow': 0, 'cancelled_after_hit': 0,
+                    'max_probe_time': 0.0, 'slow_by_exchange': {}}
+
+    def __init__(self):
+        self.storage = Redis()
+        self.degraded = False
 
-    async def find_stocks_by_ticker(self, stock: FindStockRq) -> Optional[List[StockRs]]:
+    async def find_stocks_by_ticker(self, stock: FindStockRq, first_hit: bool = False) -> Optional[List[StockRs]]:
         """
         Функция по тикеру возвращает представление
-        инструмента на каждой из бирж
+        инструмента на каждой из бирж. \n
+        Exchanges are probed in parallel and results are handled as they arrive. Probes not finished
+        within `yahoo_lookup_budget` seconds are cancelled, so a slow exchange does not hold the response
 
         :param stock: (ticker - тикер)
+        :param first_hit: return the first found instrument and cancel other probes
         :return: список представлений инструмента на каждой из бирж
+        :raise RateLimitedError: if nothing is found and some probes are not sent because of the rate limit
+        Sets `degraded` if some exchanges are not answered (timeout, failure, open circuit), so the result
+        is not to be cached
         """
         logger.info(f'Start checking exchange!')
 
+        listed, exchanges, profiles = await self.get_listed_symbols(stock.ticker)
+        not_found = set()
+        tasks = [asyncio.create_task(self.probe_exchange(symbol, not_found, profiles.get(symbol)))
+                 for symbol in listed]
         response_list = []
+        rate_limited = None
         try:
-            yahoo_symbol_list = [stock.ticker + i for i in ExchangeSuffix]
-            urls = [f'https://query1.finance.yahoo.com/v10/finance/quoteSummary/'
-                    f'{s}?modules={self.module}' for s in yahoo_symbol_list]
-            tasks = [asyncio.create_task(asyncio.wait_for(self.fetch_data(url), timeout=settings.time_out)) for url in
-                     urls]
-            result_lst = [r.get("quoteSummary")["result"][0]["price"] for r in await asyncio.gather(*tasks) if r]
-
-            for item in result_lst:
-                exchange = ExchangeRs(
-                    code=item.get("exchange"),
-                    name=item.get("exchangeName"),
-                    yahoo_search_symbol=item.get("symbol")
-                )
-                amount = Amount(
-                    value=item["regularMarketPrice"].get("raw"),
-                    currency=item.get("currency"),
-                    currency_symbol=item.get("currencySymbol")
-                )
-                asset_profile = await self.stock_profile(StockRq(ticker=item.get("symbol").partition('.')[0],
-                                                                 exchange=exchange))
-                asset = StockRs(
-                    shortName=item.get("shortName"),
-                    price=amount,
-                    ticker=item.get("symbol").partition('.')[0],
-                    exchange=exchange,
-                    assetProfile=asset_profile
-                )
-                response_list.append(asset)
-            logger.debug(f'Returning objects: {response_list}')
-            return response_list
-        except CancelledError:
-            done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
-            await asyncio.gather(pending)
+            for probe in asyncio.as_completed(tasks, timeout=settings.yahoo_lookup_budget):
+                try:
+                    asset = await probe
+                except RateLimitedError as exc:
+                    rate_limited = exc
+                    continue
+                except (ValidationError, KeyError, TypeError, AttributeError, httpx.HTTPError) as exc:
+                    logger.warning(f'Exchange probe of {stock.ticker} is skipped: {exc!r}')
+                    continue
+                if asset and first_hit:
+                    response_list = [asset]
+                    break
+            else:
+                response_list = [task.result() for task in tasks if not task.exception() and task.result()]
+        except asyncio.TimeoutError:
+            response_list = [task.result() for task in tasks
+                             if task.done() and not task.exception() and task.result()]
+            logger.warning(f'Exchange probes of {stock.ticker} are out of {settings.yahoo_lookup_budget}s budget')
+        finally:
+            # also on cancellation of the lookup: pending probes are cancelled and the cancellation is raised
+            self.record_lookup(list(listed.values()), tasks, first_hit)
+            for task in tasks:
+                task.cancel()
+        await self.save_listed_symbols(stock.ticker, listed, exchanges, profiles, tasks, not_found)
+        answered = [task.done() and not task.cancelled() and not task.exception()
+                    and (task.result() is not None or symbol in not_found)
+                    for symbol, task in zip(listed, tasks)]
+        self.degraded = not all(answered) and not (first_hit and response_list)
+        if rate_limited and not response_list:
+            raise rate_limited
+        logger.debug(f'Returning objects: {response_list}')
+        return response_list
+
+    async def get_listed_symbols(self, ticker: str) -> Tuple[Dict[str, ExchangeSuffix],
+                                                             Optional[List[dict]],
+                                                             Dict[str, AssetProfile]]:
+        """
+        Symbols to probe: cached listed exchanges of the ticker
+        or all exchanges except the ones cached as not found. Cached profiles are read in the same round trip
+        :return: yahoo symbol -> exchange suffix, cached exchanges and yahoo symbol -> profile not to be refreshed
+        """
+        symbols = {ticker + suffix: suffix for suffix in ExchangeSuffix}
+        keys = [self.get_exchanges_cache_key(ticker),
+                *(self.get_unlisted_cache_key(symbol) for symbol in symbols),
+                *(self.get_profile_cache_key(symbol) for symbol in symbols)]
+        cached = await self.storage.get_many_cached_with_ttl(keys) or [(None, None)] * len(keys)
+        (exchanges, _), unlisted = cached[0], cached[1:len(symbols) + 1]
+        cached_profiles = self.parse_cached_profiles(cached[len(symbols) + 1:])
+        profiles = {symbol: profile for symbol, profile in zip(symbols, cached_profiles) if profile}
+        if isinstance(exchanges, str):
+            exchanges = json.loads(exchanges)
+        if exchanges:
+            listed = {exchange['yahoo_search_symbol'].upper() for exchange in exchanges}
+            listed_symbols = {symbol: suffix for symbol, suffix in symbols.items() if symbol.upper() in listed}
+            return listed_symbols, exchanges, profiles
+        not_listed = {symbol for symbol, (value, _) in zip(symbols, unlisted) if value is not None}
+        return {symbol: suffix for symbol, suffix in symbols.items() if symbol not in not_listed}, None, profiles
+
+    async def save_listed_symbols(self,
+                                  ticker: str,
+                                  listed: Dict[str, ExchangeSuffix],
+                                  exchanges: Optional[List[dict]],
+                                  profiles: Dict[str, AssetProfile],
+                                  tasks: List[asyncio.Task],
+                                  not_found: Set[str]):
+        """
+        Cache symbols not found on exchanges, requested profiles and,
+        if every probe is answered, changed listed exchanges of the ticker
+        """
+        found = [task.result() for task in tasks
+                 if task.done() and not task.cancelled() and not task.exception() and task.result()]
+        messages = {self.get_unlisted_cache_key(symbol): ('1', settings.redis_symbol_negative_ttl)
+                    for symbol in not_found}
+        for stock in found:
+            messages.update(self.price_messages(stock.exchange.yahoo_search_symbol, stock.price))
+        cached_profiles = {profile_symbol.upper() for profile_symbol in profiles}
+        messages.update({self.get_profile_cache_key(stock.exchange.yahoo_search_symbol):
+                         (stock.assetProfile.dict(), settings.redis_profile_cache_ttl)
+                         for stock in found
+                         if stock.assetProfile and stock.exchange.yahoo_search_symbol.upper() not in cached_profiles})
+        found_exchanges = [stock.exchange.dict() for stock in found]
+        if found and len(found) + len(not_found) == len(listed) and found_exchanges != exchanges:
+            messages[self.get_exchanges_cache_key(ticker)] = (found_exchanges, settings.redis_symbol_cache_ttl)
+        elif exchanges and not found and not_found:
+            await self.storage.delete(self.get_exchanges_cache_key(ticker))
+        if messages:
+            await self.storage.save_many_cache(messages)
+
+    @classmethod
+    def get_exchanges_cache_key(cls, ticker: str) -> str:
+        return f'stock:exchanges:{ticker}'
+
+    @classmethod
+    def get_unlisted_cache_key(cls, yahoo_symbol: str) -> str:
+        return f'stock:unlisted:{yahoo_symbol}'
+
+    @classmethod
+    def get_quote_summary_url(cls, yahoo_symbol: str) -> str:
+        return f'{settings.yahoo_base_url}/v10/finance/quoteSummary/{quote(yahoo_symbol, safe="")}'
+
+    @classmethod
+    def get_profile_cache_key(cls, yahoo_symbol: str) -> str:
+        return f'stock:profile:{yahoo_symbol.upper()}'
+
+    @classmethod
+    def get_price_cache_key(cls, yahoo_symbol: str) -> str:
+        return f'stock:price:{yahoo_symbol}'
+
+    @classmethod
+    def get_currency_cache_key(cls, yahoo_symbol: str) -> str:
+        return f'stock:currency:{yahoo_symbol}'
+
+    @classmethod
+    def price_messages(cls, yahoo_symbol: str, amount: Amount) -> Dict[str, Tuple[Any, int]]:
+        """
+        Price for the shared price cache and currency of the symbol, for `save_many_cache`
+        """
+        return {
+            cls.get_price_cache_key(yahoo_symbol): (str(amount.value), settings.redis_stock_price_cache_ttl),
+            cls.get_currency_cache_key(yahoo_symbol): ({'currency': amount.currency,
+                                                        'currency_symbol': amount.currency_symbol},
+                                                       settings.redis_symbol_cache_ttl),
+        }
+
+    @staticmethod
+    def parse_cached_profiles(cached: List[Tuple[Any, Optional[int]]]) -> List[Optional[AssetProfile]]:
+        """
+        :return: cached profiles, None for missing profiles and for profiles to be refreshed
+        """
+        refresh_ttl = settings.redis_profile_cache_ttl - settings.redis_profile_refresh_after
+        profiles = []
+        for value, ttl in cached:
+            try:
+                fresh = value is not None and (ttl is None or ttl > refresh_ttl)
+                profiles.append(parse_model(AssetProfile, value) if fresh else None)
+            except ValidationError:
+                profiles.append(None)
+        return profiles
+
+    async def probe_exchange(self,
+                             yahoo_symbol: str,
+                             not_found: Set[str],
+                             profile: Optional[AssetProfile] = None) -> Optional[StockRs]:
+        """
+        Request price and asset profile of the symbol
+        :param not_found: symbol is added to the set if exchange does not list it
+        :param profile: cached profile, only price is requested if it is passed
+        :return: model: StockRs or None if symbol is not found or is not answered
+        """
+        started = time.perf_counter()
+        try:
+            modules = self.module if profile else f'{self.module},{self.profile_module}'
+            response = await self.fetch_data(self.get_quote_summary_url(yahoo_symbol),
+                                             allow_not_found=True,
+                                             params={'modules': modules})
+            if not response:
+                return None
+            if not response.get("quoteSummary", {}).get("result"):
+                not_found.add(yahoo_symbol)
+                return None
+            result = response.get("quoteSummary")["result"][0]
+            item = result["price"]
+            exchange = ExchangeRs(
+                code=item.get("exchange"),
+                name=item.get("exchangeName"),
+                yahoo_search_symbol=item.get("symbol")
+            )
+            amount = Amount(
+                value=item["regularMarketPrice"].get("raw"),
+                currency=item.get("currency"),
+                currency_symbol=item.get("currencySymbol")
+            )
+            return StockRs(
+                shortName=item.get("shortName"),
+                price=amount,
+                ticker=item.get("symbol").partition('.')[0],
+                exchange=exchange,
+                assetProfile=profile or self.parse_profile(result.get(self.profile_module))
+            )
+        finally:
+            probe_time = time.perf_counter() - started
+            self._probe_stats['max_probe_time'] = max(self._probe_stats['max_probe_time'], probe_time)
+
+    @classmethod
+    def record_lookup(cls, suffixes: List[ExchangeSuffix], tasks: List[asyncio.Task], first_hit: bool):
+        stats = cls._probe_stats
+        found = [task.done() and not task.cancelled() and not task.exception() and task.result() is not None
+                 for task in tasks]
+        stats['lookups'] += 1
+        stats['probes'] += len(tasks)
+        stats['hits'] += sum(found)
+        for suffix, task in zip(suffixes, tasks):
+            if task.done():
+                continue
+            if first_hit and any(found):
+                stats['cancelled_after_hit'] += 1
+            else:
+                exchange = suffix.value or 'default'
+                stats['slow'] += 1
+                stats['slow_by_exchange'][exchange] = stats['slow_by_exchange'].get(exchange, 0) + 1
+
+    @classmethod
+    def probe_stats(cls) -> dict:
+        """
+        Exchange probes: lookups, probes sent, found instruments, probes cancelled
+        at the lookup deadline (slow, also by exchange) or after the first hit, max probe time
+        """
+        return {**cls._probe_stats, 'slow_by_exchange': dict(cls._probe_stats['slow_by_exchange'])}
 
     async def get_stock_price(self, stock: StockRq) -> Amount:
         """
@@ -106,15 +372,7 @@ class StockService(YahooApiService):
         :return: model: Amount
         """
         try:
-            url = f'https://query1.finance.yahoo.com/v10/finance/quoteSummary/' \
-                  f'{stock.exchange.yahoo_search_symbol}?modules={self.module}'
-            response = await asyncio.create_task(asyncio.wait_for(self.fetch_data(url), timeout=3))
-            price = response.get("quoteSummary")["result"][0]["price"]
-            amount = Amount(
-                value=price["regularMarketPrice"].get("raw"),
-                currency=price.get("currency"),
-                currency_symbol=price.get("currencySymbol")
-            )
+            amount = await self.fetch_price(stock.exchange.yahoo_search_symbol)
             logger.debug(f'Return amount {amount}')
             return amount
         except AttributeError:
@@ -123,22 +381,143 @@ class StockService(YahooApiService):
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
 
+    async def fetch_price(self, yahoo_symbol: str) -> Amount:
+        response = await self.fetch_data(self.get_quote_summary_url(yahoo_symbol), params={'modules': self.module})
+        price = response.get("quoteSummary")["result"][0]["price"]
+        return Amount(
+            value=price["regularMarketPrice"].get("raw"),
+            currency=price.get("currency"),
+            currency_symbol=price.get("currencySymbol")
+        )
+
+    async def get_quotes(self, yahoo_symbols: List[str]) -> List[QuoteRs]:
+        """
+        Latest prices of resolved symbols. \n
+        Prices younger than `stock_quote_max_age` seconds are served from the shared price cache,
+        other symbols are requested in batches of `yahoo_quote_batch_size`. Batch quote has no currency symbol,
+        so symbols without cached currency are requested one by one
+        :return: quotes in order of symbols, price is None if symbol is not answered
+        """
+        symbols = list(dict.fromkeys(yahoo_symbols))
+        keys = [key for symbol in symbols
+                for key in (self.get_price_cache_key(symbol), self.get_currency_cache_key(symbol))]
+        cached = await self.storage.get_many_cached_with_ttl(keys) or [(None, None)] * len(keys)
+        amounts: Dict[str, Optional[Amount]] = {}
+        currencies: Dict[str, dict] = {}
+        for symbol, (price, ttl), (currency, _) in zip(symbols, cached[::2], cached[1::2]):
+            if currency is not None:
+                currencies[symbol] = json.loads(currency) if isinstance(currency, str) else currency
+            price_age = settings.redis_stock_price_cache_ttl - (ttl or 0)
+            if price and ttl and price_age < settings.stock_quote_max_age and symbol in currencies:
+                amounts[symbol] = Amount(value=price, **currencies[symbol])
+
+        stale = [symbol for symbol in symbols if symbol not in amounts]
+        batched = [symbol for symbol in stale if symbol in currencies]
+        single = [symbol for symbol in stale if symbol not in currencies]
+        size = settings.yahoo_quote_batch_size
+        batches = [batched[i:i + size] for i in range(0, len(batched), size)]
+        results = await asyncio.gather(*(self.fetch_quotes(batch, currencies) for batch in batches),
+                                       *(self.fetch_single_quote(symbol) for symbol in single))
+        messages = {}
+        for fetched in results:
+            for symbol, amount in fetched.items():
+                amounts[symbol] = amount
+                messages.update(self.price_messages(symbol, amount))
+                PriceHistory.append(symbol, amount.value)
+        if messages:
+            await self.storage.save_many_cache(messages)
+        logger.info(f'Quotes of {len(symbols)} symbols: {len(symbols) - len(stale)} cached, '
+                    f'{len(batches)} batches, {len(single)} single requests')
+        return [QuoteRs(symbol=symbol, price=amounts.get(symbol)) for symbol in symbols]
+
+    async def fetch_quotes(self, yahoo_symbols: List[str], currencies: Dict[str, dict]) -> Dict[str, Amount]:
+        """
+        Request prices of symbols in one batch quote
+        :param currencies: cached currencies of the symbols
+        """
+        response = await self.fetch_data(f'{settings.yahoo_base_url}/v7/finance/quote',
+                                         params={'symbols': ','.join(yahoo_symbols)})
+        amounts = {}
+        try:
+            requested = {symbol.upper(): symbol for symbol in yahoo_symbols}
+            for item in response["quoteResponse"]["result"] or []:
+                symbol = requested.get(str(item.get("symbol")).upper())
+                if symbol and item.get("regularMarketPrice") is not None:
+                    amounts[symbol] = Amount(value=item["regularMarketPrice"],
+                                             currency=item.get("currency") or currencies[symbol]['currency'],
+                                             currency_symbol=currencies[symbol]['currency_symbol'])
+        except (TypeError, KeyError, ValidationError) as exc:
+            logger.warning(f'Bad batch quote of {len(yahoo_symbols)} symbols: {exc!r}')
+        return amounts
+
+    async def fetch_single_quote(self, yahoo_symbol: str) -> Dict[str, Amount]:
+        try:
+            return {yahoo_symbol: await self.fetch_price(yahoo_symbol)}
+        except (AttributeError, TypeError, KeyError, IndexError, ValidationError):
+            logger.warning(f'No price for {yahoo_symbol}')
+            return {}
+
     async def stock_profile(self, stock: StockRq) -> AssetProfile:
-        module = 'assetProfile'
         try:
-            url = f'https://query1.finance.yahoo.com/v10/finance/quoteSummary/' \
-                  f'{stock.exchange.yahoo_search_symbol}?modules={module}'
-            response = await asyncio.create_task(asyncio.wait_for(self.fetch_data(url), timeout=3))
-            profile_root: dict = response.get("quoteSummary")["result"][0][module]
-            asset_profile = AssetProfile(
-                industry=profile_root.get('industry'),
-                sector=profile_root.get('sector'),
-                site=profile_root.get('website')
-            )
-            logger.debug(f'Return profile: {asset_profile}')
-            return asset_profile
+            symbol = stock.exchange.yahoo_search_symbol
+            cached = await self.storage.get_cached_with_ttl(self.get_profile_cache_key(symbol))
+            profile, = self.parse_cached_profiles([cached or (None, None)])
+            if profile:
+                return profile
+            profile = await self.fetch_profile(symbol)
+            if profile:
+                await self.storage.save_cache(profile.dict(),
+                                              collection_key=self.get_profile_cache_key(symbol),
+                                              ttl_per_sec=settings.redis_profile_cache_ttl)
+            return profile
         except AttributeError:
             logger.error(f'No asset profile for {stock.exchange.yahoo_search_symbol}')
         except CancelledError:
             done, pending = await asyncio.wait(asyncio.tasks.all_tasks())
             await asyncio.gather(pending)
+
+    async def fetch_profile(self, yahoo_symbol: str) -> Optional[AssetProfile]:
+        response = await self.fetch_data(self.get_quote_summary_url(yahoo_symbol),
+                                         params={'modules': self.profile_module})
+        return self.parse_profile(response.get("quoteSummary")["result"][0][self.profile_module])
+
+    async def warm_up_profiles(self, yahoo_symbols: List[str]) -> int:
+        """
+        Request and cache profiles of symbols which are not cached or are to be refreshed
+        :return: number of cached profiles
+        """
+        keys = [self.get_profile_cache_key(symbol) for symbol in yahoo_symbols]
+        cached = await self.storage.get_many_cached_with_ttl(keys) or [(None, None)] * len(keys)
+        missing = [symbol for symbol, profile in zip(yahoo_symbols, self.parse_cached_profiles(cached)) if not profile]
+        semaphore = asyncio.Semaphore(settings.yahoo_max_keepalive_connections)
+
+        async def fetch(symbol: str) -> Optional[AssetProfile]:
+            async with semaphore:
+                try:
+                    return await self.fetch_profile(symbol)
+                except (AttributeError, TypeError, KeyError, IndexError, ValidationError):
+                    logger.warning(f'No asset profile for {symbol}')
+
+        profiles = await asyncio.gather(*(fetch(symbol) for symbol in missing))
+        messages = {self.get_profile_cache_key(symbol): (profile.dict(), settings.redis_profile_cache_ttl)
+                    for symbol, profile in zip(missing, profiles) if profile}
+        if messages:
+            await self.storage.save_many_cache(messages)
+        logger.info(f'Warmed up {len(messages)} of {len(missing)} missing asset profiles')
+        return len(messages)
+
+    @staticmethod
+    def parse_profile(profile_root: Optional[dict]) -> Optional[AssetProfile]:
+        """
+        Build asset profile from quoteSummary assetProfile module
+        :return: model: AssetProfile or None if there is no profile
+        """
+        if not profile_root:
+            return None
+        asset_profile = AssetProfile(
+            industry=profile_root.get('industry'),
+            sector=profile_root.get('sector'),
+            site=profile_root.get('website')
+        )
+        logger.debug(f'Return profile: {asset_profile}')
+        return asset_profile
@@ -0,0 +1,400 @@
+"""
+Local stand-ins for upstream services used by tests and benchmarks
+"""
+import asyncio
+import json
+import math
+import multiprocessing
+import random
+import sys
+import threading
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, parse_qs, unquote
+
+PricePath = Callable[[str, float], float]
+
+
+def sine_price_path(symbol: str, t: float) -> float:
+    """
+    Scripted price path: every symbol oscillates around its own base price
+    """
+    seed = zlib.crc32(symbol.encode('utf-8'))
+    base = 50 + seed % 200
+    period = 300 + seed % 600
+    return round(base * (1 + 0.05 * math.sin(2 * math.pi * t / period + seed % 7)), 2)
+
+
+class StandInServer:
+    """
+    Base asyncio TCP server which can run in the current loop or in a background thread
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self.host = host
+        self.port = port
+        self.connections = 0
+        self._handlers: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        raise NotImplementedError
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        try:
+            await self.handle(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+        for task in self._handlers:
+            task.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    def start_in_thread(self):
+        """
+        Serve from a separate thread with its own loop, so the stand-in does not share loop time with the app
+        """
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=serve, name=self.__class__.__name__, daemon=True).start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self.stop(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class FakeYahooServer(StandInServer):
+    """
+    Minimal HTTP/1.1 keep-alive server answering YahooFinance quoteSummary and batch quote requests
+    with prices from a scripted path. Latency and failures can be injected.
+    """
+    reasons = {200: 'OK', 404: 'Not Found', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+    def __init__(self,
+                 price_path: PricePath = sine_price_path,
+                 known_symbols: Optional[Iterable[str]] = None,
+                 latency: float = 0.0,
+                 fail_rate: float = 0.0,
+                 fail_status: int = 503,
+                 seed: int = 42,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.price_path = price_path
+        self.known_symbols = set(known_symbols) if known_symbols is not None else None
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.requests = 0
+        self.requests_by_path: Dict[str, int] = {}
+        self.profile_requests = 0
+        self._random = random.Random(seed)
+        self._started_at = 0.0
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        self._started_at = asyncio.get_event_loop().time()
+        return await super().start()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                return
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if int(headers.get('content-length', 0)):
+                await reader.readexactly(int(headers['content-length']))
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            status, payload = await self.dispatch(method, target)
+            body = json.dumps(payload).encode('utf-8')
+            writer.write(f'HTTP/1.1 {status} {self.reasons.get(status, "")}\r\n'
+                         f'Content-Type: application/json\r\n'
+                         f'Content-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                return
+
+    def price(self, symbol: str) -> float:
+        return self.price_path(symbol, asyncio.get_event_loop().time() - self._started_at)
+
+    def is_known(self, symbol: str) -> bool:
+        return self.known_symbols is None or symbol in self.known_symbols
+
+    def price_module(self, symbol: str) -> dict:
+        return {
+            'symbol': symbol,
+            'shortName': symbol.partition('.')[0],
+            'exchange': 'MCX' if symbol.endswith('.ME') else 'NMS',
+            'exchangeName': 'MCX' if symbol.endswith('.ME') else 'NasdaqGS',
+            'currency': 'RUB' if symbol.endswith('.ME') else 'USD',
+            'currencySymbol': '₽' if symbol.endswith('.ME') else '$',
+            'regularMarketPrice': {'raw': self.price(symbol), 'fmt': str(self.price(symbol))},
+        }
+
+    @staticmethod
+    def profile_module(symbol: str) -> dict:
+        return {
+            'industry': 'Financial Data & Stock Exchanges',
+            'sector': 'Financial Services',
+            'website': f'http://www.{symbol.partition(".")[0].lower()}.com',
+        }
+
+    async def dispatch(self, method: str, target: str) -> Tuple[int, dict]:
+        self.requests += 1
+        url = urlsplit(target)
+        path = unquote(url.path)
+        route = path.rsplit('/', 1)[0] if path.startswith('/v10/finance/quoteSummary/') else path
+        self.requests_by_path[route] = self.requests_by_path.get(route, 0) + 1
+        query = parse_qs(url.query)
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and self._random.random() < self.fail_rate:
+            return self.fail_status, {'error': 'injected failure'}
+
+        if route == '/v10/finance/quoteSummary':
+            symbol = path.rsplit('/', 1)[1]
+            if not self.is_known(symbol):
+                return 404, {'quoteSummary': {'result': None,
+                                              'error': {'code': 'Not Found',
+                                                        'description': 'Quote not found for ticker symbol'}}}
+            modules = ','.join(query.get('modules', ['price'])).split(',')
+            result = {}
+            if 'price' in modules:
+                result['price'] = self.price_module(symbol)
+            if 'assetProfile' in modules:
+                self.profile_requests += 1
+                result['assetProfile'] = self.profile_module(symbol)
+            return 200, {'quoteSummary': {'result': [result], 'error': None}}
+        if route == '/v7/finance/quote':
+            symbols = ','.join(query.get('symbols', [])).split(',')
+            result = [{'symbol': symbol,
+                       'currency': self.price_module(symbol)['currency'],
+                       'regularMarketPrice': self.price(symbol)}
+                      for symbol in symbols if symbol and self.is_known(symbol)]
+            return 200, {'quoteResponse': {'result': result, 'error': None}}
+        return 404, {'error': f'unknown path {path}'}
+
+
+class RedisCountingProxy(StandInServer):
+    """
+    TCP proxy in front of Redis which counts commands and round trips sent by clients.
+    Commands read from the client at once (pipeline) are one round trip, network latency can be added per round trip.
+    With `serialize` commands are passed upstream one by one, fakeredis handles pipelined input slowly
+    """
+
+    def __init__(self,
+                 upstream_host: str,
+                 upstream_port: int,
+                 latency: float = 0.0,
+                 serialize: bool = False,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.upstream_host = upstream_host
+        self.upstream_port = upstream_port
+        self.latency = latency
+        self.serialize = serialize
+        self.commands = 0
+        self.round_trips = 0
+        self.commands_by_name: Dict[str, int] = {}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        upstream_reader, upstream_writer = await asyncio.open_connection(self.upstream_host, self.upstream_port)
+        replied = asyncio.Event()
+
+        async def pipe_replies():
+            try:
+                while True:
+                    if self.serialize:
+                        data = await self.read_reply(upstream_reader)
+                        replied.set()
+                    else:
+                        data = await upstream_reader.read(65536)
+                    if not data:
+                        break
+                    writer.write(data)
+                    await writer.drain()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                pass
+            finally:
+                writer.close()
+
+        replies = asyncio.ensure_future(pipe_replies())
+        burst: List[bytes] = []
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if command is None:
+                    break
+                name, raw = command
+                self.commands += 1
+                self.commands_by_name[name] = self.commands_by_name.get(name, 0) + 1
+                burst.append(raw)
+                if getattr(reader, '_buffer', None):
+                    continue
+                self.round_trips += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                for raw in burst:
+                    replied.clear()
+                    upstream_writer.write(raw)
+                    await upstream_writer.drain()
+                    if self.serialize:
+                        await replied.wait()
+                burst = []
+        finally:
+            upstream_writer.close()
+            await replies
+
+    @staticmethod
+    async def read_command(reader: asyncio.StreamReader) -> Optional[Tuple[str, bytes]]:
+        header = await reader.readline()
+        if not header:
+            return None
+        if not header.startswith(b'*'):
+            return header.split()[0].decode('latin-1').upper() if header.strip() else '', header
+        raw, name = [header], ''
+        for i in range(int(header[1:])):
+            length_line = await reader.readline()
+            data = await reader.readexactly(int(length_line[1:]) + 2)
+            raw += [length_line, data]
+            if i == 0:
+                name = data[:-2].decode('latin-1').upper()
+        return name, b''.join(raw)
+
+    @classmethod
+    async def read_reply(cls, reader: asyncio.StreamReader) -> bytes:
+        header = await reader.readline()
+        if header.startswith(b'$') and int(header[1:]) >= 0:
+            return header + await reader.readexactly(int(header[1:]) + 2)
+        if header.startswith(b'*') and int(header[1:]) > 0:
+            return header + b''.join([await cls.read_reply(reader) for _ in range(int(header[1:]))])
+        return header
+
+
+def check_fake_redis():
+    """
+    fakeredis TCP server needs Python 3.11+ and is installed from app/requirements-dev.txt
+    :raise RuntimeError: if the stand-in can not be run here
+    """
+    try:
+        from fakeredis import TcpFakeServer  # noqa: F401
+    except ImportError:
+        raise RuntimeError('fakeredis is not installed (app/requirements-dev.txt), pass --redis host:port') from None
+    if sys.version_info < (3, 11):
+        raise RuntimeError('fakeredis TCP server needs Python 3.11+, pass --redis host:port')
+
+
+def start_fake_redis(host: str = '127.0.0.1', port: int = 0) -> Tuple[str, int]:
+    """
+    Run in-process Redis stand-in (fakeredis with lua support) in a background thread
+    :return: host and port
+    """
+    check_fake_redis()
+    from fakeredis import TcpFakeServer
+
+    server = TcpFakeServer((host, port), server_type='redis')
+    threading.Thread(target=server.serve_forever, name='FakeRedis', daemon=True).start()
+    return server.server_address[0], server.server_address[1]
+
+
+def serve_redis_stand_in(pipe, upstream: Optional[Tuple[str, int]] = None, latency: float = 0.0):
+    """
+    Child process target: fakeredis (or upstream Redis) behind counting proxy.
+    Sends proxy address, then answers 'stats' and 'stop' requests from the pipe
+    """
+
+    async def serve():
+        host, port = upstream or start_fake_redis()
+        proxy = await RedisCountingProxy(host, port, latency=latency, serialize=upstream is None).start()
+        loop = asyncio.get_running_loop()
+        stopped = loop.create_future()
+
+        def on_request():
+            if pipe.recv() == 'stop':
+                stopped.set_result(None)
+            else:
+                pipe.send({'commands': proxy.commands,
+                           'round_trips': proxy.round_trips,
+                           'connections': proxy.connections,
+                           'commands_by_name': dict(proxy.commands_by_name)})
+
+        loop.add_reader(pipe.fileno(), on_request)
+        pipe.send((proxy.host, proxy.port))
+        await stopped
+        await proxy.stop()
+
+    asyncio.run(serve())
+
+
+class RedisStandIn:
+    """
+    Redis stand-in with command counting, served from a child process,
+    so it neither shares GIL and file descriptors with the app nor counts to app CPU and memory
+    """
+
+    def __init__(self, upstream: Optional[Tuple[str, int]] = None, latency: float = 0.0):
+        self.upstream = upstream
+        self.latency = latency
+        self.host: Optional[str] = None
+        self.port: Optional[int] = None
+        self._pipe = None
+        self._process: Optional[multiprocessing.Process] = None
+
+    def start(self):
+        # the child process can not report a failed start, so fakeredis is checked here
+        if self.upstream is None:
+            check_fake_redis()
+        self._pipe, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=serve_redis_stand_in,
+                                                args=(child, self.upstream, self.latency),
+                                                name='RedisStandIn',
+                                                daemon=True)
+        self._process.start()
+        self.host, self.port = self._pipe.recv()
+        return self
+
+    def stats(self) -> dict:
+        """
+        :return: commands, round trips, connections and commands by name served so far
+        """
+        self._pipe.send('stats')
+        return self._pipe.recv()
+
+    def stop(self):
+        if self._process:
+            self._pipe.send('stop')
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
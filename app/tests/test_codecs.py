@@ -0,0 +1,52 @@
+from decimal import Decimal
+
+import pytest
+
+from app.db.codecs import MAGIC, Codec, MsgpackCodec, get_codec, parse_model
+from app.models.models import Amount, ExchangeRs, StockPriceNotificationReadRs
+
+notification = StockPriceNotificationReadRs(ticker='MOEX',
+                                            exchange=ExchangeRs(code='ME', yahoo_search_symbol='MOEX.ME'),
+                                            targetPrice=180.5,
+                                            id='a1b2c3',
+                                            currentPrice=Amount(value=Decimal('171.73'),
+                                                                currency='RUB',
+                                                                currency_symbol='₽'),
+                                            state='in_progress')
+
+
+def test_msgpack_codec_round_trip():
+    codec = MsgpackCodec()
+    data = codec.encode(notification.dict())
+    assert data[0] == MAGIC
+    assert len(data) < len(notification.json().encode('utf-8'))
+    assert parse_model(StockPriceNotificationReadRs, codec.decode(data)) == notification
+
+
+def test_msgpack_codec_keeps_short_strings_plain():
+    codec = MsgpackCodec()
+    assert codec.encode('171.73') == b'171.73'
+    assert codec.decode(b'171.73') == '171.73'
+
+
+def test_msgpack_codec_compresses_large_values():
+    codec = MsgpackCodec(compress_threshold=1024)
+    bonds = [{'isin': f'RU000A0JX{i:04d}', 'name': 'ОФЗ 26207', 'couponPercent': 8.15} for i in range(500)]
+    data = codec.encode(bonds)
+    assert len(data) < len(MsgpackCodec(compress_threshold=10 ** 9).encode(bonds)) / 2
+    assert codec.decode(data) == bonds
+    text = 'x' * 4096
+    assert codec.decode(codec.encode(text)) == text
+
+
+def test_codec_reads_legacy_json():
+    assert parse_model(StockPriceNotificationReadRs,
+                       Codec.decode(notification.json().encode('utf-8'))) == notification
+    assert Codec.decode(None) is None
+
+
+def test_codec_rejects_unknown_version():
+    with pytest.raises(ValueError):
+        Codec.decode(bytes((MAGIC, 99, 0)) + b'payload')
+    with pytest.raises(ValueError):
+        get_codec('pickle')
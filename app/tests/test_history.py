@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from starlette.testclient import TestClient
+
+from app.core import settings
+from app.db.history import PriceHistory, RECORD, lttb, ohlc
+from app.main import app
+
+
+@pytest.fixture
+def history_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, 'history_dir', str(tmp_path))
+    yield tmp_path
+    PriceHistory.close()
+
+
+def test_history_range_is_slice_of_memory_map(history_dir):
+    for i in range(100):
+        PriceHistory.append('MOEX.ME', 170 + i % 10, timestamp=1000.0 + i)
+    records = PriceHistory.read('MOEX.ME', start=1010, end=1020)
+    assert records['t'].tolist() == [1010.0 + i for i in range(10)]
+    assert records['p'].tolist() == [170.0 + i for i in range(10)]
+    assert isinstance(records.base, np.memmap) or isinstance(records, np.memmap)
+    assert len(PriceHistory.read('MOEX.ME')) == 100
+    assert len(PriceHistory.read('SBER.ME')) == 0
+    with pytest.raises(ValueError):
+        PriceHistory.read('../MOEX')
+
+
+def test_ohlc_buckets():
+    records = np.array([(0, 10), (1, 12), (2, 9), (3, 11), (10, 20), (25, 5)], dtype=RECORD)
+    buckets = ohlc(records, interval=10)
+    assert buckets['t'].tolist() == [0, 10, 20]
+    assert buckets['open'].tolist() == [10, 20, 5]
+    assert buckets['high'].tolist() == [12, 20, 5]
+    assert buckets['low'].tolist() == [9, 20, 5]
+    assert buckets['close'].tolist() == [11, 20, 5]
+    assert buckets['count'].tolist() == [4, 1, 1]
+
+
+def test_lttb_keeps_ends_and_peaks():
+    t = np.arange(1000, dtype=float)
+    p = np.sin(t / 50) * 10 + 100
+    p[500] = 150
+    records = np.rec.fromarrays([t, p], dtype=RECORD)
+    points = lttb(records, 50)
+    assert len(points['t']) == 50
+    assert points['t'][0] == 0 and points['t'][-1] == 999
+    assert 150 in points['price']
+    assert np.all(np.diff(points['t']) > 0)
+    assert len(lttb(records[:10], 50)['t']) == 10
+
+
+def test_history_endpoint(history_dir):
+    for i in range(600):
+        PriceHistory.append('SBER.ME', 270 + i % 7, timestamp=1600000020.0 + i)
+    client = TestClient(app)
+    buckets = client.get('/stocks/SBER.ME/history', params={'interval': 60})
+    points = client.get('/stocks/SBER.ME/history', params={'points': 100})
+    too_many = client.get('/stocks/SBER.ME/history', params={'interval': 0})
+    assert buckets.status_code == 200
+    assert len(buckets.json()['t']) == 10
+    assert sum(buckets.json()['count']) == 600
+    assert len(points.json()['price']) == 100
+    assert 'open' not in points.json()
+    assert too_many.status_code == 422
@@ -2,6 +2,7 @@ import asyncio
 
 import pytest
 
+from app.core import settings
 from app.db.redis_pub import Redis
 
 
@@ -68,3 +69,46 @@ async def test_redis_cache_expired(event_loop):
     await asyncio.sleep(redis_test_ttl)
     cached_message = await redis.get_cached(collection_key=redis_test_collection)
     assert cached_message is None
+
+
+@pytest.mark.asyncio
+async def test_redis_pool_is_shared(event_loop):
+    assert await Redis().get_pool() is await redis.get_pool()
+    await redis.get_cached(collection_key=redis_test_collection)
+    stats = Redis.pool_stats()
+    assert stats['acquired'] > 0
+    assert stats['in_use'] == 0
+    assert stats['size'] <= stats['max_size']
+
+
+@pytest.mark.asyncio
+async def test_redis_hash_fields(event_loop):
+    hash_key = 'test:hash'
+    await redis.save_hash(hash_key, {'body': {'id': 'test'}, 'price': '171.73'}, ttl_per_sec=redis_test_ttl)
+    assert await redis.get_hash(hash_key) == {'body': {'id': 'test'}, 'price': '171.73'}
+    assert await redis.get_key_ttl(hash_key) == redis_test_ttl
+    await redis.delete(hash_key)
+    assert await redis.get_hash(hash_key) is None
+
+
+@pytest.mark.asyncio
+async def test_redis_hash_reads_string_value(event_loop):
+    string_key = 'test:hash:string'
+    await redis.save_cache({'id': 'test'}, collection_key=string_key, ttl_per_sec=redis_test_ttl)
+    assert await redis.get_many_hashes([string_key, 'test:hash:missing']) == [{'id': 'test'}, None]
+    await redis.delete(string_key)
+
+
+@pytest.mark.asyncio
+async def test_redis_publish_to_stream(event_loop):
+    stream = 'test:stream'
+    # consumer group is created again after the stream is deleted
+    for message in (redis_test_message, redis_new_test_message):
+        await redis.delete(stream)
+        await redis.start_publish(message, stream=stream)
+        async with redis.get_connection() as conn:
+            messages = await conn.xread_group(settings.redis_notification_group, 'test', [stream],
+                                              timeout=None, latest_ids=['>'])
+            await conn.xack(stream, settings.redis_notification_group, messages[0][1])
+        assert [fields for _, _, fields in messages] == [{'message': message}]
+    await redis.delete(stream)
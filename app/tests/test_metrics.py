@@ -0,0 +1,78 @@
+import pytest
+from httpx import AsyncClient
+
+from app.core.metrics import PROCESS, REDIS_LATENCY, Histogram, MetricsRegistry, render
+from app.db.codecs import Codec
+from app.db.redis_pub import Redis
+from app.main import app
+from app.models.models import BondsRs
+from app.services.bonds import Bonds
+from app.services.metrics import Metrics
+
+
+def test_histograms_are_merged_and_rendered():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    registry.gauge('lag_seconds', 'Lag').set(0.25)
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    other = Histogram('latency_seconds', 'Latency', ('route',), buckets=(0.1, 1.0))
+    other.observe(2.0, '/a')
+    snapshot = registry.snapshot()
+    other_snapshot = {'process': 'other:1', 'metrics': {
+        'latency_seconds': {**snapshot['metrics']['latency_seconds'], 'samples': other.samples()},
+        'lag_seconds': {**snapshot['metrics']['lag_seconds'], 'samples': [[[], 1.5]]}}}
+
+    text = render(MetricsRegistry.merge([snapshot, other_snapshot]))
+    process = snapshot['process']
+    assert f'latency_seconds_bucket{{process="{process}",route="/a",le="0.1"}} 1\n' in text
+    assert f'latency_seconds_bucket{{process="{process}",route="/a",le="1.0"}} 2\n' in text
+    assert f'latency_seconds_count{{process="{process}",route="/a"}} 2\n' in text
+    assert 'latency_seconds_bucket{process="other:1",route="/a",le="1.0"} 0\n' in text
+    assert 'latency_seconds_bucket{process="other:1",route="/a",le="+Inf"} 1\n' in text
+    assert f'lag_seconds{{process="{snapshot["process"]}"}} 0.25\n' in text
+    assert 'lag_seconds{process="other:1"} 1.5\n' in text
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_merges_processes(monkeypatch):
+    async def bonds_list(self):
+        return BondsRs.parse_obj([])
+
+    monkeypatch.setattr(Bonds, 'list', bonds_list)
+    other = {'process': 'worker-host:7', 'time': 0, 'metrics': {
+        'notifications_active': {'type': 'gauge', 'description': 'Notifications run by the worker',
+                                 'labels': [], 'buckets': [], 'samples': [[[], 12]]}}}
+    await Metrics.publish(other)
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        await client.get('/bonds/')
+        response = await client.get('/metrics')
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert f'http_request_duration_seconds_count{{process="{PROCESS}",method="GET",route="/bonds/",status="200"}}' \
+        in response.text
+    assert f'redis_command_duration_seconds_count{{process="{PROCESS}",command="save_cache"}}' in response.text
+    assert 'notifications_active{process="worker-host:7"} 12\n' in response.text
+    await Redis().delete(Metrics.get_snapshot_key('worker-host:7'))
+
+
+@pytest.mark.asyncio
+async def test_metrics_merge_snapshots_saved_by_json_codec(monkeypatch):
+    monkeypatch.setattr(Redis, 'codec', Codec())
+    other = {'process': 'worker-host:8', 'time': 0, 'metrics': {
+        'notifications_active': {'type': 'gauge', 'description': 'Notifications run by the worker',
+                                 'labels': [], 'buckets': [], 'samples': [[[], 3]]}}}
+    await Metrics.publish(other)
+    assert 'notifications_active{process="worker-host:8"} 3\n' in await Metrics.collect()
+    await Redis().delete(Metrics.get_snapshot_key('worker-host:8'))
+
+
+@pytest.mark.asyncio
+async def test_nested_storage_calls_are_observed_once(monkeypatch):
+    monkeypatch.setattr(REDIS_LATENCY, 'series', {})
+    storage = Redis()
+    await storage.save_hash('metrics:test:hash', {'price': '1'})
+    await storage.get_hash('metrics:test:hash')
+    await storage.delete('metrics:test:hash')
+    assert sorted(labels[0] for labels in REDIS_LATENCY.series) == ['delete', 'get_hash', 'save_hash']
+    assert all(series[-1] == 1 for series in REDIS_LATENCY.series.values())
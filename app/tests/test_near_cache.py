@@ -0,0 +1,62 @@
+import time
+
+from app.db.near_cache import NearCache
+
+
+def active_cache(max_bytes: int = 1024, ttl: int = 60) -> NearCache:
+    cache = NearCache(max_bytes=max_bytes, ttl=ttl)
+    cache.active = True
+    return cache
+
+
+def test_near_cache_inactive_serves_nothing():
+    cache = NearCache(max_bytes=1024, ttl=60)
+    cache.set('stock:price:MOEX.ME', '171.73', size=6)
+    assert cache.get('stock:price:MOEX.ME') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_near_cache_hit_and_miss():
+    cache = active_cache()
+    assert cache.get('stock:price:MOEX.ME') is None
+    cache.set('stock:price:MOEX.ME', '171.73', size=6, redis_ttl=3600)
+    value, ttl = cache.get('stock:price:MOEX.ME')
+    assert value == '171.73'
+    assert 3590 < ttl <= 3600
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_near_cache_expiration(monkeypatch):
+    cache = active_cache(ttl=60)
+    now = time.monotonic()
+    cache.set('stock:price:MOEX.ME', '171.73', size=6)
+    cache.set('stock:price:SBER.ME', '270.10', size=6, redis_ttl=5)
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 10)
+    assert cache.get('stock:price:MOEX.ME') == ('171.73', None)
+    assert cache.get('stock:price:SBER.ME') is None
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+    assert cache.get('stock:price:MOEX.ME') is None
+    assert cache.stats()['expirations'] == 2
+
+
+def test_near_cache_evicts_least_recently_used():
+    cache = active_cache(max_bytes=3 * len('key:0value'))
+    for i in range(3):
+        cache.set(f'key:{i}', 'value', size=5)
+    cache.get('key:0')
+    cache.set('key:3', 'value', size=5)
+    assert cache.get('key:1') is None
+    assert cache.get('key:0') is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] <= cache.max_bytes
+
+
+def test_near_cache_drops_value_read_before_invalidation():
+    cache = active_cache()
+    version = cache.version
+    cache.invalidate(['stock:price:MOEX.ME'])
+    cache.set('stock:price:MOEX.ME', '171.73', size=6, version=version)
+    assert cache.get('stock:price:MOEX.ME') is None
+    cache.set('stock:price:MOEX.ME', '171.80', size=6, version=cache.version)
+    assert cache.get('stock:price:MOEX.ME') == ('171.80', None)
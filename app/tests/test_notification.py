@@ -0,0 +1,346 @@
+import asyncio
+import json
+from decimal import Decimal
+from uuid import uuid4
+
+import pytest
+from httpx import AsyncClient
+
+from app.core import settings
+from app.db.codecs import MsgpackCodec
+from app.db.scripts import UPDATE_NOTIFICATION_PRICE
+from app.db.redis_pub import Redis
+from app.main import app
+from app.models.models import (Amount, ExchangeRs, StockPriceNotificationDeleteRq, StockPriceNotificationReadRs,
+                               TelegramUser)
+from app.services.notification import NotificationStockPriceService
+from app.services.notification_worker import NotificationWorker
+from app.tests.stubs import RedisCountingProxy
+
+
+async def save_notification(chat_id: str, notification_id: str, symbol: str = 'MOEX.ME',
+                            target_price: float = 180.5) -> NotificationStockPriceService:
+    """
+    Save and enqueue notification the way `NotificationStockPriceService.create` does, without price request
+    """
+    service = NotificationStockPriceService()
+    service.notification = StockPriceNotificationReadRs(ticker=symbol.split('.')[0],
+                                                        chatId=chat_id,
+                                                        exchange=ExchangeRs(code='ME', yahoo_search_symbol=symbol),
+                                                        targetPrice=target_price,
+                                                        action='Buy',
+                                                        delay=10,
+                                                        id=notification_id,
+                                                        currentPrice=Amount(value=Decimal('171.73'),
+                                                                            currency='RUB',
+                                                                            currency_symbol='₽'),
+                                                        state='new')
+    service.notification_cache_key = service.get_notification_cache_key(chatId=chat_id,
+                                                                         notification_id=notification_id)
+    await service.save_notification(service.notification)
+    await service.enqueue()
+    return service
+
+
+async def wait_for(condition, timeout: float = 2.0):
+    for _ in range(int(timeout / 0.05)):
+        if await condition():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+@pytest.mark.asyncio
+async def test_price_reaching_target_moves_notification_to_done():
+    storage = Redis()
+    # events of earlier runs stay in the stream
+    notification_id = uuid4().hex
+    key = (await save_notification('41154', notification_id, symbol='TSTE.ME')).notification_cache_key
+    service = NotificationStockPriceService()
+    await service.restore(key)
+    await storage.save_cache('185', collection_key=service.price_cache_key,
+                             ttl_per_sec=settings.redis_stock_price_cache_ttl)
+    await service.update_price()
+    assert service.state == 'new'
+    assert (await storage.get_hash(key))['state'] == 'in_progress'
+
+    await storage.save_cache('179.9', collection_key=service.price_cache_key,
+                             ttl_per_sec=settings.redis_stock_price_cache_ttl)
+    await service.update_price()
+    fields = await storage.get_hash(key)
+    assert (fields['state'], fields['price']) == ('done', '179.9')
+    assert service.state == 'done'
+    assert key not in (await storage.get_set(service.get_symbol_key('TSTE.ME')) or [])
+
+    async def published():
+        async with storage.get_connection() as conn:
+            entries = await conn.xrevrange(settings.redis_notification_stream, count=10)
+        events = [json.loads(fields['message']) for _, fields in entries]
+        return any(event['id'] == notification_id and event['state'] == 'done' for event in events)
+
+    assert await wait_for(published)
+    await service.delete_keys('41154')
+
+
+@pytest.mark.asyncio
+async def test_chat_notifications_are_listed_in_two_round_trips():
+    proxy = await RedisCountingProxy(settings.redis_host, int(settings.redis_port)).start()
+    storage = Redis(host=proxy.host, port=str(proxy.port))
+    service = NotificationStockPriceService()
+    service.storage = storage
+    try:
+        for i in range(5):
+            await save_notification('41157', f'ntf{i}', symbol='TSTG.ME')
+        # notification saved as string before hash layout
+        legacy = await save_notification('41157', 'ntf5', symbol='TSTG.ME')
+        await Redis().save_cache(legacy.notification.dict(), collection_key=legacy.notification_cache_key)
+        # the script is loaded and the connection is opened by the first call
+        await save_notification('41158', 'ntf0', symbol='TSTG.ME')
+        await service.get_many(TelegramUser(chatId='41158'))
+        round_trips, commands = proxy.round_trips, proxy.commands
+        listed = await service.get_many(TelegramUser(chatId='41157'))
+        assert [item.id for item in listed] == [f'ntf{i}' for i in range(6)]
+        # the index is read first, so the script gets notification keys declared
+        assert (proxy.round_trips - round_trips, proxy.commands - commands) == (2, 2)
+
+        # expired notification is dropped from the index by the listing, deleted one by the delete
+        await Redis().delete('notification:41157:ntf0')
+        await service.delete_one(StockPriceNotificationDeleteRq(id='ntf1', chatId='41157'))
+        assert [item.id for item in await service.get_many(TelegramUser(chatId='41157'))] == ['ntf2', 'ntf3', 'ntf4', 'ntf5']
+        assert await Redis().get_sorted_set(service.get_chat_index_key('41157')) == \
+            [f'notification:41157:ntf{i}' for i in (2, 3, 4, 5)]
+    finally:
+        await NotificationStockPriceService().delete_keys('41157')
+        await NotificationStockPriceService().delete_keys('41158')
+        pool = await storage.get_pool()
+        pool.close()
+        await pool.wait_closed()
+        await proxy.stop()
+
+
+@pytest.mark.asyncio
+async def test_delete_notifications_script_drops_index_and_symbols():
+    storage = Redis()
+    await save_notification('41150', 'ntf1', symbol='TSTA.ME')
+    await save_notification('41150', 'ntf2', symbol='TSTB.ME')
+    await save_notification('41151', 'ntf3', symbol='TSTB.ME')
+    service = NotificationStockPriceService()
+
+    deleted = await service.delete_keys('41150')
+
+    assert sorted(item.id for item in deleted) == ['ntf1', 'ntf2']
+    assert not await storage.exists('notification:41150:ntf1')
+    assert not await storage.exists('notification:41150:ntf2')
+    assert not await storage.get_sorted_set(service.get_chat_index_key('41150'))
+    assert not await storage.get_set(service.get_symbol_key('TSTA.ME'))
+    assert await storage.get_set(service.get_symbol_key('TSTB.ME')) == ['notification:41151:ntf3']
+    symbols = await storage.get_set(settings.redis_notification_symbols_key)
+    assert 'TSTA.ME' not in symbols and 'TSTB.ME' in symbols
+
+    assert await service.delete_keys('41150') == []
+    assert [item.id for item in await service.delete_keys('41151')] == ['ntf3']
+    assert 'TSTB.ME' not in await storage.get_set(settings.redis_notification_symbols_key)
+
+
+@pytest.mark.asyncio
+async def test_compressed_notification_saved_as_string_is_deleted_with_its_symbol(monkeypatch):
+    monkeypatch.setattr(Redis, 'codec', MsgpackCodec(compress_threshold=1))
+    storage = Redis()
+    legacy = await save_notification('41156', 'ntf1', symbol='TSTH.ME')
+    await storage.save_cache(legacy.notification.dict(), collection_key=legacy.notification_cache_key)
+    assert (await storage.get_many_cached([legacy.notification_cache_key]))[0]['id'] == 'ntf1'
+
+    deleted = await NotificationStockPriceService().delete_keys('41156')
+
+    assert [item.id for item in deleted] == ['ntf1']
+    assert not await storage.exists(legacy.notification_cache_key)
+    assert not await storage.get_set(legacy.get_symbol_key('TSTH.ME'))
+    assert 'TSTH.ME' not in await storage.get_set(settings.redis_notification_symbols_key)
+
+
+@pytest.mark.asyncio
+async def test_delete_unknown_notification_answers_404():
+    await save_notification('41152', 'ntf1', symbol='TSTC.ME')
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        missing = await client.delete('/notification/unknown', params={'chatId': '41152'})
+        deleted = await client.delete('/notification/ntf1', params={'chatId': '41152'})
+        again = await client.delete('/notification/ntf1', params={'chatId': '41152'})
+    assert missing.status_code == again.status_code == 404
+    assert deleted.status_code == 204
+
+
+@pytest.mark.asyncio
+async def test_control_message_stops_updates_of_deleted_notification():
+    storage = Redis()
+    worker = NotificationWorker(worker_id='test-worker')
+    worker.scheduler.start(paused=True)
+    await save_notification('41153', 'ntf1', symbol='TSTD.ME')
+    await save_notification('41153', 'ntf2', symbol='TSTD.ME')
+    await worker.sync_symbol('TSTD.ME')
+    # one price tick job runs all notifications of the symbol
+    assert [job.id for job in worker.scheduler.get_jobs()] == ['price_tick_TSTD.ME']
+    assert sorted(worker.notifications['TSTD.ME']) == ['notification:41153:ntf1', 'notification:41153:ntf2']
+
+    async def subscribed():
+        async with storage.get_connection() as conn:
+            return sum((await conn.pubsub_numsub(settings.redis_notification_control_channel)).values())
+
+    async def stopped():
+        return 'notification:41153:ntf1' not in worker.notifications['TSTD.ME']
+
+    control = asyncio.create_task(worker.listen_control())
+    try:
+        assert await wait_for(subscribed)
+        async with AsyncClient(app=app, base_url='http://test') as client:
+            response = await client.delete('/notification/ntf1', params={'chatId': '41153'})
+        assert response.status_code == 204
+        assert await wait_for(stopped)
+        assert list(worker.notifications['TSTD.ME']) == ['notification:41153:ntf2']
+        assert worker.scheduler.get_job('price_tick_TSTD.ME')
+
+        await NotificationStockPriceService().delete_keys('41153')
+        await worker.sync_symbol('TSTD.ME')
+        assert worker.scheduler.get_job('price_tick_TSTD.ME') is None
+    finally:
+        control.cancel()
+        await asyncio.gather(control, return_exceptions=True)
+        worker.scheduler.shutdown(wait=False)
+        await NotificationStockPriceService().delete_keys('41153')
+
+
+@pytest.mark.asyncio
+async def test_symbol_notifications_are_restored_and_ticked_in_constant_round_trips():
+    proxy = await RedisCountingProxy(settings.redis_host, int(settings.redis_port)).start()
+    worker = NotificationWorker(worker_id='test-worker')
+    worker.storage = Redis(host=proxy.host, port=str(proxy.port))
+    worker.scheduler.start(paused=True)
+    storage = Redis()
+    try:
+        ids = [uuid4().hex for _ in range(20)]
+        for i, notification_id in enumerate(ids):
+            await save_notification(f'4116{i % 2}', notification_id, symbol='TSTJ.ME', target_price=150)
+        price_key = NotificationStockPriceService.get_price_cache_key('TSTJ.ME')
+        await storage.save_cache('171.5', collection_key=price_key, ttl_per_sec=settings.redis_stock_price_cache_ttl)
+        # the connection is opened and the script is loaded by the first calls
+        await worker.storage.get_set(settings.redis_notification_symbols_key)
+        await worker.storage.run_scripts(UPDATE_NOTIFICATION_PRICE, [(['notification:41160:missing'], ['1', '1', ''])])
+
+        round_trips = proxy.round_trips
+        await worker.sync_symbol('TSTJ.ME')
+        running = worker.notifications['TSTJ.ME']
+        assert len(running) == 20 and all(service.state == 'in_progress' for service in running.values())
+        assert proxy.round_trips - round_trips == 2
+
+        round_trips = proxy.round_trips
+        await worker.tick('TSTJ.ME', 10)
+        assert proxy.round_trips - round_trips == 2
+        fields = await storage.get_many_hashes(list(running))
+        assert {(item['state'], item['price']) for item in fields} == {('in_progress', '171.5')}
+        # notifications are not due until their delay passes
+        round_trips = proxy.round_trips
+        await worker.tick('TSTJ.ME', 10)
+        assert proxy.round_trips == round_trips
+
+        await storage.save_cache('149', collection_key=price_key, ttl_per_sec=settings.redis_stock_price_cache_ttl)
+        for service in running.values():
+            service.next_update = 0.0
+        await worker.tick('TSTJ.ME', 10)
+        assert all(service.state == 'done' for service in running.values())
+
+        async def published():
+            async with storage.get_connection() as conn:
+                entries = await conn.xrevrange(settings.redis_notification_stream, count=50)
+            return set(ids) <= {json.loads(fields['message'])['id'] for _, fields in entries}
+
+        assert await wait_for(published)
+    finally:
+        worker.scheduler.shutdown(wait=False)
+        for chat_id in ('41160', '41161'):
+            await NotificationStockPriceService().delete_keys(chat_id)
+        pool = await worker.storage.get_pool()
+        pool.close()
+        await pool.wait_closed()
+        await proxy.stop()
+
+
+@pytest.mark.asyncio
+async def test_lease_is_acquired_renewed_and_released_by_owner_only(monkeypatch):
+    monkeypatch.setattr(settings, 'notification_worker_lease_ttl', 1)
+    storage = Redis()
+    first, second = NotificationWorker(worker_id='test-worker-1'), NotificationWorker(worker_id='test-worker-2')
+    lease_key = first.get_lease_key('TSTL.ME')
+    await storage.delete(lease_key)
+
+    assert await first.acquire(['TSTL.ME']) == {'TSTL.ME'}
+    assert await second.acquire(['TSTL.ME']) == set()
+    await asyncio.sleep(0.6)
+    assert await first.acquire(['TSTL.ME']) == {'TSTL.ME'}
+    async with storage.get_connection() as conn:
+        assert await conn.pttl(lease_key) > 600
+    await second.release(['TSTL.ME'])
+    assert await second.acquire(['TSTL.ME']) == set()
+    await first.release(['TSTL.ME'])
+    assert await second.acquire(['TSTL.ME']) == {'TSTL.ME'}
+    await storage.delete(lease_key)
+
+
+@pytest.mark.asyncio
+async def test_symbols_fail_over_when_worker_lease_expires(monkeypatch):
+    monkeypatch.setattr(settings, 'notification_worker_lease_ttl', 1)
+    monkeypatch.setattr(settings, 'redis_notification_symbols_key', 'test:notification:symbols')
+    monkeypatch.setattr(settings, 'redis_notification_workers_key', 'test:notification:workers')
+    storage = Redis()
+    symbols = {f'TSF{i}.ME' for i in range(6)}
+    await storage.delete(settings.redis_notification_workers_key,
+                         *[NotificationWorker.get_lease_key(symbol) for symbol in symbols])
+    for i, symbol in enumerate(sorted(symbols)):
+        await save_notification('41155', f'ntf{i}', symbol=symbol)
+    first, second = NotificationWorker(worker_id='test-worker-1'), NotificationWorker(worker_id='test-worker-2')
+    for worker in (first, second):
+        worker.scheduler.start(paused=True)
+    try:
+        await first.rebalance()
+        assert first.owned_symbols == symbols
+        await second.rebalance()
+        # symbols are leased by the first worker until its leases expire
+        assert second.owned_symbols == set()
+
+        # the first worker stops without releasing leases, they expire with its heartbeat
+        await asyncio.sleep(1.2)
+        await second.rebalance()
+        assert second.owned_symbols == symbols
+        assert set(second.notifications) == symbols
+        assert all(len(running) == 1 for running in second.notifications.values())
+    finally:
+        for worker in (first, second):
+            worker.scheduler.shutdown(wait=False)
+        await NotificationStockPriceService().delete_keys('41155')
+        await storage.delete(settings.redis_notification_workers_key, settings.redis_notification_symbols_key,
+                             *[NotificationWorker.get_lease_key(symbol) for symbol in symbols])
+
+
+@pytest.mark.asyncio
+async def test_adaptive_polling_checks_expiration(monkeypatch):
+    monkeypatch.setattr(settings, 'notification_polling_mode', 'adaptive')
+    storage = Redis()
+    worker = NotificationWorker(worker_id='test-worker')
+    notification_id = uuid4().hex
+    key = (await save_notification('41159', notification_id, symbol='TSTI.ME')).notification_cache_key
+    await worker.sync_symbol('TSTI.ME')
+    service = worker.notifications['TSTI.ME'][key]
+    # the price update is moved far away by adaptive polling
+    service.next_update = float('inf')
+    await worker.tick('TSTI.ME', 10)
+    assert service.state == 'in_progress'
+
+    await storage.delete(key)
+    await worker.tick('TSTI.ME', 10)
+    assert service.state == 'disabled'
+
+    async def published():
+        async with storage.get_connection() as conn:
+            entries = await conn.xrevrange(settings.redis_notification_stream, count=10)
+        return any(json.loads(fields['message'])['id'] == notification_id for _, fields in entries)
+
+    assert await wait_for(published)
+    assert not await storage.get_set(service.get_symbol_key('TSTI.ME'))
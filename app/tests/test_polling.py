@@ -0,0 +1,31 @@
+from app.services.polling import AdaptivePolling
+
+delay = 60
+max_delay = 3600
+
+
+def build_policy() -> AdaptivePolling:
+    policy = AdaptivePolling(delay=delay, max_delay=max_delay, z_score=3)
+    for i, price in enumerate([100, 100.1, 99.9, 100.05, 100]):
+        policy.observe(price, timestamp=i * delay)
+    return policy
+
+
+def test_polling_base_delay_without_history():
+    policy = AdaptivePolling(delay=delay, max_delay=max_delay)
+    assert policy.next_interval(price=100, target=140) == delay
+
+
+def test_polling_far_target_is_polled_rarely():
+    assert build_policy().next_interval(price=100, target=140) == max_delay
+
+
+def test_polling_close_target_is_polled_with_delay():
+    assert build_policy().next_interval(price=100, target=100.1) == delay
+
+
+def test_polling_interval_grows_with_distance():
+    policy = build_policy()
+    intervals = [policy.next_interval(price=100, target=t) for t in (100.5, 101, 101.5)]
+    assert intervals == sorted(intervals)
+    assert delay < intervals[-1] < max_delay
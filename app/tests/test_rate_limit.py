@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from app.core.metrics import RATE_LIMITED
+from app.db.rate_limit import RateLimitedError, RateLimiter
+from app.db.redis_pub import Redis
+from app.main import app
+from app.services.resilience import CircuitOpenError, UpstreamPolicy
+
+NOTIFICATION = {
+    'ticker': 'MOEX',
+    'exchange': {'code': 'MCX', 'name': 'MCX', 'yahoo_search_symbol': 'MOEX.ME'},
+    'targetPrice': 150,
+    'action': 'Buy',
+    'delay': 10,
+}
+
+
+@pytest.mark.asyncio
+async def test_bucket_takes_burst_then_rejects():
+    limiter = RateLimiter('test_bucket', rate=0.5, burst=2)
+    await Redis().delete(limiter.get_bucket_key('41144'))
+    rejected = RATE_LIMITED.series.get(('test_bucket',), 0)
+
+    assert await limiter.take('41144') == 0
+    assert await limiter.take('41144') == 0
+    assert 1.5 < await limiter.take('41144') <= 2.0
+    assert await limiter.take('41145') == 0
+    assert RATE_LIMITED.series.get(('test_bucket',), 0) == rejected
+    with pytest.raises(RateLimitedError):
+        await limiter.check('41144')
+    assert RATE_LIMITED.series[('test_bucket',)] == rejected + 1
+    with pytest.raises(ValueError):
+        await limiter.take('41145', tokens=3)
+    await Redis().delete(limiter.get_bucket_key('41144'), limiter.get_bucket_key('41145'))
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_refill():
+    limiter = RateLimiter('test_refill', rate=20, burst=2)
+    await Redis().delete(limiter.get_bucket_key())
+    await limiter.acquire(tokens=2)
+    started = time.perf_counter()
+    await limiter.acquire(tokens=2, max_wait=1)
+    assert 0.05 < time.perf_counter() - started < 0.5
+    with pytest.raises(RateLimitedError):
+        await limiter.acquire(tokens=2, max_wait=0.01)
+    await Redis().delete(limiter.get_bucket_key())
+
+
+@pytest.mark.asyncio
+async def test_chat_creating_notifications_too_fast_gets_429(monkeypatch):
+    limiter = RateLimiter('notification_create', rate=0.01, burst=1)
+    monkeypatch.setitem(RateLimiter._limiters, 'notification_create', limiter)
+    await Redis().delete(limiter.get_bucket_key('41146'))
+    await limiter.take('41146')
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.post('/notification/', json={**NOTIFICATION, 'chatId': '41146'})
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '100'
+    await Redis().delete(limiter.get_bucket_key('41146'))
+
+
+@pytest.mark.asyncio
+async def test_upstream_is_not_requested_over_rate_limit():
+    limiter = RateLimiter('test_upstream', rate=0.01, burst=1)
+    await Redis().delete(limiter.get_bucket_key())
+    policy = UpstreamPolicy('test_upstream', max_concurrency=1, timeout=1, rate_limiter=limiter)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        return 'ok'
+
+    assert await policy.call(request) == 'ok'
+    with pytest.raises(RateLimitedError):
+        await policy.call(request)
+    assert len(calls) == 1
+    await Redis().delete(limiter.get_bucket_key())
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_half_open_trial_is_released():
+    limiter = RateLimiter('test_trial', rate=0.01, burst=1)
+    await Redis().delete(limiter.get_bucket_key())
+    policy = UpstreamPolicy('test_trial', max_concurrency=1, timeout=1, failure_threshold=1, reset_timeout=0.05,
+                            rate_limiter=limiter)
+
+    async def fail():
+        raise ConnectionError('injected failure')
+
+    async def ok():
+        return 'ok'
+
+    with pytest.raises(ConnectionError):
+        await policy.call(fail)
+    with pytest.raises(CircuitOpenError):
+        await policy.call(ok)
+    await asyncio.sleep(0.06)
+    with pytest.raises(RateLimitedError):
+        await policy.call(ok)
+    policy.rate_limiter = None
+    assert await policy.call(ok) == 'ok'
+    assert policy.stats()['state'] == 'closed'
+    await Redis().delete(limiter.get_bucket_key())
+
+
+@pytest.mark.asyncio
+async def test_yahoo_rate_limit_answers_429(monkeypatch):
+    limiter = RateLimiter('yahoo', rate=0.01, burst=1)
+    monkeypatch.setitem(RateLimiter._limiters, 'yahoo', limiter)
+    monkeypatch.setattr(UpstreamPolicy, '_policies', {})
+    await Redis().delete(limiter.get_bucket_key())
+    await limiter.take()
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        lookup = await client.get('/stocks/ZZRL')
+        created = await client.post('/notification/', json={**NOTIFICATION, 'chatId': '41147'})
+    assert lookup.status_code == created.status_code == 429
+    assert int(lookup.headers['retry-after']) > 1
+    await Redis().delete(limiter.get_bucket_key())
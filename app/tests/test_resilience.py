@@ -0,0 +1,182 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from app.core import settings
+from app.models.models import StockRq, ExchangeRs
+from app.db.redis_pub import Redis
+from app.services.bonds import Bonds, DataFetcher
+from app.services.resilience import CircuitOpenError, UpstreamPolicy
+from app.services.stock import StockService
+from app.tests.stubs import FakeYahooServer
+
+MOEX = StockRq(ticker='MOEX', exchange=ExchangeRs(yahoo_search_symbol='MOEX.ME'))
+
+
+class SlowFirstYahoo(FakeYahooServer):
+    """
+    Answers the first request after `first_latency` seconds and tracks requests in flight
+    """
+
+    def __init__(self, first_latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.first_latency = first_latency
+        self.received = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def dispatch(self, method: str, target: str):
+        self.received += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.received == 1:
+                await asyncio.sleep(self.first_latency)
+            return await super().dispatch(method, target)
+        finally:
+            self.in_flight -= 1
+
+
+async def start_yahoo(monkeypatch, **kwargs) -> SlowFirstYahoo:
+    server = await SlowFirstYahoo(price_path=lambda symbol, t: 171.73, **kwargs).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', server.base_url)
+    monkeypatch.setattr(settings, 'yahoo_retry_backoff', 0.001)
+    monkeypatch.setattr(UpstreamPolicy, '_policies', {})
+    return server
+
+
+@pytest.mark.asyncio
+async def test_retries_recover_from_injected_failures(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch, fail_rate=0.3)
+    monkeypatch.setattr(settings, 'yahoo_retries', 4)
+    prices = [await StockService().get_stock_price(MOEX) for _ in range(20)]
+    await StockService.close_client()
+    await yahoo.stop()
+    stats = StockService.get_policy().stats()
+    assert all(price and float(price.value) == 171.73 for price in prices)
+    assert stats['retried'] == stats['failures'] > 0
+    assert stats['state'] == 'closed'
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch, fail_rate=1.0)
+    monkeypatch.setattr(settings, 'yahoo_retries', 0)
+    monkeypatch.setattr(settings, 'yahoo_breaker_failures', 3)
+    monkeypatch.setattr(settings, 'yahoo_breaker_reset', 0.2)
+    prices = [await StockService().get_stock_price(MOEX) for _ in range(10)]
+    requests_when_open = yahoo.requests
+    stats = StockService.get_policy().stats()
+    yahoo.fail_rate = 0.0
+    await asyncio.sleep(0.25)
+    price = await StockService().get_stock_price(MOEX)
+    await StockService.close_client()
+    await yahoo.stop()
+    assert prices == [None] * 10
+    assert requests_when_open == 3
+    assert (stats['state'], stats['rejected']) == ('open', 7)
+    assert float(price.value) == 171.73
+    assert StockService.get_policy().stats()['state'] == 'closed'
+
+
+@pytest.mark.asyncio
+async def test_hedged_request_cuts_tail_latency(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch, first_latency=2.0)
+    monkeypatch.setattr(settings, 'yahoo_hedge_after', 0.05)
+    started = time.perf_counter()
+    price = await StockService().get_stock_price(MOEX)
+    elapsed = time.perf_counter() - started
+    await StockService.close_client()
+    await yahoo.stop()
+    stats = StockService.get_policy().stats()
+    assert float(price.value) == 171.73
+    assert elapsed < 1
+    assert (stats['hedged'], stats['hedge_wins'], stats['failures']) == (1, 1, 0)
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_capped(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch, latency=0.02)
+    monkeypatch.setattr(settings, 'yahoo_max_concurrency', 2)
+    prices = await asyncio.gather(*(StockService().get_stock_price(MOEX) for _ in range(10)))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert all(prices)
+    assert yahoo.max_in_flight == 2
+
+
+def test_sync_call_retries_and_opens_circuit():
+    policy = UpstreamPolicy(name='iss', max_concurrency=1, timeout=1, retries=2, retry_backoff=0.001,
+                            failure_threshold=3, reset_timeout=60, is_failure=DataFetcher.is_upstream_failure)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise requests.ConnectionError('injected failure')
+
+    with pytest.raises(requests.ConnectionError):
+        policy.call_sync(request)
+    with pytest.raises(CircuitOpenError):
+        policy.call_sync(request)
+    with pytest.raises(KeyError):
+        UpstreamPolicy(name='iss', max_concurrency=1, timeout=1, retries=2,
+                       is_failure=DataFetcher.is_upstream_failure).call_sync(lambda: {}['securities'])
+    assert len(calls) == 3
+    assert policy.stats()['state'] == 'open'
+
+
+@pytest.mark.asyncio
+async def test_blocking_iss_calls_do_not_block_event_loop(monkeypatch):
+    def slow_failure(cls, request_url, arguments, reference_name):
+        time.sleep(0.3)
+        raise requests.ConnectionError('injected failure')
+
+    monkeypatch.setattr(DataFetcher, 'get_data_by_reference', classmethod(slow_failure))
+    await Redis().delete(settings.redis_bonds_list_cache_key)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.create_task(tick())
+    try:
+        assert await Bonds().list() is None
+    finally:
+        ticker.cancel()
+    assert ticks >= 10
+
+
+@pytest.mark.asyncio
+async def test_cancelled_half_open_trial_does_not_wedge_circuit():
+    policy = UpstreamPolicy(name='test', max_concurrency=2, timeout=1, failure_threshold=1, reset_timeout=0.05)
+
+    async def fail():
+        raise ConnectionError('injected failure')
+
+    async def ok():
+        return 'ok'
+
+    with pytest.raises(ConnectionError):
+        await policy.call(fail)
+    await asyncio.sleep(0.06)
+    trial = asyncio.ensure_future(policy.call(lambda: asyncio.sleep(10)))
+    await asyncio.sleep(0.01)
+    assert policy.stats()['state'] == 'half_open'
+    trial.cancel()
+    await asyncio.gather(trial, return_exceptions=True)
+    # the trial waiting for a concurrency slot is cancelled
+    await policy.semaphore.acquire()
+    await policy.semaphore.acquire()
+    trial = asyncio.ensure_future(policy.call(ok))
+    await asyncio.sleep(0.01)
+    trial.cancel()
+    await asyncio.gather(trial, return_exceptions=True)
+    policy.semaphore.release()
+    policy.semaphore.release()
+    assert await policy.call(ok) == 'ok'
+    assert policy.stats()['state'] == 'closed'
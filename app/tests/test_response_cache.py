@@ -0,0 +1,129 @@
+import pytest
+from httpx import AsyncClient
+
+from app.core import settings
+from app.db.codecs import Codec
+from app.db.redis_pub import Redis
+from app.db.response_cache import ResponseCache
+from app.db.scripts import UPDATE_NOTIFICATION_PRICE
+from app.main import app
+from app.models.models import Amount, BondsRs, ExchangeRs, ExchangeSuffix, StockRs
+from app.services.bonds import Bonds
+from app.services.notification import NotificationStockPriceService
+from app.services.resilience import UpstreamPolicy
+from app.services.stock import StockService
+from app.tests.stubs import FakeYahooServer
+
+BONDS = BondsRs.parse_obj([{'isin': 'RU000A0ZZWZ9', 'name': 'Детский мир ПАО БО-07', 'couponAmount': 17.01,
+                            'couponPeriod': 182, 'couponPercent': 6.75, 'price': 92.75,
+                            'expiredDate': '2021-06-01T00:00:00'}])
+
+
+@pytest.mark.asyncio
+async def test_cached_response_and_not_modified(monkeypatch):
+    calls = []
+
+    async def bonds_list(self):
+        calls.append(1)
+        return BONDS
+
+    monkeypatch.setattr(Bonds, 'list', bonds_list)
+    await Redis().delete(ResponseCache.get_entry_key('/bonds/', []))
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        first = await client.get('/bonds/')
+        second = await client.get('/bonds/')
+        not_modified = await client.get('/bonds/', headers={'If-None-Match': first.headers['etag']})
+    assert len(calls) == 1
+    assert first.status_code == second.status_code == 200
+    assert second.json() == first.json() == [{'isin': 'RU000A0ZZWZ9', 'name': 'Детский мир ПАО БО-07',
+                                              'couponAmount': 17.01, 'couponPeriod': 182, 'couponPercent': 6.75,
+                                              'price': 92.75, 'expiredDate': '2021-06-01T00:00:00'}]
+    assert second.headers['etag'] == first.headers['etag']
+    assert first.headers['cache-control'] == 'public, max-age=300'
+    assert not_modified.status_code == 304 and not not_modified.content
+
+
+@pytest.mark.asyncio
+async def test_chat_responses_are_invalidated_by_notification_changes(monkeypatch):
+    calls = []
+
+    async def get_many(self, user):
+        calls.append(user.chatId)
+        return []
+
+    monkeypatch.setattr(NotificationStockPriceService, 'get_many', get_many)
+    cache = ResponseCache()
+    await cache.invalidate('41144')
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('/notification/', params={'chatId': '41144'})
+        await client.get('/notification/', params={'chatId': '41144'})
+        await client.get('/notification/', params={'chatId': '41145'})
+        assert calls == ['41144', '41145']
+        assert response.headers['cache-control'] == 'private, no-cache'
+        assert await cache.invalidate('41144') == 1
+        await client.get('/notification/', params={'chatId': '41144'})
+        assert calls == ['41144', '41145', '41144']
+
+        storage = Redis()
+        await storage.save_hash('notification:41144:n1', {'body': {}, 'state': 'in_progress'}, 60)
+        responses = await cache.get_keys('41144')
+        result = await storage.run_script(UPDATE_NOTIFICATION_PRICE,
+                                          keys=['notification:41144:n1', ResponseCache.get_index_key('41144'),
+                                                *responses, 'http:response:41144:unlisted'],
+                                          args=['171.73', '150', 'Buy'])
+        # only response keys listed in the index are deleted
+        assert result == ['in_progress', 0, responses] and len(responses) == 1
+        await client.get('/notification/', params={'chatId': '41144'})
+        assert calls == ['41144', '41145', '41144', '41144']
+    await storage.delete('notification:41144:n1')
+    await cache.invalidate('41145')
+
+
+@pytest.mark.asyncio
+async def test_cached_response_with_json_codec(monkeypatch):
+    async def get_many(self, user):
+        return []
+
+    monkeypatch.setattr(NotificationStockPriceService, 'get_many', get_many)
+    monkeypatch.setattr(Redis, 'codec', Codec())
+    cache = ResponseCache()
+    await cache.invalidate('41148')
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        first = await client.get('/notification/', params={'chatId': '41148'})
+        cached = await client.get('/notification/', params={'chatId': '41148'})
+    assert first.status_code == cached.status_code == 200
+    assert cached.json() == [] and cached.headers['etag'] == first.headers['etag']
+    await cache.invalidate('41148')
+
+
+@pytest.mark.asyncio
+async def test_failed_and_degraded_lookups_are_not_cached(monkeypatch):
+    yahoo = await FakeYahooServer(price_path=lambda symbol, t: 171.73, fail_rate=1.0).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', yahoo.base_url)
+    monkeypatch.setattr(settings, 'yahoo_retries', 0)
+    monkeypatch.setattr(UpstreamPolicy, '_policies', {})
+    await Redis().delete(ResponseCache.get_entry_key('/stocks/ZZFL', []),
+                         ResponseCache.get_entry_key('/stocks/ZZDG', []))
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        failed = await client.get('/stocks/ZZFL')
+        requests = yahoo.requests
+        retried = await client.get('/stocks/ZZFL')
+        assert failed.status_code == retried.status_code == 503
+        assert failed.headers['retry-after'] and 'etag' not in failed.headers
+        assert yahoo.requests == requests + len(ExchangeSuffix)
+        await StockService.close_client()
+        await yahoo.stop()
+
+        lookups = []
+
+        async def degraded_lookup(self, stock, first_hit=False):
+            lookups.append(stock.ticker)
+            self.degraded = True
+            return [StockRs(ticker='ZZDG', exchange=ExchangeRs(yahoo_search_symbol='ZZDG.ME'),
+                            price=Amount(value=10, currency='RUB', currency_symbol='₽'))]
+
+        monkeypatch.setattr(StockService, 'find_stocks_by_ticker', degraded_lookup)
+        partial = await client.get('/stocks/ZZDG')
+        await client.get('/stocks/ZZDG')
+    assert partial.status_code == 200 and partial.headers['cache-control'] == 'no-store'
+    assert lookups == ['ZZDG', 'ZZDG']
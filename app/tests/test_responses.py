@@ -0,0 +1,40 @@
+import json
+from decimal import Decimal
+
+from fastapi.encoders import jsonable_encoder
+
+from app.api import responses
+from app.api.responses import FastJSONResponse, validated_response
+from app.core import settings
+from app.models.models import Amount, BondsRs, ExchangeRs, StockPriceNotificationReadRs
+
+notification = StockPriceNotificationReadRs(ticker='MOEX',
+                                            exchange=ExchangeRs(code='ME', yahoo_search_symbol='MOEX.ME'),
+                                            targetPrice=180.5,
+                                            id='a1b2c3',
+                                            currentPrice=Amount(value=Decimal('171.73'),
+                                                                currency='RUB',
+                                                                currency_symbol='₽'),
+                                            state='in_progress')
+bonds = BondsRs.parse_obj([{'isin': 'RU000A0ZZWZ9', 'name': 'Детский мир ПАО БО-07', 'couponAmount': 17.01,
+                            'couponPeriod': 182, 'couponPercent': 6.75, 'price': 92.75,
+                            'expiredDate': '2021-06-01T00:00:00', 'effectiveYield': None}])
+
+
+def test_validated_response_matches_response_model(monkeypatch):
+    monkeypatch.setattr(settings, 'api_skip_response_validation', True)
+    response = validated_response([notification], exclude_none=True)
+    assert isinstance(response, FastJSONResponse)
+    assert json.loads(response.body) == jsonable_encoder([notification], exclude_none=True)
+    response = validated_response(bonds, exclude_none=True, exclude_unset=True, by_alias=False)
+    assert json.loads(response.body) == jsonable_encoder(bonds, exclude_none=True, exclude_unset=True)
+    assert validated_response(None) is None
+    monkeypatch.setattr(settings, 'api_skip_response_validation', False)
+    assert validated_response(bonds) is bonds
+
+
+def test_json_fallback_renders_same_document(monkeypatch):
+    body = FastJSONResponse(jsonable_encoder([notification])).body
+    monkeypatch.setattr(responses, 'orjson', None)
+    assert FastJSONResponse(jsonable_encoder([notification])).body == body
+    assert '₽' in body.decode('utf-8')
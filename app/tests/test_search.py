@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from app.core import settings
+from app.db.codecs import Codec
+from app.db.redis_pub import Redis
+from app.main import app
+from app.services.search import SecuritiesIndex, Security, SecuritiesDirectory, is_one_typo
+
+SECURITIES = [
+    Security('MOEX', 'ПАО Московская Биржа', 'MOEX.ME', 'MCX'),
+    Security('MOEXP', 'Московская Биржа ап', 'MOEXP.ME', 'MCX'),
+    Security('SBER', 'Сбербанк России ПАО ао', 'SBER.ME', 'MCX'),
+    Security('SBERP', 'Сбербанк России ПАО ап', 'SBERP.ME', 'MCX'),
+    Security('AAPL', 'Apple Inc.', 'AAPL', 'NasdaqGS'),
+]
+
+
+def test_is_one_typo():
+    assert not is_one_typo('MOEX', 'MOEX')
+    assert is_one_typo('MOEX', 'MEOX')
+    assert is_one_typo('MOEX', 'MOE')
+    assert is_one_typo('MOX', 'MOEX')
+    assert is_one_typo('SBER', 'SPER')
+    assert not is_one_typo('SBER', 'SEBP')
+    assert not is_one_typo('SBER', 'SB')
+
+
+def test_search_prefix_name_and_typo():
+    index = SecuritiesIndex(SECURITIES)
+    assert [s.ticker for s in index.search('moex')] == ['MOEX', 'MOEXP']
+    assert [s.ticker for s in index.search('SB')] == ['SBER', 'SBERP']
+    assert [s.ticker for s in index.search('сбер')] == ['SBER', 'SBERP']
+    assert [s.ticker for s in index.search('MEOX')] == ['MOEX']
+    assert [s.ticker for s in index.search('МОЕХ')] == ['MOEX', 'MOEXP']
+    assert index.search('MOEX', limit=1) == [SECURITIES[0]]
+    assert index.search('XYZQ') == []
+
+
+def test_search_takes_microseconds():
+    index = SecuritiesIndex(Security(f'T{i:04d}', f'Company {i}', f'T{i:04d}.ME', 'MCX') for i in range(10000))
+    started = time.perf_counter()
+    for _ in range(1000):
+        index.search('T123')
+        index.search('T1x34')
+    per_search = (time.perf_counter() - started) / 2000
+    assert per_search < 0.0005
+
+
+@pytest.mark.asyncio
+async def test_directory_is_loaded_from_file_and_cache(monkeypatch, tmp_path):
+    path = tmp_path / 'securities.csv'
+    path.write_text('ticker,name,yahoo_symbol,exchange\nAAPL,Apple Inc.,AAPL,NasdaqGS\n', encoding='utf-8')
+    monkeypatch.setattr(settings, 'stock_directory_file', str(path))
+    monkeypatch.setattr(SecuritiesDirectory, 'fetch_moex', staticmethod(lambda boards: SECURITIES[:4]))
+    await Redis().delete(SecuritiesDirectory.cache_key)
+    assert await SecuritiesDirectory.load() == 5
+    monkeypatch.setattr(SecuritiesDirectory, 'fetch_moex', staticmethod(lambda boards: []))
+    assert await SecuritiesDirectory.load() == 5
+    await Redis().delete(SecuritiesDirectory.cache_key)
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('/stocks/search', params={'q': 'aap'})
+    assert response.status_code == 200
+    assert response.json() == [{'ticker': 'AAPL', 'name': 'Apple Inc.', 'yahoo_search_symbol': 'AAPL',
+                                'exchange': 'NasdaqGS'}]
+
+
+@pytest.mark.asyncio
+async def test_directory_is_loaded_from_cache_with_json_codec(monkeypatch):
+    monkeypatch.setattr(Redis, 'codec', Codec())
+    monkeypatch.setattr(settings, 'stock_directory_file', None)
+    monkeypatch.setattr(SecuritiesDirectory, 'fetch_moex', staticmethod(lambda boards: SECURITIES))
+    await Redis().delete(SecuritiesDirectory.cache_key)
+    assert await SecuritiesDirectory.load() == 5
+    monkeypatch.setattr(SecuritiesDirectory, 'fetch_moex', staticmethod(lambda boards: []))
+    assert await SecuritiesDirectory.load() == 5
+    assert SecuritiesDirectory.search('SBERP')[0] == SECURITIES[3]
+    await Redis().delete(SecuritiesDirectory.cache_key)
+
+
+@pytest.mark.asyncio
+async def test_directory_is_reloaded_and_failed_load_is_retried(monkeypatch):
+    monkeypatch.setattr(settings, 'stock_directory_file', None)
+    monkeypatch.setattr(settings, 'stock_directory_reload_interval', 0.05)
+    monkeypatch.setattr(settings, 'stock_directory_retry_interval', 0.05)
+    monkeypatch.setattr(SecuritiesDirectory, '_index', SecuritiesIndex([]))
+    downloads = [RuntimeError('injected failure'), [], SECURITIES[:2], SECURITIES]
+
+    def fetch_moex(boards):
+        download = downloads.pop(0) if len(downloads) > 1 else downloads[0]
+        if isinstance(download, Exception):
+            raise download
+        return download
+
+    monkeypatch.setattr(SecuritiesDirectory, 'fetch_moex', staticmethod(fetch_moex))
+    await Redis().delete(SecuritiesDirectory.cache_key)
+    loading = asyncio.create_task(SecuritiesDirectory.run())
+    try:
+        for _ in range(40):
+            if SecuritiesDirectory.size():
+                break
+            await asyncio.sleep(0.05)
+        assert SecuritiesDirectory.size() == 2
+        # the directory is downloaded again once its cache expires
+        await Redis().delete(SecuritiesDirectory.cache_key)
+        for _ in range(40):
+            if SecuritiesDirectory.size() == 5:
+                break
+            await asyncio.sleep(0.05)
+        assert SecuritiesDirectory.search('SBERP')[0] == SECURITIES[3]
+    finally:
+        loading.cancel()
+        await asyncio.gather(loading, return_exceptions=True)
+        await Redis().delete(SecuritiesDirectory.cache_key)
@@ -0,0 +1,32 @@
+from collections import Counter
+
+from app.services.sharding import HashRing
+
+symbols = [f'TICK{i}.ME' for i in range(1000)]
+
+
+def test_ring_empty():
+    assert HashRing().get_node('MOEX.ME') is None
+
+
+def test_ring_stable_assignment():
+    ring = HashRing(['worker-1', 'worker-2', 'worker-3'])
+    same_ring = HashRing(['worker-3', 'worker-1', 'worker-2'])
+    assert [ring.get_node(s) for s in symbols] == [same_ring.get_node(s) for s in symbols]
+
+
+def test_ring_balance():
+    ring = HashRing(['worker-1', 'worker-2', 'worker-3', 'worker-4'])
+    load = Counter(ring.get_node(s) for s in symbols)
+    assert len(load) == 4
+    assert min(load.values()) > len(symbols) / 4 / 2
+
+
+def test_ring_minimal_movement_on_worker_leave():
+    ring = HashRing(['worker-1', 'worker-2', 'worker-3'])
+    before = {s: ring.get_node(s) for s in symbols}
+    ring.remove_node('worker-2')
+    after = {s: ring.get_node(s) for s in symbols}
+    moved = [s for s in symbols if before[s] != after[s]]
+    assert all(before[s] == 'worker-2' for s in moved)
+    assert 'worker-2' not in after.values()
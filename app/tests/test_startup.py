@@ -0,0 +1,29 @@
+import logging.config
+
+from app.benchmarks.cold_start import measure_import, parse_importtime
+from app.core import logging as app_logging
+
+
+def test_parse_importtime():
+    report = ('import time: self [us] | cumulative | imported package\n'
+              'import time:       120 |        120 |   yaml.error\n'
+              'import time:      3010 |       3130 | yaml\n')
+    assert parse_importtime(report) == {'yaml.error': (120, 120), 'yaml': (3010, 3130)}
+
+
+def test_api_import_does_not_load_bonds_stack():
+    modules = measure_import(['app.main'])['modules']
+    assert 'app.api.bonds' in modules
+    assert not {'pandas', 'apimoex', 'requests', 'app.services.bonds'} & set(modules)
+
+
+def test_logging_is_configured_once(monkeypatch, tmp_path):
+    path = tmp_path / 'logging.yaml'
+    path.write_text('version: 1\ndisable_existing_loggers: False\n')
+    calls = []
+    monkeypatch.setattr(app_logging, '_configured', False)
+    monkeypatch.setattr(app_logging, '_config', None)
+    monkeypatch.setattr(logging.config, 'dictConfig', calls.append)
+    config = app_logging.setup_logging(default_path=str(path))
+    assert app_logging.setup_logging(default_path=str(path)) is config
+    assert calls == [config]
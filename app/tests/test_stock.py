@@ -0,0 +1,213 @@
+import asyncio
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from app.core import settings
+from app.db.redis_pub import Redis
+from app.main import app
+from app.models.models import Amount, StockRq, ExchangeRs, FindStockRq, ExchangeSuffix
+from app.services.stock import StockService
+from app.tests.stubs import FakeYahooServer
+
+
+async def clear_symbol_cache(ticker: str):
+    await Redis().delete(StockService.get_exchanges_cache_key(ticker),
+                         *(StockService.get_unlisted_cache_key(ticker + suffix) for suffix in ExchangeSuffix),
+                         *(StockService.get_profile_cache_key(ticker + suffix) for suffix in ExchangeSuffix))
+
+
+async def start_yahoo(monkeypatch) -> FakeYahooServer:
+    server = await FakeYahooServer(price_path=lambda symbol, t: 171.73, known_symbols={'MOEX.ME'}).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', server.base_url)
+    await clear_symbol_cache('MOEX')
+    return server
+
+
+@pytest.mark.asyncio
+async def test_get_stock_price_from_fake_yahoo(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    amount = await StockService().get_stock_price(StockRq(ticker='MOEX',
+                                                          exchange=ExchangeRs(yahoo_search_symbol='MOEX.ME')))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert float(amount.value) == 171.73
+    assert amount.currency == 'RUB'
+    assert yahoo.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_find_stocks_skips_unknown_exchanges(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    stocks = await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert [s.exchange.yahoo_search_symbol for s in stocks] == ['MOEX.ME']
+    assert stocks[0].assetProfile.sector == 'Financial Services'
+    assert yahoo.requests == len(ExchangeSuffix)
+
+
+@pytest.mark.asyncio
+async def test_failed_probe_is_skipped(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    probe_exchange = StockService.probe_exchange
+
+    async def broken_probe(self, yahoo_symbol, not_found, profile=None):
+        if yahoo_symbol == 'MOEX.HK':
+            return Amount(value=None)  # price without `raw`
+        return await probe_exchange(self, yahoo_symbol, not_found, profile)
+
+    monkeypatch.setattr(StockService, 'probe_exchange', broken_probe)
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        response = await client.get('/stocks/MOEX')
+    await StockService.close_client()
+    await yahoo.stop()
+    assert response.status_code == 200
+    assert [stock['exchange']['yahoo_search_symbol'] for stock in response.json()] == ['MOEX.ME']
+    assert response.headers['cache-control'] == 'no-store'
+
+
+@pytest.mark.asyncio
+async def test_cancelled_lookup_cancels_its_probes(monkeypatch):
+    yahoo = await FakeYahooServer(latency=1.0, known_symbols={'MOEX.ME'}).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', yahoo.base_url)
+    await clear_symbol_cache('MOEX')
+    lookup = asyncio.create_task(StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX')))
+    await asyncio.sleep(0.1)
+    lookup.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await asyncio.wait_for(lookup, timeout=0.5)
+    await StockService.close_client()
+    await yahoo.stop()
+
+
+@pytest.mark.asyncio
+async def test_requests_share_keep_alive_connections(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    for _ in range(3):
+        await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert yahoo.requests == len(ExchangeSuffix) + 2
+    assert yahoo.connections <= len(ExchangeSuffix)
+
+
+@pytest.mark.asyncio
+async def test_repeat_lookup_probes_only_listed_exchanges(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    requests = yahoo.requests
+    stocks = await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert [s.exchange.yahoo_search_symbol for s in stocks] == ['MOEX.ME']
+    assert yahoo.requests - requests == 1
+
+
+@pytest.mark.asyncio
+async def test_repeat_lookup_reads_profile_from_cache(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    stocks = await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert stocks[0].assetProfile.sector == 'Financial Services'
+    assert yahoo.profile_requests == 1
+
+
+@pytest.mark.asyncio
+async def test_warm_up_profiles_requests_only_missing(monkeypatch):
+    yahoo = await start_yahoo(monkeypatch)
+    cached = await StockService().warm_up_profiles(['MOEX.ME', 'MOEX.HK'])
+    cached_again = await StockService().warm_up_profiles(['MOEX.ME'])
+    stocks = await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    await StockService.close_client()
+    await yahoo.stop()
+    assert (cached, cached_again) == (1, 0)
+    assert stocks[0].assetProfile.sector == 'Financial Services'
+    assert yahoo.profile_requests == 1
+
+
+class SlowExchangeYahoo(FakeYahooServer):
+    async def dispatch(self, method: str, target: str):
+        if '.HK' in target:
+            await asyncio.sleep(10)
+        return await super().dispatch(method, target)
+
+
+async def start_slow_yahoo(monkeypatch) -> FakeYahooServer:
+    server = await SlowExchangeYahoo(price_path=lambda symbol, t: 171.73, known_symbols={'MOEX.ME', 'MOEX.HK'}).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', server.base_url)
+    monkeypatch.setattr(settings, 'yahoo_lookup_budget', 0.5)
+    await clear_symbol_cache('MOEX')
+    return server
+
+
+@pytest.mark.asyncio
+async def test_find_stocks_cancels_slow_exchange_at_deadline(monkeypatch):
+    yahoo = await start_slow_yahoo(monkeypatch)
+    slow = StockService.probe_stats()['slow_by_exchange'].get('.HK', 0)
+    started = time.perf_counter()
+    stocks = await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'))
+    elapsed = time.perf_counter() - started
+    await StockService.close_client()
+    await yahoo.stop()
+    assert [s.exchange.yahoo_search_symbol for s in stocks] == ['MOEX.ME']
+    assert elapsed < 1
+    assert StockService.probe_stats()['slow_by_exchange']['.HK'] == slow + 1
+
+
+@pytest.mark.asyncio
+async def test_find_stocks_returns_first_hit(monkeypatch):
+    yahoo = await start_slow_yahoo(monkeypatch)
+    cancelled = StockService.probe_stats()['cancelled_after_hit']
+    started = time.perf_counter()
+    stocks = await StockService().find_stocks_by_ticker(FindStockRq(ticker='MOEX'), first_hit=True)
+    elapsed = time.perf_counter() - started
+    await StockService.close_client()
+    await yahoo.stop()
+    assert [s.exchange.yahoo_search_symbol for s in stocks] == ['MOEX.ME']
+    assert elapsed < 0.5
+    assert StockService.probe_stats()['cancelled_after_hit'] > cancelled
+
+
+@pytest.mark.asyncio
+async def test_quotes_from_price_cache_and_batches(monkeypatch):
+    yahoo = await FakeYahooServer(price_path=lambda symbol, t: 171.73).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', yahoo.base_url)
+    monkeypatch.setattr(settings, 'yahoo_quote_batch_size', 50)
+    symbols = [f'Q{i}.ME' for i in range(120)]
+    await Redis().delete(*(StockService.get_price_cache_key(symbol) for symbol in symbols),
+                         *(StockService.get_currency_cache_key(symbol) for symbol in symbols))
+    first = await StockService().get_quotes(symbols)
+    first_requests = yahoo.requests
+    cached = await StockService().get_quotes(symbols)
+    cached_requests = yahoo.requests - first_requests
+    monkeypatch.setattr(settings, 'stock_quote_max_age', 0)
+    batched = await StockService().get_quotes(symbols)
+    await StockService.close_client()
+    await yahoo.stop()
+    assert [quote.symbol for quote in batched] == symbols
+    for quotes in (first, cached, batched):
+        assert all(float(quote.price.value) == 171.73 and quote.price.currency_symbol == '₽' for quote in quotes)
+    assert (first_requests, cached_requests) == (len(symbols), 0)
+    assert yahoo.requests_by_path['/v7/finance/quote'] == 3
+
+
+@pytest.mark.asyncio
+async def test_invalid_symbols_are_not_sent_upstream(monkeypatch):
+    yahoo = await FakeYahooServer(price_path=lambda symbol, t: 171.73).start()
+    monkeypatch.setattr(settings, 'yahoo_base_url', yahoo.base_url)
+    await Redis().delete(StockService.get_price_cache_key('^GSPC'), StockService.get_currency_cache_key('^GSPC'))
+    async with AsyncClient(app=app, base_url='http://test') as client:
+        quotes = await client.get('/stocks/quotes', params={'symbols': ['AAPL', 'AAPL&x=y']})
+        traversal = await client.get('/stocks/quotes', params={'symbols': ['..']})
+        profiles = await client.post('/stocks/profiles', json={'symbols': ['MOEX.ME', 'MOEX/../x']})
+        index = await client.get('/stocks/quotes', params={'symbols': ['^GSPC']})
+    await StockService.close_client()
+    await yahoo.stop()
+    assert quotes.status_code == traversal.status_code == profiles.status_code == 422
+    assert index.status_code == 200
+    assert float(index.json()[0]['price']['value']) == 171.73
+    assert yahoo.requests_by_path == {'/v10/finance/quoteSummary': 1}
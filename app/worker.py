@@ -0,0 +1,74 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from app.core import settings
+from app.core.logging import setup_logging
+from app.db.history import PriceHistory
+from app.db.redis_pub import Redis
+from app.services.metrics import Metrics
+from app.services.notification_worker import NotificationWorker
+from app.services.stock import YahooApiService
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+async def serve():
+    worker = NotificationWorker()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    await Redis.init_pool()
+    await YahooApiService.open_client()
+    metrics_publishing = asyncio.create_task(Metrics.run()) if settings.metrics_enabled else None
+    try:
+        await worker.run()
+    finally:
+        if metrics_publishing:
+            metrics_publishing.cancel()
+        await YahooApiService.close_client()
+        await Redis.close_pool()
+        PriceHistory.close()
+
+
+def run_worker():
+    asyncio.run(serve())
+
+
+def main(processes: int):
+    """
+    Run notification workers. Add more processes (or nodes) to scale out
+    :param processes: number of worker processes
+    :return: None
+    """
+    if processes == 1:
+        run_worker()
+        return
+
+    workers = [multiprocessing.Process(target=run_worker, name=f'notification-worker-{i}')
+               for i in range(processes)]
+
+    def terminate(*args):
+        for p in workers:
+            p.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    for p in workers:
+        p.start()
+    try:
+        for p in workers:
+            p.join()
+    except KeyboardInterrupt:
+        terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='InvestAssistance notification workers')
+    parser.add_argument('-p', '--processes',
+                        type=int,
+                        default=settings.notification_worker_processes,
+                        help='number of worker processes')
+    main(parser.parse_args().processes)
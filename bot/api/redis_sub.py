@@ -1,11 +1,14 @@
+import asyncio
 import json
 import logging
-from typing import Optional
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
 
 import aioredis
 from aiogram import Bot
 from aiogram.utils.exceptions import TelegramAPIError
-from aioredis import RedisError
+from aioredis import RedisError, ReplyError
 from pydantic import ValidationError
 
 from bot.core import settings
@@ -16,25 +19,123 @@ from bot.telegram.utils import MarkdownMessageBuilder
 setup_logging()
 logger = logging.getLogger(__name__)
 
+Messages = List[Tuple[str, Dict[str, str]]]
+
 
 class RedisListener:
-    def __init__(self, host: str = settings.redis_host, port: int = settings.redis_port, db: int = 0):
+    """
+    Read notification events from Redis Stream as member of consumer group, so bot instances share the events. \n
+    Event is acknowledged after its message is sent. Events not acknowledged by this consumer are read again on start,
+    events pending longer than `redis_notification_claim_idle` seconds (consumer is stopped or sending failed)
+    are claimed and sent again, up to `redis_notification_max_deliveries` times
+    """
+
+    def __init__(self,
+                 host: str = settings.redis_host,
+                 port: int = settings.redis_port,
+                 db: int = 0,
+                 group: str = settings.redis_notification_group,
+                 consumer: Optional[str] = settings.redis_notification_consumer):
         self.redis_connection_string = f'redis://{host}:{port}/{db}'
+        self.group = group
+        self.consumer = consumer or socket.gethostname()
+        self.batch_size = settings.redis_notification_batch_size
+        self.claim_idle_ms = settings.redis_notification_claim_idle * 1000
+        self.pending_id = '0'
+        self.next_claim = 0.0
 
-    async def start(self, bot: Bot, queue: str = settings.redis_notification_queue):
+    async def start(self, bot: Bot, stream: str = settings.redis_notification_stream):
+        redis = await aioredis.create_redis(self.redis_connection_string, encoding='utf-8')
         try:
-            redis = await aioredis.create_redis(self.redis_connection_string, encoding='utf-8')
             while True:
-                row_message = await redis.blpop(queue)
-                logging.debug(f'Message received {json.loads(row_message[1])}')
-                typed_message = self.validate_message(message=json.loads(row_message[1]))
-                message_text = MarkdownMessageBuilder(row_message=typed_message).build_notification_message()
-                if message_text:
-                    await bot.send_message(chat_id=typed_message.chatId, text=message_text, parse_mode='Markdown')
-        except RedisError as redis_err:
-            logging.error(f'Redis error: {redis_err.args}')
+                try:
+                    await self.create_group(redis, stream)
+                    while True:
+                        for message_id, fields in await self.read(redis, stream):
+                            if await self.send(bot, fields.get('message')):
+                                await redis.xack(stream, self.group, message_id)
+                except RedisError as redis_err:
+                    if isinstance(redis_err, ReplyError) and str(redis_err).startswith('NOGROUP'):
+                        # stream is deleted or Redis is restarted without persistence, group is created again
+                        logging.warning(f'Consumer group {self.group} is lost: {redis_err.args}')
+                        self.pending_id = '0'
+                        continue
+                    logging.error(f'Redis error: {redis_err.args}')
+                    await asyncio.sleep(1)
+        finally:
+            redis.close()
+            await redis.wait_closed()
+
+    async def create_group(self, redis, stream: str):
+        try:
+            await redis.xgroup_create(stream, self.group, latest_id='0', mkstream=True)
+        except ReplyError as err:
+            if not str(err).startswith('BUSYGROUP'):
+                raise
+
+    async def read(self, redis, stream: str) -> Messages:
+        """
+        Read own pending events first, then claim stale events of the group, then wait for new events
+        """
+        if self.pending_id != '>':
+            messages = await self.read_group(redis, stream, self.pending_id, timeout=None)
+            if messages:
+                self.pending_id = messages[-1][0]
+                return messages
+            self.pending_id = '>'
+        if time.monotonic() >= self.next_claim:
+            self.next_claim = time.monotonic() + self.claim_idle_ms / 1000
+            messages = await self.claim(redis, stream)
+            if messages:
+                return messages
+        return await self.read_group(redis, stream, '>', timeout=min(5000, self.claim_idle_ms))
+
+    async def read_group(self, redis, stream: str, latest_id: str, timeout: Optional[int]) -> Messages:
+        messages = await redis.xread_group(self.group, self.consumer, [stream], timeout=timeout,
+                                           count=self.batch_size, latest_ids=[latest_id])
+        return [(message_id, fields) for _, message_id, fields in messages]
+
+    async def claim(self, redis, stream: str) -> Messages:
+        """
+        Claim events pending longer than claim idle time. Events delivered too many times
+        and events trimmed from the stream are acknowledged without sending
+        """
+        pending = await redis.xpending(stream, self.group, '-', '+', self.batch_size)
+        stale = [(message_id, deliveries) for message_id, _, idle, deliveries in pending
+                 if idle >= self.claim_idle_ms]
+        dropped = [message_id for message_id, deliveries in stale
+                   if deliveries >= settings.redis_notification_max_deliveries]
+        ids = [message_id for message_id, deliveries in stale if message_id not in dropped]
+        messages = await redis.xclaim(stream, self.group, self.consumer, self.claim_idle_ms, *ids) if ids else []
+        claimed = {message_id for message_id, _ in messages}
+        dropped += [message_id for message_id in ids if message_id not in claimed]
+        if dropped:
+            logging.error(f'Notification events are dropped after {settings.redis_notification_max_deliveries} '
+                          f'deliveries or trimmed: {dropped}')
+            await redis.xack(stream, self.group, *dropped)
+        if messages:
+            logging.info(f'Claimed {len(messages)} pending notification events')
+        return messages
+
+    async def send(self, bot: Bot, row_message: Optional[str]) -> bool:
+        """
+        :return: True if event is handled and can be acknowledged
+        """
+        try:
+            logging.debug(f'Message received {row_message}')
+            typed_message = self.validate_message(message=json.loads(row_message))
+            if not typed_message:
+                return True
+            message_text = MarkdownMessageBuilder(row_message=typed_message).build_notification_message()
+            if message_text:
+                await bot.send_message(chat_id=typed_message.chatId, text=message_text, parse_mode='Markdown')
+            return True
+        except (TypeError, ValueError) as err:
+            logging.error(f'Invalid message {row_message}: {err.args}')
+            return True
         except TelegramAPIError as tg_err:
             logging.error(f'Aiogram error: {tg_err.args}')
+            return False
 
     @classmethod
     def validate_message(cls, message) -> Optional[StockPriceNotificationReadRs]:
@@ -7,7 +7,7 @@ from pydantic import ValidationError
 
 from bot.api.base import ApiRequest
 from bot.core.logging import setup_logging
-from bot.models.models import StockRs
+from bot.models.models import StockRs, SecurityRs
 
 setup_logging()
 logger = logging.getLogger(__name__)
@@ -37,3 +37,18 @@ class StockService(ApiRequest):
                 return stock_list
         except httpx.HTTPError as exc:
             logging.error(f'Error from "find_stock_by_ticker": {exc}')
+
+    async def search(self, query: str, limit: int = 5) -> List[SecurityRs]:
+        """
+        Find securities by ticker or name prefix and tickers with a typo in the local directory \n
+        :return: model: List[SecurityRs], empty if search failed
+        """
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(self.url + 'search', params={'q': query, 'limit': limit},
+                                            headers=self.headers)
+                response.raise_for_status()
+                return [SecurityRs(**item) for item in response.json()]
+        except (httpx.HTTPError, ValidationError, TypeError) as exc:
+            logging.error(f'Error from "search": {exc}')
+            return []
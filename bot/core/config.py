@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseSettings
 
 
@@ -9,4 +11,9 @@ class Settings(BaseSettings):
     time_out: int = 5
     redis_host: str = '127.0.0.1'
     redis_port: int = 6379
-    redis_notification_queue: str = 'notification:stock:price:received'
+    redis_notification_stream: str = 'notification:stock:price:events'
+    redis_notification_group: str = 'bot'
+    redis_notification_consumer: Optional[str] = None
+    redis_notification_batch_size: int = 10
+    redis_notification_claim_idle: int = 60
+    redis_notification_max_deliveries: int = 5
@@ -42,7 +42,7 @@ async def main():
 
     try:
         await asyncio.gather(dp.start_polling(),
-                             notify_listener.start(bot=bot, queue=settings.redis_notification_queue))
+                             notify_listener.start(bot=bot, stream=settings.redis_notification_stream))
     finally:
         await dp.storage.close()
         await dp.storage.wait_closed()
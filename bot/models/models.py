@@ -83,6 +83,13 @@ class StockRs(StockRq):
     assetProfile: Optional[AssetProfile] = None
 
 
+class SecurityRs(BaseModel):
+    ticker: str
+    name: str
+    yahoo_search_symbol: str
+    exchange: str
+
+
 class StockPriceNotificationCreateRq(StockRq):
     targetPrice: float = Field(...,
                                gt=0,
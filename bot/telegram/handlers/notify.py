@@ -74,12 +74,32 @@ async def notify_waiting_for_ticker(message: types.Message, state: FSMContext):
             await message.answer(full_message(2, msg_body), parse_mode="Markdown",
                                  reply_markup=approve_keyboard)
         else:
-            await message.reply(f'По тикеру {message.text} ничего не найдено. Пожалуйста, поверьте привильность тикера.')
+            await message.reply(f'По тикеру {message.text} ничего не найдено. Пожалуйста, поверьте привильность тикера.'
+                                + await suggestions(message.text))
     except HTTPStatusError as err:
         logger.error(f'Error trying to find stock with: {err.response.status_code}')
         await message.reply(f'Ошибка при поиске по тикеру {message.text}. Пожалуйста, попробуйте позднее.')
 
 
+async def suggestions(query: str) -> str:
+    """
+    Tickers similar to the query from the securities directory
+    """
+    found = await StockService().search(query)
+    if not found:
+        return ''
+    return '\nВозможно, вы имели в виду: ' + ', '.join(f'{security.ticker} ({security.name})' for security in found)
+
+
+async def notify_ticker_not_valid(message: types.Message):
+    logging.debug(f'Log from {notify_ticker_not_valid} {message.text}')
+    found = await StockService().search(message.text)
+    msg_body = "Введите TICKER акции латиницей, до 5 символов (" + MarkdownFormatter.italic("например, SBER") + ")."
+    if found:
+        msg_body += "\nВозможно, вы имели в виду: " + ", ".join(security.ticker for security in found)
+    await message.reply(full_message(1, msg_body), parse_mode="Markdown")
+
+
 async def notify_waiting_for_approve_stock(callback_query: types.CallbackQuery, state: FSMContext):
     logger.debug(f'Log from notify_waiting_for_approve_stock: {callback_query.data}')
     if callback_query.data == "Нет":
@@ -194,6 +214,8 @@ def register_handlers_notify(dp: Dispatcher):
     dp.register_message_handler(notify_waiting_for_ticker, state=OrderNotification.waiting_for_ticker,
                                 content_types=types.ContentTypes.TEXT,
                                 regexp='^[a-zA-Z]{1,5}$')
+    dp.register_message_handler(notify_ticker_not_valid, state=OrderNotification.waiting_for_ticker,
+                                content_types=types.ContentTypes.TEXT)
     dp.register_callback_query_handler(notify_waiting_for_approve_stock,
                                        lambda c: c.data and c.data in [i for i in approve_options],
                                        state=OrderNotification.waiting_for_approve_stock